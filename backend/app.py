@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import mimetypes
 from flask import (
     Flask,
     render_template,
@@ -10,12 +12,17 @@ from flask import (
     flash,
     jsonify,
     send_from_directory,
+    send_file,
+    Response,
+    abort,
 )
+from markupsafe import Markup, escape
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from redis import Redis
 from redis.exceptions import RedisError
 from flask_wtf import CSRFProtect
+from werkzeug.utils import secure_filename
 from passlib.hash import argon2
 from dotenv import load_dotenv
 from functools import wraps
@@ -24,7 +31,6 @@ load_dotenv()
 
 from backend.utils import (
     allowed_file,
-    save_file,
     get_file_size,
     generate_prompt,
     generate_job_id,
@@ -32,29 +38,58 @@ from backend.utils import (
     call_openai_json,
     enhance_tank_conditions,
     convert_markdown,
+    MarkdownStreamRenderer,
     UPLOAD_FOLDER,
     MODEL,
     MAX_FILE_SIZE_MB,
-    get_db,
+    llm_stats,
 )
 from backend.bdr_extractor import (
     BDR_PROMPT,
+    BDR_CROP_TOP_FRACTION,
     extract_bdr,
     merge_bdr_json,
     _extract_json,
     call_openai_bdr_json,
+    bdr_markdown_to_json,
+    bdr_missing_fields,
 )
+from backend.tank_extractor import markdown_to_tank_report
 from backend.models import (
     init_db,
+    create_job,
+    job_exists,
+    list_jobs,
+    search_requests,
+    aggregate_facts,
+    MATCH_START,
+    MATCH_END,
     log_request,
+    get_request_statuses,
+    get_requests,
+    get_request,
+    update_request,
+    save_edits,
+    field_digest,
+    StaleEditError,
+    EDITABLE_FIELDS,
     get_job_name,
     set_job_name,
     add_attachment,
     get_attachments,
+    bdr_image_path,
 )
-from pathlib import Path
-from backend.cleanup import purge_old_uploads
+from backend import cleanup as retention
+from backend.export import export_chunks, MIMETYPES
+from backend.archive import archive_chunks
+from backend.variants import upload_max_edge
+from backend.cache import get_result_cache
+from backend.ratelimit import limiter as llm_limiter
+from backend.db import pool as db_pool
+from backend.blobs import save_file, upload_path, lookup, blob_path, stats as blob_stats
+from backend.hedge import latencies as vision_latencies
 from backend import worker
+from backend.worker import vision_pipeline, structured_pipeline
 
 APP_PASSWORD = os.getenv('APP_PASSWORD')
 if not APP_PASSWORD:
@@ -62,6 +97,23 @@ if not APP_PASSWORD:
 PASS_HASH = argon2.hash(APP_PASSWORD)
 RATE_LIMIT_PER_HOUR = int(os.getenv('RATE_LIMIT_PER_HOUR', 50))
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+# Seconds between database polls while streaming job progress over SSE.
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', 0.5))
+SSE_KEEPALIVE_SECONDS = 15
+# A job event stream ends with a ``timeout`` event after this many seconds,
+# or this many without any row changing, and the page falls back to polling.
+SSE_MAX_SECONDS = float(os.getenv('SSE_MAX_SECONDS', 600))
+SSE_IDLE_SECONDS = float(os.getenv('SSE_IDLE_SECONDS', 120))
+# ``local`` parses BDR tables without the model when all required fields are
+# found; ``llm`` always asks the model.
+BDR_JSON_MODE = os.getenv('BDR_JSON_MODE', 'local').lower()
+# Whole-request limit; uploads are sent at full resolution and resized on the
+# server according to the image policy, so a batch can be several photos.
+MAX_REQUEST_SIZE_MB = int(os.getenv('MAX_REQUEST_SIZE_MB', 64))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+FACTS_MAX_ROWS = 10000
 
 if REDIS_URL.startswith(('redis://', 'rediss://', 'unix://')):
     try:
@@ -73,7 +125,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.join(BASE_DIR, "..", "frontend")
 app = Flask(__name__, template_folder=FRONTEND_DIR, static_folder=FRONTEND_DIR)
 app.secret_key = os.getenv('SECRET_KEY', os.urandom(24))
-app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE_MB * 1024 * 1024
 app.config['SESSION_COOKIE_SECURE'] = (
     os.getenv('SESSION_COOKIE_SECURE', 'True').lower() == 'true'
 )
@@ -87,7 +139,7 @@ limiter = Limiter(
 limiter.init_app(app)
 
 init_db()
-purge_old_uploads()
+retention.start()
 
 
 def login_required(func):
@@ -101,17 +153,105 @@ def login_required(func):
     return wrapper
 
 
-def job_db_path(job_id: str) -> str:
-    """Return the SQLite path for the given job."""
-    return os.path.join(UPLOAD_FOLDER, f"{job_id}.db")
+def _pipeline_mode() -> str:
+    """Return the extraction mode chosen on the upload form."""
+    mode = request.form.get('mode') or worker.PIPELINE_MODE
+    if mode not in worker.PIPELINE_MODES:
+        mode = worker.PIPELINE_MODE
+    session['mode'] = mode
+    return mode
+
+
+def _accepted_uploads(files):
+    """Save valid uploads.
+
+    Returns a list of ``(new_name, path)`` tuples for saved files and a list of
+    messages describing rejected ones.
+    """
+    saved = []
+    rejected = []
+    for file in files:
+        if file and allowed_file(file.filename):
+            if get_file_size(file) > MAX_FILE_SIZE_MB * 1024 * 1024:
+                rejected.append(f"{file.filename} exceeds size limit")
+                continue
+            file.seek(0)
+            saved.append(save_file(file))
+        else:
+            rejected.append(f"Invalid file: {file.filename}")
+    return saved, rejected
+
+
+def _status_payload(row: dict) -> dict:
+    """Return the JSON representation of a request row's progress."""
+    payload = {
+        'id': row['id'],
+        'filename': row['filename'],
+        'status': row['status'],
+    }
+    if row['status'] in ('done', 'error'):
+        payload['prompt'] = row['prompt']
+        payload['output'] = row['output'] or ''
+        payload['html'] = convert_markdown(row['output'] or '')
+    return payload
+
+
+def _changed_fields(form) -> list[tuple[int, int, dict]]:
+    """Return ``(req_id, version, {field: value})`` for the rows of a job
+    edit form, keeping only fields whose digest differs from the one the
+    page was rendered with."""
+    edits = []
+    for key in form:
+        if not key.startswith('version_'):
+            continue
+        suffix = key[len('version_'):]
+        version = form.get(key, type=int)
+        if not suffix.isdigit() or version is None:
+            continue
+        req_id = int(suffix)
+        fields = {}
+        for field in EDITABLE_FIELDS:
+            value = form.get(f'{field}_{req_id}')
+            if value is not None and field_digest(value) != form.get(f'{field}_digest_{req_id}'):
+                fields[field] = value.replace('\r\n', '\n')
+        edits.append((req_id, version, fields))
+    return edits
+
+
+def _history_page():
+    """Return the history page selected by the ``limit``/``before`` args."""
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    before = request.args.get('before', type=int)
+    return list_jobs(max(1, min(limit, HISTORY_MAX_PAGE_SIZE)), before)
+
+
+def _arg_list(name: str) -> list[str]:
+    """Return the comma separated values of query argument ``name``."""
+    return [v.strip() for v in request.args.get(name, '').split(',') if v.strip()]
+
+
+def _search_page():
+    """Return ``(query, page, results, has_more)`` for the ``q``/``page`` args.
+
+    Each result gets a ``highlight``: its escaped snippet with the matched
+    terms in ``<mark>`` tags.
+    """
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    results, has_more = search_requests(
+        query, SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE
+    )
+    for r in results:
+        r['highlight'] = (
+            escape(r.pop('snippet') or '')
+            .replace(MATCH_START, Markup('<mark>'))
+            .replace(MATCH_END, Markup('</mark>'))
+        )
+    return query, page, results, has_more
 
 
-def vision_pipeline(image_path: str, model: str | None = None):
-    if model is None:
-        model = MODEL
-    prompt = generate_prompt()
-    md = call_openai(image_path, prompt, os.path.basename(image_path), model)
-    return prompt, md
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -137,44 +277,210 @@ def upload():
         files = request.files.getlist('files')
         model = request.form.get('model') or MODEL
         session['model'] = model
+        mode = _pipeline_mode()
         results = []
         job_id = generate_job_id()
-        job_path = job_db_path(job_id)
-        init_db(job_path)
-        for file in files:
-            if file and allowed_file(file.filename):
-                if get_file_size(file) > MAX_FILE_SIZE_MB * 1024 * 1024:
-                    flash(f"{file.filename} exceeds size limit")
-                    continue
-                file.seek(0)
-                new_name, path = save_file(file)
-                fut = worker.run_async(vision_pipeline, path, model)
-                try:
-                    prompt, output_text = fut.result()
-                except Exception as e:
-                    prompt, output_text = generate_prompt(), str(e)
-                log_request(
-                    new_name,
-                    request.remote_addr,
-                    prompt,
-                    output_text,
-                    db_path=job_path,
-                )
-                html_output = convert_markdown(output_text)
-                results.append(
-                    {
-                        'filename': new_name,
-                        'output': output_text,
-                        'html': html_output,
-                        'job_id': job_id,
-                        'prompt': prompt,
-                    }
-                )
+        create_job(job_id)
+        saved, rejected = _accepted_uploads(files)
+        for message in rejected:
+            flash(message)
+        # Submit every image up front so the batch takes roughly as long as
+        # the slowest extraction rather than the sum of all of them.
+        metrics = [{} for _ in saved]
+        if mode == 'structured':
+            func, args = structured_pipeline, [
+                (path, model, m) for (_, path), m in zip(saved, metrics)
+            ]
+        else:
+            func, args = vision_pipeline, [
+                (path, model, None, m) for (_, path), m in zip(saved, metrics)
+            ]
+        outcomes = worker.run_batch(
+            func, args, max_in_flight=worker.UPLOAD_CONCURRENCY
+        )
+        for (new_name, _), outcome, call_metrics in zip(saved, outcomes, metrics):
+            json_text = ''
+            if isinstance(outcome, Exception):
+                prompt, output_text = generate_prompt(), str(outcome)
+            elif mode == 'structured':
+                prompt, output_text, json_text = outcome
             else:
-                flash(f"Invalid file: {file.filename}")
+                prompt, output_text = outcome
+            log_request(
+                job_id,
+                new_name,
+                request.remote_addr,
+                prompt,
+                output_text,
+                json_text=json_text,
+                metrics=call_metrics,
+            )
+            html_output = convert_markdown(output_text)
+            results.append(
+                {
+                    'filename': new_name,
+                    'output': output_text,
+                    'html': html_output,
+                    'job_id': job_id,
+                    'prompt': prompt,
+                }
+            )
         return render_template('result.html', results=results, model=model)
     model = session.get('model', MODEL)
-    return render_template('upload.html', model=model)
+    mode = session.get('mode', worker.PIPELINE_MODE)
+    return render_template(
+        'upload.html',
+        model=model,
+        mode=mode,
+        max_file_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+        max_edge=upload_max_edge(),
+    )
+
+
+@app.route('/submit', methods=['POST'])
+@limiter.limit(f"{RATE_LIMIT_PER_HOUR}/hour")
+def submit():
+    """Save the uploaded files, queue extraction and return the job id."""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files part'}), 400
+    model = request.form.get('model') or MODEL
+    session['model'] = model
+    mode = _pipeline_mode()
+    saved, rejected = _accepted_uploads(files)
+    if not saved:
+        return jsonify({'error': 'No valid files', 'rejected': rejected}), 400
+    job_id = generate_job_id()
+    create_job(job_id)
+    prompt = generate_prompt()
+    tasks = []
+    for new_name, _ in saved:
+        req_id = log_request(
+            job_id,
+            new_name,
+            request.remote_addr,
+            prompt,
+            '',
+            status='pending',
+        )
+        tasks.append(
+            {
+                'job_id': job_id,
+                'req_id': req_id,
+                'filename': new_name,
+                'model': model,
+                'mode': mode,
+            }
+        )
+    worker.dispatch(tasks, max_in_flight=worker.UPLOAD_CONCURRENCY)
+    return (
+        jsonify(
+            {
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id),
+                'events_url': url_for('job_events', job_id=job_id),
+                'results_url': url_for('job_results', job_id=job_id),
+                'rejected': rejected,
+            }
+        ),
+        202,
+    )
+
+
+@app.route('/job/<job_id>/status')
+def job_status(job_id):
+    """Return per-file processing status for a job."""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not job_exists(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    rows = [_status_payload(r) for r in get_request_statuses(job_id)]
+    done = sum(1 for r in rows if r['status'] in ('done', 'error'))
+    return jsonify({'job_id': job_id, 'total': len(rows), 'done': done, 'rows': rows})
+
+
+@app.route('/job/<job_id>/events')
+def job_events(job_id):
+    """Stream row updates for a job as server-sent events until it finishes.
+
+    Streams of jobs whose rows stop changing, e.g. after a worker crash, end
+    with a ``timeout`` event instead of holding a thread forever.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not job_exists(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+
+    def stream():
+        seen = {}
+        partial_seen = {}
+        renderers = {}
+        started = last_sent = last_change = time.monotonic()
+        while True:
+            rows = get_request_statuses(job_id)
+            changed = [r for r in rows if seen.get(r['id']) != r['status']]
+            for r in changed:
+                seen[r['id']] = r['status']
+                yield _sse('row', _status_payload(r))
+            for r in rows:
+                # Streamed output written by the worker while still running
+                output = r['output'] or ''
+                if r['status'] != 'running' or partial_seen.get(r['id']) == output:
+                    continue
+                partial_seen[r['id']] = output
+                renderer = renderers.setdefault(r['id'], MarkdownStreamRenderer())
+                yield _sse(
+                    'partial',
+                    {'id': r['id'], 'output': output, 'html': renderer.render(output)},
+                )
+                last_sent = last_change = time.monotonic()
+            done = sum(1 for r in rows if r['status'] in ('done', 'error'))
+            if changed:
+                yield _sse('progress', {'done': done, 'total': len(rows)})
+                last_sent = last_change = time.monotonic()
+            if done == len(rows):
+                yield _sse('done', {'done': done, 'total': len(rows)})
+                return
+            now = time.monotonic()
+            if now - last_change > SSE_IDLE_SECONDS or now - started > SSE_MAX_SECONDS:
+                yield _sse('timeout', {'done': done, 'total': len(rows)})
+                return
+            if time.monotonic() - last_sent > SSE_KEEPALIVE_SECONDS:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/results/<job_id>')
+@login_required
+def job_results(job_id):
+    """Render the results page for a job; pending rows fill in over SSE."""
+    if not job_exists(job_id):
+        return render_template('error.html', message='Job not found'), 404
+    results = []
+    for row in get_request_statuses(job_id):
+        finished = row['status'] in ('done', 'error')
+        results.append(
+            {
+                'id': row['id'],
+                'filename': row['filename'],
+                'status': row['status'],
+                'output': row['output'] if finished else '',
+                'html': convert_markdown(row['output'] or '') if finished else '',
+                'job_id': job_id,
+                'prompt': row['prompt'],
+            }
+        )
+    model = session.get('model', MODEL)
+    return render_template('result.html', results=results, model=model, job_id=job_id)
 
 
 @app.route('/retry/<filename>', methods=['POST'])
@@ -184,20 +490,23 @@ def retry(filename):
     prompt = request.form.get('prompt', generate_prompt())
     model = request.form.get('model') or session.get('model', MODEL)
     session['model'] = model
-    path = os.path.join(UPLOAD_FOLDER, filename)
+    path = upload_path(filename)
+    use_cache = not request.form.get('bypass_cache')
+    metrics = {}
     try:
-        output_text = call_openai(path, prompt, filename, model)
+        output_text = call_openai(
+            path, prompt, filename, model, use_cache=use_cache, metrics=metrics
+        )
     except Exception as e:
         output_text = str(e)
     job_id = generate_job_id()
-    job_path = job_db_path(job_id)
-    init_db(job_path)
     log_request(
+        job_id,
         filename,
         request.remote_addr,
         prompt,
         output_text,
-        db_path=job_path,
+        metrics=metrics,
     )
     html_output = convert_markdown(output_text)
     result = {
@@ -219,43 +528,144 @@ def to_json():
     markdown_tables = data.get('markdown', '')
     model = session.get('model', MODEL)
     try:
-        json_text = call_openai_json(markdown_tables, model)
+        # The tables follow fixed headers, so parse them locally and only ask
+        # the model when they don't match.
+        try:
+            json_text = json.dumps(markdown_to_tank_report(markdown_tables))
+            source = 'local'
+        except ValueError:
+            json_text = call_openai_json(markdown_tables, model)
+            source = 'llm'
         json_text = enhance_tank_conditions(json_text)
         json_obj = json.loads(json_text)
         json_text = json.dumps(json_obj, indent=2)
     except Exception as e:
         json_text = str(e)
-    return jsonify({'json': json_text})
+        source = 'error'
+    return jsonify({'json': json_text, 'source': source})
 
 
 @app.route('/history')
 @login_required
 def history():
-    job_files = sorted(Path(UPLOAD_FOLDER).glob('*.db'), key=lambda p: p.stat().st_mtime, reverse=True)
-    jobs = []
-    for f in job_files:
-        # Older job databases may predate the ``jobmeta`` table. ``init_db``
-        # upgrades the schema in-place so querying ``jobmeta`` doesn't fail.
-        init_db(str(f))
-        with get_db(str(f)) as conn:
-            row = conn.execute(
-                "SELECT filename, timestamp, ip FROM requests ORDER BY id DESC LIMIT 1"
-            ).fetchone()
-            name_row = conn.execute("SELECT name FROM jobmeta").fetchone()
-        if row:
-            jobs.append({'job_id': f.stem, 'filename': row[0], 'timestamp': row[1], 'ip': row[2], 'job_name': name_row[0] if name_row else ''})
-    return render_template('history.html', jobs=jobs)
+    jobs, cursor = _history_page()
+    return render_template('history.html', jobs=jobs, cursor=cursor)
+
+
+@app.route('/history/jobs')
+def history_jobs():
+    """Return one page of the job history as JSON.
+
+    ``limit`` sets the page size and ``before`` takes the ``next`` cursor of
+    the previous page.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    jobs, cursor = _history_page()
+    return jsonify({'jobs': jobs, 'next': cursor})
+
+
+@app.route('/search')
+@login_required
+def search():
+    query, page, results, has_more = _search_page()
+    return render_template(
+        'search.html', query=query, page=page, results=results, has_more=has_more
+    )
+
+
+@app.route('/search/requests')
+def search_results():
+    """Return one page of ranked search results as JSON.
+
+    ``q`` is the query and ``page`` counts from 1; ``highlight`` is HTML.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    query, page, results, has_more = _search_page()
+    for r in results:
+        r['highlight'] = str(r['highlight'])
+    return jsonify({'query': query, 'page': page, 'results': results, 'more': has_more})
+
+
+@app.route('/facts/<fact>')
+def facts_aggregate(fact):
+    """Aggregate a fact table as JSON.
+
+    ``group`` lists dimensions (e.g. ``product,month``), ``measure`` lists
+    ``<sum|avg|min|max|count>:<column>`` totals, ``from``/``to`` bound the
+    day and ``job_id`` limits the rows to one job.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    limit = request.args.get('limit', 1000, type=int)
+    try:
+        rows = aggregate_facts(
+            fact,
+            _arg_list('group'),
+            _arg_list('measure'),
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            job_id=request.args.get('job_id'),
+            limit=max(1, min(limit, FACTS_MAX_ROWS)),
+        )
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query', 'message': str(e)}), 400
+    return jsonify({'rows': rows})
+
+
+@app.route('/export')
+@login_required
+def export():
+    """Stream request rows as CSV, NDJSON or Parquet.
+
+    ``format`` picks the format, ``job_id`` takes a comma separated list of
+    jobs, ``from``/``to`` bound the request timestamp and ``after`` resumes
+    after the ``id`` of the last row received.
+    """
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = export_chunks(
+            fmt,
+            job_ids=_arg_list('job_id'),
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            after=request.args.get('after', 0, type=int),
+            limit=request.args.get('limit', type=int),
+        )
+    except ValueError as e:
+        return jsonify({'error': 'Invalid export', 'message': str(e)}), 400
+    return Response(
+        chunks,
+        mimetype=MIMETYPES[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="requests.{fmt}"',
+            'X-Accel-Buffering': 'no',
+        },
+    )
+
+
+@app.route('/job/<job_id>/archive')
+@login_required
+def job_archive(job_id):
+    """Stream a ZIP of the job's images, attachments and results."""
+    if not job_exists(job_id):
+        return render_template("error.html", message="Job not found"), 404
+    filename = secure_filename(job_id) or 'job'
+    return Response(
+        archive_chunks(job_id),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}.zip"',
+            'X-Accel-Buffering': 'no',
+        },
+    )
 
 
 @app.route('/delete_job/<job_id>', methods=['POST'])
 @login_required
 def delete_job(job_id):
-    db_path = job_db_path(job_id)
-    if os.path.exists(db_path):
-        try:
-            os.remove(db_path)
-        except OSError:
-            pass
+    retention.purge_job(job_id)
     flash('Job deleted')
     return redirect(url_for('history'))
 
@@ -263,8 +673,7 @@ def delete_job(job_id):
 @app.route('/job/<job_id>', methods=['GET', 'POST'])
 @login_required
 def job_detail(job_id):
-    db_path = job_db_path(job_id)
-    if not os.path.exists(db_path):
+    if not job_exists(job_id):
         return (
             render_template(
                 "error.html",
@@ -272,67 +681,41 @@ def job_detail(job_id):
             ),
             404,
         )
-    # Ensure database schema is up to date (older jobs may lack the ``json``
-    # column).  ``init_db`` will create the table if needed and add the column
-    # when missing.
-    init_db(db_path)
 
     if request.method == 'POST':
         file = request.files.get('attachment')
         if file and file.filename:
             new_name, _ = save_file(file)
-            add_attachment(new_name, db_path=db_path)
+            add_attachment(job_id, new_name)
             flash('Attachment uploaded')
             return redirect(url_for('job_detail', job_id=job_id))
 
-        new_name = request.form.get('job_name', '')
-        set_job_name(new_name, db_path=db_path)
-        with get_db(db_path) as conn:
-            rows = conn.execute("SELECT id FROM requests").fetchall()
-            for r in rows:
-                pid = r[0]
-                prompt_val = request.form.get(f'prompt_{pid}', '')
-                output_val = request.form.get(f'output_{pid}', '')
-                json_val = request.form.get(f'json_{pid}', '')
-                bdr_json_val = request.form.get(f'bdr_json_{pid}', '')
-                bdr_md_val = request.form.get(f'bdr_md_{pid}', '')
-                conn.execute(
-                    "UPDATE requests SET prompt=?, output=?, json=?, bdr_json=?, bdr_md=? WHERE id=?",
-                    (
-                        prompt_val,
-                        output_val,
-                        json_val,
-                        bdr_json_val,
-                        bdr_md_val,
-                        pid,
-                    ),
-                )
+        new_name = request.form.get('job_name')
+        if new_name is not None and new_name != get_job_name(job_id):
+            set_job_name(job_id, new_name)
+        try:
+            save_edits(job_id, _changed_fields(request.form))
+        except StaleEditError as e:
+            flash(
+                f"Not saved: {e}. Another edit or a running extraction changed "
+                "them; reload the page and try again."
+            )
+            return redirect(url_for('job_detail', job_id=job_id))
         flash('Job updated')
         return redirect(url_for('job_detail', job_id=job_id))
-    with get_db(db_path) as conn:
-        rows = conn.execute(
-            "SELECT id, filename, prompt, output, json, bdr_json, bdr_md FROM requests ORDER BY id"
-        ).fetchall()
-    job_name = get_job_name(db_path)
-    rows = [
-        {
-            'id': r[0],
-            'filename': r[1],
-            'prompt': r[2],
-            'output': r[3],
-            'json': r[4],
-            'bdr_json': r[5],
-            'bdr_md': r[6],
-        }
-        for r in rows
-    ]
-    attachments = get_attachments(db_path)
+    rows = get_requests(job_id)
+    for r in rows:
+        r['digests'] = {f: field_digest(r[f]) for f in EDITABLE_FIELDS}
+    job_name = get_job_name(job_id)
+    attachments = get_attachments(job_id)
+    processing = any(r['status'] in ('pending', 'running') for r in rows)
     return render_template(
         'job_detail.html',
         job_id=job_id,
         rows=rows,
         job_name=job_name,
         attachments=attachments,
+        processing=processing,
     )
 
 
@@ -348,12 +731,10 @@ def update_json(job_id, req_id):
     except json.JSONDecodeError as e:
         return jsonify({'error': 'Invalid JSON', 'message': str(e)}), 400
 
-    db_path = job_db_path(job_id)
-    if not os.path.exists(db_path):
+    if not job_exists(job_id):
         return jsonify({'error': 'Job not found'}), 404
-    init_db(db_path)
-    with get_db(db_path) as conn:
-        conn.execute('UPDATE requests SET json=? WHERE id=?', (json_text, req_id))
+    if not update_request(job_id, req_id, json=json_text):
+        return jsonify({'error': 'Request not found'}), 404
     return jsonify({'status': 'ok'})
 
 
@@ -363,44 +744,27 @@ def extract_bdr_route(job_id, req_id):
     if not session.get('logged_in'):
         return jsonify({'error': 'Unauthorized'}), 401
 
-    db_path = job_db_path(job_id)
-    if not os.path.exists(db_path):
+    if not job_exists(job_id):
         return jsonify({'error': 'Job not found'}), 404
 
-    init_db(db_path)
-    with get_db(db_path) as conn:
-        row = conn.execute(
-            'SELECT filename FROM requests WHERE id=?', (req_id,)
-        ).fetchone()
+    row = get_request(job_id, req_id)
     if not row:
         return jsonify({'error': 'Request not found'}), 404
 
-    filename = row[0]
     model = session.get('model', MODEL)
-    image_path = os.path.join(UPLOAD_FOLDER, filename)
-    attachments = get_attachments(db_path)
-    if attachments:
-        # Use the most recent attachment when extracting BDR tables
-        att_path = os.path.join(UPLOAD_FOLDER, attachments[-1]["filename"])
-        if os.path.exists(att_path):
-            image_path = att_path
-            filename = attachments[-1]["filename"]
+    image_path = bdr_image_path(job_id, row['filename'])
     try:
         output_text = call_openai(
             image_path,
             BDR_PROMPT,
-            filename,
+            os.path.basename(image_path),
             model,
-            crop_top_fraction=0.40,
+            crop_top_fraction=BDR_CROP_TOP_FRACTION,
         )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     html_output = convert_markdown(output_text)
-    with get_db(db_path) as conn:
-        conn.execute(
-            'UPDATE requests SET bdr_md=? WHERE id=?',
-            (output_text, req_id),
-        )
+    update_request(job_id, req_id, bdr_md=output_text)
     return jsonify({'bdr_md': output_text, 'html': html_output})
 
 
@@ -416,30 +780,76 @@ def bdr_json_route(job_id, req_id):
         return jsonify({'error': 'No markdown supplied'}), 400
 
     model = session.get('model', MODEL)
+    source, confidence = 'llm', None
     try:
-        json_text = call_openai_bdr_json(markdown_tables, model)
-        json_obj = json.loads(json_text)
+        if BDR_JSON_MODE == 'local':
+            json_obj, confidence = bdr_markdown_to_json(markdown_tables)
+            if not bdr_missing_fields(json_obj):
+                source = 'local'
+        if source == 'llm':
+            json_obj = json.loads(call_openai_bdr_json(markdown_tables, model))
         json_text = json.dumps(json_obj, indent=2)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-    db_path = job_db_path(job_id)
-    if not os.path.exists(db_path):
+    if not job_exists(job_id):
         return jsonify({'error': 'Job not found'}), 404
-    init_db(db_path)
-    with get_db(db_path) as conn:
-        conn.execute(
-            'UPDATE requests SET bdr_json=? WHERE id=?',
-            (json_text, req_id),
-        )
-    return jsonify({'bdr_json': json_text})
+    update_request(job_id, req_id, bdr_json=json_text)
+    return jsonify(
+        {'bdr_json': json_text, 'source': source, 'confidence': confidence}
+    )
+
+
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    """Return hit/miss counters for the vision result cache."""
+    cache = get_result_cache()
+    if cache is None:
+        return jsonify({'backend': 'off'})
+    return jsonify(cache.stats())
+
+
+@app.route('/db/stats')
+@login_required
+def db_stats():
+    """Return open, idle and reused connection counts for the SQLite pool."""
+    return jsonify(db_pool.stats())
+
+
+@app.route('/storage/stats')
+@login_required
+def storage_stats():
+    """Return blob store usage and the report of the last retention pass."""
+    return jsonify({'blobs': blob_stats(), 'retention': retention.last_report})
+
+
+@app.route('/llm/stats')
+@login_required
+def llm_stats_view():
+    """Return per-model call counts, latency, token usage, the current
+    adaptive concurrency limit and the rolling vision latency percentiles."""
+    return jsonify(
+        {
+            'models': llm_stats.stats(),
+            'limiter': llm_limiter.stats(),
+            'vision_latency': vision_latencies.stats(),
+        }
+    )
 
 
 @app.route('/uploads/<path:filename>')
 @login_required
 def uploaded_file(filename):
-    """Serve uploaded files from the uploads folder."""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """Serve an upload from the blob store, or the uploads folder for
+    files saved before the store existed."""
+    digest = lookup(filename)
+    if digest is None:
+        return send_from_directory(UPLOAD_FOLDER, filename)
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
 
 
 @app.route('/logout')
@@ -0,0 +1,120 @@
+"""ZIP archives of a whole job, streamed as they are built.
+
+An archive holds ``manifest.json`` and, per request, the original image with
+its ``output.md``, ``result.json`` and ``bdr.json`` under ``requests/<id>/``,
+then the job attachments under ``attachments/``.
+
+:func:`archive_chunks` writes the ZIP into a :class:`~backend.export.ChunkSink`
+and yields its bytes while files are read in ``ARCHIVE_CHUNK_SIZE`` pieces
+and results one request at a time.  The sink cannot seek, so every entry
+carries a data descriptor and the archive is never staged in memory or on
+disk.
+"""
+import os
+import json
+import time
+import zipfile
+
+from backend.blobs import lookup, upload_path
+from backend.export import ChunkSink
+from backend.models import get_request, get_attachments, get_job_name, jobs_db
+from backend.variants import source_path
+
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+# Request columns written next to each image, with their archive names.
+RESULT_FILES = (('output', 'output.md'), ('json', 'result.json'), ('bdr_json', 'bdr.json'))
+
+
+def _source(name: str, db_path: str | None = None) -> tuple[str, str | None]:
+    """Return the file holding the original of upload ``name`` and its
+    blob digest; in-place preprocessed legacy uploads keep a ``.orig``."""
+    digest = lookup(name, db_path)
+    path = upload_path(name, db_path)
+    return (path if digest else source_path(path)), digest
+
+
+def _file_entry(name: str, arcname: str, db_path: str | None = None) -> tuple[dict, str]:
+    """Return the manifest entry of upload ``name`` and the path to read.
+
+    Uploads missing from disk are listed with a ``path`` of ``None``.
+    """
+    path, digest = _source(name, db_path)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        arcname = size = None
+    return {'filename': name, 'path': arcname, 'size': size, 'sha256': digest}, path
+
+
+def _text_info(arcname: str) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def _copy(zf: zipfile.ZipFile, sink: ChunkSink, path: str, arcname: str, chunk_size: int):
+    """Store ``path`` in ``zf`` as ``arcname``, yielding the ZIP bytes."""
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    # Images do not compress, so they are stored as they are.
+    with open(path, 'rb') as src, zf.open(
+        info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT
+    ) as dest:
+        while chunk := src.read(chunk_size):
+            dest.write(chunk)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def archive_chunks(job_id: str, db_path: str | None = None, chunk_size: int = ARCHIVE_CHUNK_SIZE):
+    """Yield a ZIP archive of ``job_id`` in the order it is written."""
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            """SELECT id, filename, timestamp, status,
+                      COALESCE(output, '') != '', COALESCE(json, '') != '',
+                      COALESCE(bdr_json, '') != ''
+               FROM requests WHERE job_id=? ORDER BY id""",
+            (job_id,),
+        ).fetchall()
+    manifest = {
+        'job_id': job_id,
+        'name': get_job_name(job_id, db_path),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'requests': [],
+        'attachments': [],
+    }
+    sources = {}
+    for req_id, filename, timestamp, status, *present in rows:
+        folder = f"requests/{req_id}/"
+        image, sources[req_id] = _file_entry(filename, folder + filename, db_path)
+        manifest['requests'].append({
+            'id': req_id,
+            'timestamp': timestamp,
+            'status': status or 'done',
+            'image': image,
+            'results': [
+                folder + arcname
+                for (_, arcname), exists in zip(RESULT_FILES, present) if exists
+            ],
+        })
+    attachments = []
+    for a in get_attachments(job_id, db_path):
+        entry, path = _file_entry(a['filename'], f"attachments/{a['filename']}", db_path)
+        manifest['attachments'].append(entry | {'timestamp': a['timestamp']})
+        attachments.append((entry, path))
+
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as zf:
+        zf.writestr(_text_info('manifest.json'), json.dumps(manifest, indent=2))
+        yield sink.drain()
+        for entry in manifest['requests']:
+            if entry['image']['path']:
+                yield from _copy(zf, sink, sources[entry['id']], entry['image']['path'], chunk_size)
+            row = get_request(job_id, entry['id'], db_path) or {}
+            for column, arcname in RESULT_FILES:
+                if row.get(column):
+                    zf.writestr(_text_info(f"requests/{entry['id']}/{arcname}"), row[column])
+            yield sink.drain()
+        for entry, path in attachments:
+            if entry['path']:
+                yield from _copy(zf, sink, path, entry['path'], chunk_size)
+    yield sink.drain()
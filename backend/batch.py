@@ -0,0 +1,316 @@
+"""Bulk re-processing of stored jobs through the OpenAI Batch API.
+
+A backfill builds one chat completion request per stored row, packs them
+into JSONL payloads, submits each payload as a batch, polls until the batches
+finish and writes the results back into the jobs database.  Batch requests cost half as
+much as synchronous calls and do not count against the regular rate limits.
+
+Three kinds of backfill are supported:
+
+``tables``  image + ``generate_prompt`` (or a custom prompt) -> ``output``
+``bdr``     BDR image + ``BDR_PROMPT``, top 40% only -> ``bdr_md``
+``json``    stored ``output`` + ``JSON_PROMPT`` -> ``json``; tables that parse
+            locally are converted without the model
+
+Run ``python -m backend.batch --help`` for the command line interface.
+"""
+import os
+import io
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import openai
+
+from backend.utils import (
+    MODEL,
+    generate_prompt,
+    enhance_tank_conditions,
+    _vision_params,
+    _json_params,
+)
+from backend.bdr_extractor import BDR_PROMPT, BDR_CROP_TOP_FRACTION
+from backend.tank_extractor import markdown_to_tank_report
+from backend.blobs import upload_path
+from backend.models import (
+    jobs_db,
+    job_exists,
+    get_requests,
+    update_request,
+    bdr_image_path,
+    set_request_output,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_KINDS = ('tables', 'bdr', 'json')
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_COMPLETION_WINDOW = '24h'
+# Provider limits are 50,000 requests and 200 MB per input file.
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 50000))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 190 * 1024 * 1024))
+BATCH_POLL_INTERVAL = float(os.getenv('BATCH_POLL_INTERVAL', 30))
+BATCH_FINAL_STATES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class OpenAIBatchClient:
+    """Upload, poll and download through the OpenAI Files and Batches APIs."""
+
+    def submit(self, jsonl: bytes, metadata: dict | None = None) -> str:
+        upload = openai.files.create(file=('batch.jsonl', io.BytesIO(jsonl)), purpose='batch')
+        batch = openai.batches.create(
+            input_file_id=upload.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata or openai.NOT_GIVEN,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> dict:
+        batch = openai.batches.retrieve(batch_id)
+        return {
+            'id': batch.id,
+            'status': batch.status,
+            'output_file_id': batch.output_file_id,
+            'error_file_id': batch.error_file_id,
+        }
+
+    def download(self, file_id: str) -> str:
+        return openai.files.content(file_id).text
+
+
+class LocalBatchClient:
+    """Offline stand-in for :class:`OpenAIBatchClient`.
+
+    Batches complete on the first :meth:`status` call.  ``respond`` receives
+    each request body and returns the message content to answer with; raising
+    an exception records an error line for that request instead.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.batches: dict[str, list[dict]] = {}
+        self.files: dict[str, str] = {}
+
+    def submit(self, jsonl: bytes, metadata: dict | None = None) -> str:
+        batch_id = f"batch_{len(self.batches) + 1}"
+        self.batches[batch_id] = [json.loads(line) for line in jsonl.splitlines() if line]
+        return batch_id
+
+    def status(self, batch_id: str) -> dict:
+        output_id = f"{batch_id}_output"
+        if output_id not in self.files:
+            lines = []
+            for i, req in enumerate(self.batches[batch_id]):
+                line = {'id': f"{batch_id}_req_{i}", 'custom_id': req['custom_id'], 'response': None, 'error': None}
+                try:
+                    content = self.respond(req['body'])
+                except Exception as e:
+                    line['error'] = {'code': 'local_error', 'message': str(e)}
+                else:
+                    line['response'] = {
+                        'status_code': 200,
+                        'body': {
+                            'object': 'chat.completion',
+                            'model': req['body']['model'],
+                            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}],
+                        },
+                    }
+                lines.append(json.dumps(line))
+            self.files[output_id] = '\n'.join(lines) + '\n'
+        return {'id': batch_id, 'status': 'completed', 'output_file_id': output_id, 'error_file_id': None}
+
+    def download(self, file_id: str) -> str:
+        return self.files[file_id]
+
+
+def custom_id(kind: str, job_id: str, req_id: int) -> str:
+    return f"{kind}:{job_id}:{req_id}"
+
+
+def parse_custom_id(value: str) -> tuple[str, str, int]:
+    kind, job_id, req_id = value.split(':')
+    return kind, job_id, int(req_id)
+
+
+def job_ids() -> list[str]:
+    """Return the ids of every stored job."""
+    with jobs_db() as conn:
+        return [r[0] for r in conn.execute("SELECT job_id FROM jobs ORDER BY job_id")]
+
+
+def _store(kind: str, job_id: str, req_id: int, content: str, prompt: str | None = None) -> None:
+    if kind == 'tables':
+        set_request_output(job_id, req_id, prompt or generate_prompt(), content, 'done')
+        return
+    if kind == 'json':
+        content = json.dumps(json.loads(enhance_tank_conditions(content)), indent=2)
+    column = {'json': 'json', 'bdr': 'bdr_md'}[kind]
+    update_request(job_id, req_id, **{column: content})
+
+
+def build_requests(
+    kind: str,
+    jobs: list[str] | None = None,
+    model: str | None = None,
+    prompt: str | None = None,
+):
+    """Yield Batch API request lines for the rows of ``jobs`` (default: all).
+
+    ``json`` rows whose tables parse locally are written immediately and not
+    yielded.  Rows whose image is missing are skipped.
+    """
+    if kind not in BATCH_KINDS:
+        raise ValueError(f"Unknown batch kind: {kind}")
+    model = model or MODEL
+    prompt = prompt or generate_prompt()
+    for job_id in jobs or job_ids():
+        if not job_exists(job_id):
+            logger.warning("Job %s not found", job_id)
+            continue
+        for row in get_requests(job_id):
+            req_id, filename, output = row['id'], row['filename'], row['output']
+            if kind == 'json':
+                if not output:
+                    continue
+                try:
+                    local = json.dumps(markdown_to_tank_report(output))
+                except ValueError:
+                    body = _json_params(output, model)
+                else:
+                    _store('json', job_id, req_id, local)
+                    continue
+            else:
+                if kind == 'bdr':
+                    path, text, crop = bdr_image_path(job_id, filename), BDR_PROMPT, BDR_CROP_TOP_FRACTION
+                else:
+                    path, text, crop = upload_path(filename), prompt, None
+                if not os.path.exists(path):
+                    logger.warning("Skipping %s/%s: image %s missing", job_id, req_id, path)
+                    continue
+                body = _vision_params(path, text, model, crop)
+            yield {
+                'custom_id': custom_id(kind, job_id, req_id),
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': body,
+            }
+
+
+def chunk_requests(lines, max_requests: int = BATCH_MAX_REQUESTS, max_bytes: int = BATCH_MAX_BYTES):
+    """Group request lines into JSONL payloads within the provider limits."""
+    chunk, size = [], 0
+    for line in lines:
+        data = json.dumps(line).encode() + b'\n'
+        if chunk and (len(chunk) >= max_requests or size + len(data) > max_bytes):
+            yield b''.join(chunk)
+            chunk, size = [], 0
+        chunk.append(data)
+        size += len(data)
+    if chunk:
+        yield b''.join(chunk)
+
+
+def submit(client, kind: str, jobs=None, model=None, prompt=None) -> list[str]:
+    """Build and submit a backfill; returns the batch ids."""
+    batch_ids = []
+    for payload in chunk_requests(build_requests(kind, jobs, model, prompt)):
+        batch_ids.append(client.submit(payload, metadata={'kind': kind}))
+        logger.info("Submitted batch %s (%s requests)", batch_ids[-1], payload.count(b'\n'))
+    return batch_ids
+
+
+def wait(client, batch_ids: list[str], poll_interval: float = BATCH_POLL_INTERVAL, timeout: float | None = None) -> dict:
+    """Poll until every batch reaches a final state; returns their statuses."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    statuses = {}
+    while True:
+        for batch_id in batch_ids:
+            if statuses.get(batch_id, {}).get('status') not in BATCH_FINAL_STATES:
+                statuses[batch_id] = client.status(batch_id)
+        if all(s['status'] in BATCH_FINAL_STATES for s in statuses.values()):
+            return statuses
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Batches still running: {', '.join(batch_ids)}")
+        time.sleep(poll_interval)
+
+
+def apply_results(output: str, prompt: str | None = None) -> tuple[int, int]:
+    """Write a batch output file back into the jobs database.
+
+    Returns ``(applied, failed)``.  Failed requests leave their row untouched.
+    """
+    applied = failed = 0
+    for raw in output.splitlines():
+        if not raw.strip():
+            continue
+        line = json.loads(raw)
+        kind, job_id, req_id = parse_custom_id(line['custom_id'])
+        response = line.get('response') or {}
+        if line.get('error') or response.get('status_code') != 200:
+            logger.warning("Batch request %s failed: %s", line['custom_id'], line.get('error') or response)
+            failed += 1
+            continue
+        content = response['body']['choices'][0]['message']['content']
+        try:
+            _store(kind, job_id, req_id, content, prompt)
+        except (ValueError, KeyError) as e:
+            logger.warning("Could not store result for %s: %s", line['custom_id'], e)
+            failed += 1
+            continue
+        applied += 1
+    return applied, failed
+
+
+def collect(client, batch_ids: list[str], prompt: str | None = None, **wait_kwargs) -> tuple[int, int]:
+    """Wait for ``batch_ids`` and apply their results."""
+    applied = failed = 0
+    for batch_id, status in wait(client, batch_ids, **wait_kwargs).items():
+        if status['status'] != 'completed' or not status.get('output_file_id'):
+            logger.error("Batch %s ended as %s", batch_id, status['status'])
+            continue
+        a, f = apply_results(client.download(status['output_file_id']), prompt)
+        applied += a
+        failed += f
+    return applied, failed
+
+
+def main(argv=None, client=None):
+    parser = argparse.ArgumentParser(
+        description="Re-process stored jobs through the OpenAI Batch API."
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (
+        ('submit', "build and submit batches, print their ids"),
+        ('run', "submit, wait for completion and write results back"),
+    ):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('kind', choices=BATCH_KINDS)
+        p.add_argument('--job', action='append', dest='jobs', help="job id (repeatable; default: all jobs)")
+        p.add_argument('--model', default=MODEL)
+        p.add_argument('--prompt-file', help="prompt for the tables kind (default: generate_prompt)")
+    p = sub.add_parser('collect', help="wait for submitted batches and write results back")
+    p.add_argument('batch_ids', nargs='+')
+    p.add_argument('--prompt-file', help="prompt the tables batches were submitted with")
+    for p in sub.choices.values():
+        p.add_argument('--poll-interval', type=float, default=BATCH_POLL_INTERVAL)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    client = client or OpenAIBatchClient()
+    prompt = Path(args.prompt_file).read_text() if args.prompt_file else None
+    if args.command == 'collect':
+        batch_ids = args.batch_ids
+    else:
+        batch_ids = submit(client, args.kind, args.jobs, args.model, prompt)
+        print('\n'.join(batch_ids))
+        if args.command == 'submit':
+            return
+    applied, failed = collect(client, batch_ids, prompt, poll_interval=args.poll_interval)
+    print(f"{applied} row(s) updated, {failed} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,9 @@ import re
 import json
 from typing import Any, Dict, List, Optional
 
+# Only the header and product tables at the top of a BDR are needed.
+BDR_CROP_TOP_FRACTION = 0.40
+
 # Prompt used when sending BDR images to the LLM.  The model should return two
 # markdown tables that can later be converted to JSON.
 BDR_PROMPT = (
@@ -126,12 +129,18 @@ _PRODUCT_HEADER_MAP = {
 
 
 def _match_header_index(headers: List[str], target: str) -> int | None:
+    # Synonyms are literal text; ``re.escape`` keeps "weight (mt)" from being
+    # read as a regex group that never matches the real header.
     for i, h in enumerate(headers):
-        if re.search(target, h, re.IGNORECASE):
+        if re.search(re.escape(target), h, re.IGNORECASE):
             return i
     return None
 
 
+def _is_separator_row(parts: List[str]) -> bool:
+    return bool(parts) and all(re.fullmatch(r":?-{2,}:?", p) for p in parts if p)
+
+
 def _parse_products(text: str) -> List[Dict[str, Any]]:
     def _split(line: str):
         d = "|" if "|" in line else None
@@ -176,7 +185,7 @@ def _parse_products(text: str) -> List[Dict[str, Any]]:
         if not row:
             break
         parts, _ = _split(row)
-        if len(parts) < len(col_map):
+        if len(parts) < len(col_map) or _is_separator_row(parts):
             continue
         prod = {key: parts[idx] if idx < len(parts) else "" for key, idx in col_map.items()}
         products.append(prod)
@@ -216,6 +225,79 @@ def extract_bdr(text: str) -> Dict[str, Any]:
     return result
 
 
+_HEADER_TABLE_COLUMNS = {
+    "vessel_name": "vessel name",
+    "imo_number": "imo number",
+    "flag_country": "flag country",
+    "delivery_port": "delivery port",
+}
+
+# Fields that must be present before the local conversion is trusted.
+BDR_REQUIRED_FIELDS = ("vessel_name", "products")
+BDR_REQUIRED_PRODUCT_FIELDS = ("product_description", "weight_mt")
+
+
+def _parse_header_table(text: str) -> Dict[str, Any]:
+    """Return the general information row of the first ``BDR_PROMPT`` table."""
+    rows = [
+        [p.strip() for p in ln.strip().strip("|").split("|")]
+        for ln in text.splitlines()
+        if ln.strip().startswith("|")
+    ]
+    for i, header in enumerate(rows):
+        lowered = [h.lower() for h in header]
+        if "vessel name" not in lowered:
+            continue
+        values = next(
+            (r for r in rows[i + 1:] if not _is_separator_row(r)), []
+        )
+        result = {}
+        for key, name in _HEADER_TABLE_COLUMNS.items():
+            idx = lowered.index(name) if name in lowered else None
+            value = values[idx] if idx is not None and idx < len(values) else ""
+            result[key] = value or None
+        return result
+    return {key: None for key in _HEADER_TABLE_COLUMNS}
+
+
+def bdr_missing_fields(data: Dict[str, Any]) -> List[str]:
+    """Return the required fields that are empty in ``data``."""
+    missing = [f for f in BDR_REQUIRED_FIELDS if data.get(f) in (None, "", [])]
+    for i, prod in enumerate(data.get("products") or []):
+        for f in BDR_REQUIRED_PRODUCT_FIELDS:
+            if prod.get(f) in (None, ""):
+                missing.append(f"products[{i}].{f}")
+    return missing
+
+
+def bdr_markdown_to_json(text: str) -> tuple[Dict[str, Any], float]:
+    """Convert the two ``BDR_PROMPT`` tables to the ``BDR_JSON_PROMPT`` schema.
+
+    Returns the data and a confidence score between 0 and 1: the share of
+    schema fields that were filled in.  Use :func:`bdr_missing_fields` to
+    decide whether the result needs the model instead.
+    """
+    data = _parse_header_table(text)
+    products = []
+    for prod in _parse_products(text):
+        prod["product_description"] = prod["product_description"] or None
+        products.append(prod)
+    data["products"] = products
+
+    filled = sum(1 for k in _HEADER_TABLE_COLUMNS if data[k])
+    total = len(_HEADER_TABLE_COLUMNS) + 1
+    if products:
+        filled += 1
+        for prod in products:
+            for key, val in prod.items():
+                total += 1
+                if key == "viscosity":
+                    val = val.get("value")
+                if val not in (None, ""):
+                    filled += 1
+    return data, round(filled / total, 3)
+
+
 def merge_bdr_json(existing: Dict[str, Any] | None, new: Dict[str, Any]) -> Dict[str, Any]:
     """Merge ``new`` BDR data into ``existing`` without overwriting values.
 
@@ -278,7 +360,7 @@ Convert any temperatures from Celsius to Fahrenheit. Output only valid JSON.
 
 def call_openai_bdr_json(tables: str, model: str | None = None) -> str:
     """Use OpenAI to convert BDR tables to standardized JSON."""
-    from .utils import MODEL, openai
+    from .utils import MODEL, chat_completion
 
     if model is None:
         model = MODEL
@@ -291,18 +373,4 @@ def call_openai_bdr_json(tables: str, model: str | None = None) -> str:
     }
     if model not in {"o3", "o3-mini", "o4-mini"}:
         params["temperature"] = 0.25
-
-    try:
-        response = openai.chat.completions.create(**params)
-    except openai.BadRequestError as e:
-        if (
-            getattr(e, "body", None)
-            and e.body.get("error", {}).get("code") == "unsupported_value"
-            and e.body.get("error", {}).get("param") == "temperature"
-        ):
-            params.pop("temperature", None)
-            response = openai.chat.completions.create(**params)
-        else:
-            raise
-    return response.choices[0].message.content
-
+    return chat_completion(params).choices[0].message.content
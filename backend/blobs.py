@@ -0,0 +1,169 @@
+"""Content-addressed storage for uploaded files.
+
+Uploads keep their unique ``<timestamp>_<uuid>.<ext>`` names, but the bytes
+are stored once per distinct content under ``BLOB_FOLDER/ab/cd/<sha256>``.
+The ``files`` table maps each upload name to its blob and ``blobs`` counts
+how many names reference each blob, so the same document uploaded twice
+takes the space of one and is deleted with its last reference.
+
+Uploads saved by older releases sit flat in ``UPLOAD_FOLDER``;
+:func:`upload_path` falls back to them, and ``python -m backend.manage
+import-uploads`` moves them into the store.
+"""
+import os
+import uuid
+import hashlib
+import datetime
+
+from werkzeug.utils import secure_filename
+
+from backend.utils import UPLOAD_FOLDER
+from backend.models import jobs_db
+
+BLOB_FOLDER = os.getenv('BLOB_FOLDER', os.path.join(UPLOAD_FOLDER, 'blobs'))
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_path(digest: str) -> str:
+    """Return the sharded location of the blob with ``digest``."""
+    return os.path.join(BLOB_FOLDER, digest[:2], digest[2:4], digest)
+
+
+def _write_temp(stream) -> tuple[str, str, int]:
+    """Copy ``stream`` to a temporary file while hashing it."""
+    tmp_dir = os.path.join(BLOB_FOLDER, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    sha = hashlib.sha256()
+    size = 0
+    with open(tmp_path, 'wb') as out:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return tmp_path, sha.hexdigest(), size
+
+
+def store(name: str, stream, db_path: str | None = None) -> str:
+    """Store the contents of ``stream`` under the upload ``name``.
+
+    Returns the blob path.  Identical content already in the store is not
+    written again; its reference count goes up instead.
+    """
+    tmp_path, digest, size = _write_temp(stream)
+    path = blob_path(digest)
+    try:
+        with jobs_db(db_path) as conn:
+            # Serialise with ``release`` so a blob is never unlinked between
+            # our existence check and the reference being recorded.
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """INSERT INTO blobs (hash, size, refcount, created) VALUES (?, ?, 1, ?)
+                   ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1""",
+                (digest, size, datetime.datetime.utcnow().isoformat()),
+            )
+            conn.execute(
+                "INSERT INTO files (name, hash, created) VALUES (?, ?, ?)",
+                (name, digest, datetime.datetime.utcnow().isoformat()),
+            )
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def save_file(file) -> tuple[str, str]:
+    """Save an uploaded file under a new unique name.
+
+    Returns ``(new_name, path)`` where ``path`` is the blob to read from.
+    """
+    now = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    filename = secure_filename(file.filename)
+    ext = filename.rsplit('.', 1)[1].lower()
+    new_name = f"{now}_{uuid.uuid4().hex[:8]}.{ext}"
+    return new_name, store(new_name, file.stream)
+
+
+def lookup(name: str, db_path: str | None = None) -> str | None:
+    """Return the blob digest for upload ``name``, if it is in the store."""
+    with jobs_db(db_path) as conn:
+        row = conn.execute("SELECT hash FROM files WHERE name=?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def legacy_path(name: str) -> str:
+    """Return where older releases saved upload ``name``."""
+    return os.path.join(UPLOAD_FOLDER, name)
+
+
+def upload_path(name: str, db_path: str | None = None) -> str:
+    """Return the file to read for upload ``name``.
+
+    Names missing from the store resolve to the flat ``UPLOAD_FOLDER``
+    location older releases saved them at.
+    """
+    digest = lookup(name, db_path)
+    if digest:
+        return blob_path(digest)
+    return legacy_path(name)
+
+
+def release(name: str, db_path: str | None = None) -> int:
+    """Drop upload ``name``; the blob is deleted with its last reference.
+
+    The file is unlinked only after the rows are gone for good, so a failed
+    commit never leaves a reference to a missing blob.  Returns the number of
+    bytes freed on disk.
+    """
+    with jobs_db(db_path) as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT hash FROM files WHERE name=?", (name,)).fetchone()
+        if row is None:
+            return 0
+        digest = row[0]
+        conn.execute("DELETE FROM files WHERE name=?", (name,))
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash=?", (digest,))
+        left = conn.execute(
+            "SELECT refcount, size FROM blobs WHERE hash=?", (digest,)
+        ).fetchone()
+        if left and left[0] > 0:
+            return 0
+        conn.execute("DELETE FROM blobs WHERE hash=?", (digest,))
+        freed = left[1] if left else 0
+    with jobs_db(db_path) as conn:
+        # Hold the write lock so ``store`` cannot reference the content again
+        # while it is unlinked, and skip it if it already did.
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+            return 0
+        try:
+            os.remove(blob_path(digest))
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+def stats(db_path: str | None = None) -> dict:
+    """Return upload and blob counts and the bytes saved by deduplication."""
+    with jobs_db(db_path) as conn:
+        files, logical = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(b.size), 0) FROM files f JOIN blobs b ON b.hash = f.hash"
+        ).fetchone()
+        blobs, stored = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+    return {
+        'files': files,
+        'blobs': blobs,
+        'stored_bytes': stored,
+        'deduplicated_bytes': logical - stored,
+    }
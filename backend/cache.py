@@ -0,0 +1,219 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+from backend.utils import UPLOAD_FOLDER, get_db
+
+logger = logging.getLogger(__name__)
+
+# ``sqlite`` (default), ``redis`` or ``off``
+RESULT_CACHE = os.getenv('RESULT_CACHE', 'sqlite').lower()
+RESULT_CACHE_PATH = os.getenv(
+    'RESULT_CACHE_PATH', os.path.join(UPLOAD_FOLDER, 'result_cache.sqlite')
+)
+RESULT_CACHE_REDIS_URL = os.getenv(
+    'RESULT_CACHE_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379')
+)
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 7 * 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 5000))
+
+
+def cache_key(
+    image: bytes | str,
+    prompt: str,
+    model: str,
+    crop_top_fraction: float | None = None,
+    detail: str | None = None,
+) -> str:
+    """Return the cache key for a vision call.
+
+    ``image`` is the preprocessed payload actually sent to the model, so two
+    uploads of the same sheet share a key even when their filenames differ.
+    """
+    if isinstance(image, str):
+        image = image.encode()
+    h = hashlib.sha256()
+    parts = [image, prompt.encode(), model.encode(), repr(crop_top_fraction).encode()]
+    if detail is not None:
+        parts.append(detail.encode())
+    for part in parts:
+        h.update(len(part).to_bytes(8, 'big'))
+        h.update(part)
+    return h.hexdigest()
+
+
+class _Counters:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+class SQLiteResultCache:
+    """Result cache in a local SQLite file with TTL and LRU size eviction."""
+
+    backend = 'sqlite'
+
+    def __init__(
+        self,
+        path: str = RESULT_CACHE_PATH,
+        ttl: int = RESULT_CACHE_TTL,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counters = _Counters()
+        with get_db(self.path) as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    created REAL,
+                    accessed REAL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+            )
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        try:
+            with get_db(self.path) as conn:
+                row = conn.execute(
+                    "SELECT value FROM results WHERE key=? AND created>=?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE results SET accessed=? WHERE key=?", (now, key)
+                    )
+        except sqlite3.Error:
+            logger.exception("Result cache lookup failed")
+            row = None
+        self.counters.record(row is not None)
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        try:
+            with get_db(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                conn.execute(
+                    "DELETE FROM results WHERE created<?", (now - self.ttl,)
+                )
+                conn.execute(
+                    """DELETE FROM results WHERE key IN (
+                        SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error:
+            logger.exception("Result cache store failed")
+
+    def __len__(self) -> int:
+        with get_db(self.path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'hits': self.counters.hits,
+            'misses': self.counters.misses,
+            'entries': len(self),
+        }
+
+
+class RedisResultCache:
+    """Result cache in Redis; keys expire after ``ttl`` and the oldest
+    entries are trimmed once more than ``max_entries`` are stored."""
+
+    backend = 'redis'
+
+    def __init__(
+        self,
+        redis: Redis,
+        ttl: int = RESULT_CACHE_TTL,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        prefix: str = 'sfk:result:',
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.index_key = f"{prefix}index"
+        self.counters = _Counters()
+
+    def get(self, key: str) -> str | None:
+        try:
+            value = self.redis.get(self.prefix + key)
+            if value is not None:
+                self.redis.zadd(self.index_key, {key: time.time()})
+        except RedisError:
+            logger.exception("Result cache lookup failed")
+            value = None
+        self.counters.record(value is not None)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        try:
+            pipe = self.redis.pipeline()
+            pipe.setex(self.prefix + key, self.ttl, value)
+            pipe.zadd(self.index_key, {key: now})
+            pipe.zremrangebyscore(self.index_key, '-inf', now - self.ttl)
+            pipe.execute()
+            excess = self.redis.zcard(self.index_key) - self.max_entries
+            if excess > 0:
+                evicted = [
+                    k.decode() if isinstance(k, bytes) else k
+                    for k, _ in self.redis.zpopmin(self.index_key, excess)
+                ]
+                self.redis.delete(*(self.prefix + k for k in evicted))
+        except RedisError:
+            logger.exception("Result cache store failed")
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'hits': self.counters.hits,
+            'misses': self.counters.misses,
+            'entries': self.redis.zcard(self.index_key),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the configured result cache, or ``None`` when disabled."""
+    global _cache
+    if RESULT_CACHE == 'off':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            if RESULT_CACHE == 'redis':
+                _cache = RedisResultCache(Redis.from_url(RESULT_CACHE_REDIS_URL))
+            else:
+                _cache = SQLiteResultCache()
+        return _cache
@@ -1,18 +1,229 @@
+"""Retention and garbage collection for jobs and their uploads.
+
+Jobs are picked oldest first from the ``jobs`` summary index rather than by
+walking ``UPLOAD_FOLDER``:
+
+- age: jobs without a new request for ``RETENTION_DAYS`` days
+- quota: the oldest jobs while the blob store holds more than
+  ``UPLOAD_QUOTA_MB``
+
+Purging a job deletes its rows and then every upload no other job refers to:
+the blob (with its last reference), a flat file and ``.orig`` left by older
+releases, and the image variants rendered from it, together with a legacy
+``<job_id>.db`` file and its WAL sidecars.  Each pass handles at most
+``RETENTION_BATCH`` jobs per policy, so a large backlog is worked off over
+several passes without holding up the app.
+
+The app runs a pass every ``RETENTION_INTERVAL`` seconds in a background
+thread; ``python -m backend.cleanup --once`` runs one from cron or another
+container.
+"""
+import os
+import time
+import signal
+import logging
+import argparse
+import threading
 from datetime import datetime, timedelta
-from pathlib import Path
 
-from backend.utils import UPLOAD_FOLDER
+from backend.models import jobs_db, delete_job
+from backend.blobs import BLOB_FOLDER, lookup, release, legacy_path
+from backend.variants import variant_store, source_path
+
+logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = Path(UPLOAD_FOLDER)
+RETENTION_DAYS = float(os.getenv('RETENTION_DAYS', 7))
+UPLOAD_QUOTA_MB = int(os.getenv('UPLOAD_QUOTA_MB', 0))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))
+RETENTION_BATCH = int(os.getenv('RETENTION_BATCH', 100))
 
+# Report of the most recent pass, shown at ``/storage/stats``.
+last_report: dict = {}
 
-def purge_old_uploads(days: int = 7) -> None:
-    """Delete files in ``UPLOAD_DIR`` older than ``days`` days."""
-    cutoff = datetime.utcnow() - timedelta(days=days)
-    for p in UPLOAD_DIR.iterdir():
+
+def _remove(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return 0
+    return size
+
+
+def remove_upload(name: str, db_path: str | None = None) -> int:
+    """Delete the files of upload ``name``; returns the bytes freed."""
+    freed = 0
+    digest = lookup(name, db_path)
+    if digest:
+        released = release(name, db_path)
+        if released:
+            freed += released + variant_store.discard(digest)
+    flat = legacy_path(name)
+    if os.path.exists(flat) or os.path.exists(f"{flat}.orig"):
         try:
-            if p.is_file() and p.stat().st_mtime < cutoff.timestamp():
-                p.unlink(missing_ok=True)
+            freed += variant_store.discard(variant_store.digest(source_path(flat)))
+        except OSError:
+            pass
+        freed += _remove(f"{flat}.orig") + _remove(flat)
+    return freed
+
+
+def purge_job(job_id: str, db_path: str | None = None) -> int:
+    """Delete a job with every file only it uses; returns the bytes freed."""
+    freed = sum(remove_upload(name, db_path) for name in delete_job(job_id, db_path))
+    legacy_db = legacy_path(f"{job_id}.db")
+    for suffix in ('', '-wal', '-shm'):
+        freed += _remove(f"{legacy_db}{suffix}")
+    return freed
+
+
+def expired_jobs(cutoff: str, limit: int, db_path: str | None = None) -> list[str]:
+    """Return up to ``limit`` jobs last active before ``cutoff``, oldest first."""
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            """SELECT job_id FROM jobs
+               WHERE COALESCE(last_timestamp, created) < ?
+               ORDER BY last_request_id LIMIT ?""",
+            (cutoff, limit),
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def orphaned_uploads(cutoff: str, limit: int, db_path: str | None = None) -> list[str]:
+    """Return up to ``limit`` stored uploads from before ``cutoff`` that no
+    request or attachment refers to, such as files of abandoned uploads."""
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            """SELECT name FROM files f
+               WHERE created < ?
+                 AND NOT EXISTS (SELECT 1 FROM requests WHERE filename = f.name)
+                 AND NOT EXISTS (SELECT 1 FROM attachments WHERE filename = f.name)
+               LIMIT ?""",
+            (cutoff, limit),
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def stored_bytes(db_path: str | None = None) -> int:
+    """Return the bytes held by the blob store."""
+    with jobs_db(db_path) as conn:
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+
+def _oldest_job(db_path: str | None = None) -> str | None:
+    with jobs_db(db_path) as conn:
+        row = conn.execute(
+            """SELECT job_id FROM jobs WHERE last_request_id IS NOT NULL
+               ORDER BY last_request_id LIMIT 1"""
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _sweep_temp(cutoff: float) -> int:
+    """Delete temporary blob files left by interrupted uploads."""
+    tmp_dir = os.path.join(BLOB_FOLDER, 'tmp')
+    freed = 0
+    try:
+        entries = list(os.scandir(tmp_dir))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                freed += _remove(entry.path)
         except FileNotFoundError:
-            # File might be removed between listing and deletion
             pass
+    return freed
+
+
+def collect(
+    days: float = RETENTION_DAYS,
+    quota_mb: int = UPLOAD_QUOTA_MB,
+    batch: int = RETENTION_BATCH,
+    db_path: str | None = None,
+    now: datetime | None = None,
+) -> dict:
+    """Run one retention pass and return what it reclaimed.
+
+    ``days`` or ``quota_mb`` of 0 disables that policy.
+    """
+    now = now or datetime.utcnow()
+    started = time.monotonic()
+    report = {'expired': 0, 'over_quota': 0, 'orphans': 0, 'bytes': 0}
+    if days:
+        cutoff = (now - timedelta(days=days)).isoformat()
+        for job_id in expired_jobs(cutoff, batch, db_path):
+            report['bytes'] += purge_job(job_id, db_path)
+            report['expired'] += 1
+        for name in orphaned_uploads(cutoff, batch, db_path):
+            report['bytes'] += remove_upload(name, db_path)
+            report['orphans'] += 1
+    if quota_mb:
+        quota = quota_mb * 1024 * 1024
+        while report['over_quota'] < batch and stored_bytes(db_path) > quota:
+            job_id = _oldest_job(db_path)
+            if job_id is None:
+                break
+            report['bytes'] += purge_job(job_id, db_path)
+            report['over_quota'] += 1
+    report['bytes'] += _sweep_temp((now - timedelta(days=1)).timestamp())
+    report['seconds'] = round(time.monotonic() - started, 3)
+    report['finished'] = now.isoformat()
+    last_report.clear()
+    last_report.update(report)
+    return report
+
+
+def run(stop: threading.Event, interval: float = RETENTION_INTERVAL) -> None:
+    """Run a retention pass every ``interval`` seconds until ``stop`` is set."""
+    while not stop.wait(interval):
+        try:
+            report = collect()
+        except Exception:
+            logger.exception("Retention pass failed")
+            continue
+        if report['expired'] or report['over_quota'] or report['orphans']:
+            logger.info(
+                "Retention purged %s expired and %s over-quota job(s) and "
+                "%s orphaned upload(s), %s bytes",
+                report['expired'], report['over_quota'], report['orphans'], report['bytes'],
+            )
+
+
+def start(interval: float = RETENTION_INTERVAL) -> threading.Thread | None:
+    """Start :func:`run` in a daemon thread; ``interval`` of 0 disables it."""
+    if interval <= 0:
+        return None
+    thread = threading.Thread(
+        target=run, args=(threading.Event(), interval), name='retention', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purge old jobs and their uploads.")
+    parser.add_argument('--once', action='store_true', help="run a single pass and exit")
+    parser.add_argument('--days', type=float, default=RETENTION_DAYS, help="age policy in days, 0 disables")
+    parser.add_argument('--quota-mb', type=int, default=UPLOAD_QUOTA_MB, help="blob store quota, 0 disables")
+    parser.add_argument('--batch', type=int, default=RETENTION_BATCH, help="jobs purged per policy and pass")
+    parser.add_argument('--interval', type=float, default=RETENTION_INTERVAL, help="seconds between passes")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    while True:
+        report = collect(args.days, args.quota_mb, args.batch)
+        print(
+            f"{report['expired']} expired and {report['over_quota']} over-quota "
+            f"job(s) and {report['orphans']} orphaned upload(s) purged, "
+            f"{report['bytes']} bytes reclaimed"
+        )
+        if args.once or stop.wait(args.interval):
+            break
+
+
+if __name__ == '__main__':
+    main()
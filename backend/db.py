@@ -0,0 +1,143 @@
+"""Pooled SQLite connections.
+
+Opening a connection and setting its pragmas costs far more than the queries
+most callers run, so :class:`ConnectionPool` hands finished connections to
+the next caller instead of leaving them for the garbage collector.  A thread
+keeps the connection it checked out for a path until its outermost ``with``
+block ends, so nested helpers share one connection and transaction.  At most
+``SQLITE_POOL_SIZE`` idle connections are kept across all paths; the least
+recently used one is closed first.  Idle connections whose database file was
+replaced or removed are dropped instead of reused.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 16))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 16384))
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', 64))
+
+
+def _file_id(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class _Lease:
+    """A connection checked out by one thread."""
+
+    def __init__(self, path: str, conn: sqlite3.Connection):
+        self.path = path
+        self.conn = conn
+        self.file_id = _file_id(path)
+        self.depth = 0
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections keyed by database path."""
+
+    def __init__(self, size: int = SQLITE_POOL_SIZE):
+        self.size = max(0, size)
+        self._idle: list[_Lease] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {'opened': 0, 'closed': 0, 'reused': 0, 'evicted': 0, 'stale': 0}
+
+    def _open(self, path: str) -> _Lease:
+        conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL keeps the database consistent with NORMAL; only the last
+        # transactions before a power loss can be lost.
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}')
+        with self._lock:
+            self._counters['opened'] += 1
+        return _Lease(path, conn)
+
+    def _close(self, lease: _Lease, reason: str | None = None) -> None:
+        lease.conn.close()
+        with self._lock:
+            self._counters['closed'] += 1
+            if reason:
+                self._counters[reason] += 1
+
+    def _checkout(self, path: str) -> _Lease:
+        stale = []
+        lease = None
+        with self._lock:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i].path == path:
+                    candidate = self._idle.pop(i)
+                    if candidate.file_id == _file_id(path):
+                        lease = candidate
+                        self._counters['reused'] += 1
+                        break
+                    stale.append(candidate)
+        for candidate in stale:
+            self._close(candidate, 'stale')
+        return lease or self._open(path)
+
+    def _checkin(self, lease: _Lease) -> None:
+        if lease.conn.in_transaction:
+            lease.conn.rollback()
+        evicted = []
+        with self._lock:
+            self._idle.append(lease)
+            while len(self._idle) > self.size:
+                evicted.append(self._idle.pop(0))
+        for old in evicted:
+            self._close(old, 'evicted')
+
+    @contextmanager
+    def connection(self, path: str):
+        """Yield a connection to ``path``.
+
+        The outermost ``with`` in a thread commits on success and rolls back
+        on error; nested uses in the same thread share its connection and
+        transaction.
+        """
+        path = os.path.abspath(path)
+        active = getattr(self._local, 'active', None)
+        if active is None:
+            active = self._local.active = {}
+        lease = active.get(path)
+        if lease is None:
+            lease = active[path] = self._checkout(path)
+        lease.depth += 1
+        try:
+            if lease.depth == 1:
+                with lease.conn:
+                    yield lease.conn
+            else:
+                yield lease.conn
+        finally:
+            lease.depth -= 1
+            if lease.depth == 0:
+                del active[path]
+                self._checkin(lease)
+
+    def close_all(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for lease in idle:
+            self._close(lease)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters, idle=len(self._idle))
+        stats['open'] = stats['opened'] - stats['closed']
+        stats['in_use'] = stats['open'] - stats['idle']
+        return stats
+
+
+pool = ConnectionPool()
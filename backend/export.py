@@ -0,0 +1,225 @@
+"""Streaming bulk export of request rows as CSV, NDJSON or Parquet.
+
+Rows are read in ``EXPORT_BATCH_SIZE`` batches keyed on the request id, each
+batch on a fresh pooled connection, so memory stays flat however many rows
+are exported and no read transaction is held open while a slow client
+downloads.  Rows come out in id order; pass the ``id`` of the last row
+received as ``after`` to resume an interrupted export.
+
+Parquet needs ``pyarrow``; each batch becomes one row group.
+
+Run ``python -m backend.export --help`` for the command line interface; the
+web app serves the same streams at ``/export``.
+"""
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from backend.models import jobs_db
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))
+FORMATS = ('csv', 'ndjson', 'parquet')
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+COLUMNS = (
+    'id', 'job_id', 'job_name', 'filename', 'timestamp', 'status',
+    'output', 'json', 'bdr_md', 'bdr_json',
+)
+
+
+def _end_bound(end: str) -> str:
+    """Return the exclusive upper timestamp bound for ``end``.
+
+    A bare date includes that whole day, and a timestamp every timestamp
+    it is a prefix of, e.g. ``2025-03-01T10:00`` includes ``10:00:59``.
+    """
+    try:
+        day = datetime.date.fromisoformat(end)
+    except ValueError:
+        return end + '\uffff'
+    return (day + datetime.timedelta(days=1)).isoformat()
+
+
+def iter_batches(
+    job_ids: list[str] | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    after: int = 0,
+    limit: int | None = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    db_path: str | None = None,
+):
+    """Yield lists of row tuples (see ``COLUMNS``) with ids above ``after``.
+
+    ``job_ids`` selects jobs and ``start``/``end`` bound the request
+    timestamp, both inclusive.  ``limit`` caps the total number of rows.
+    """
+    where, params = ["r.id > ?"], []
+    if job_ids:
+        where.append(f"r.job_id IN ({', '.join('?' for _ in job_ids)})")
+        params.extend(job_ids)
+    # The unary ``+`` keeps SQLite walking requests in id order instead of
+    # sorting the whole date range from the timestamp index on every batch.
+    if start:
+        where.append("+r.timestamp >= ?")
+        params.append(start)
+    if end:
+        where.append("+r.timestamp < ?")
+        params.append(_end_bound(end))
+    sql = (
+        f"SELECT r.{', r.'.join(c for c in COLUMNS if c != 'job_name')}, j.name"
+        " FROM requests r JOIN jobs j ON j.job_id = r.job_id"
+        f" WHERE {' AND '.join(where)} ORDER BY r.id LIMIT ?"
+    )
+    if start:
+        # Skip straight to the first request of the range.
+        with jobs_db(db_path) as conn:
+            first = conn.execute(
+                "SELECT MIN(id) FROM requests WHERE timestamp >= ?", (start,)
+            ).fetchone()[0]
+        if first is None:
+            return
+        after = max(after, first - 1)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        with jobs_db(db_path) as conn:
+            rows = conn.execute(sql, (after, *params, size)).fetchall()
+        if not rows:
+            return
+        # ``job_name`` is selected last; move it to its place in COLUMNS.
+        yield [(r[0], r[1], r[-1], *r[2:-1]) for r in rows]
+        after = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < size:
+            return
+
+
+def csv_chunks(batches):
+    """Yield UTF-8 CSV, one chunk per batch, starting with a header row."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def ndjson_chunks(batches):
+    """Yield one JSON object per line, one chunk per batch."""
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows
+        ).encode()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only, unseekable file that hands back what was written since
+    the last :meth:`drain`, for streaming writers such as Parquet and ZIP."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def parquet_chunks(batches):
+    """Yield a Parquet file with one row group per batch."""
+    schema = pa.schema(
+        [('id', pa.int64())] + [(c, pa.string()) for c in COLUMNS if c != 'id']
+    )
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in batches:
+            writer.write_table(
+                pa.Table.from_pylist([dict(zip(COLUMNS, row)) for row in rows], schema)
+            )
+            yield sink.drain()
+    yield sink.drain()
+
+
+_WRITERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks, 'parquet': parquet_chunks}
+
+
+def export_chunks(fmt: str, **filters):
+    """Return an iterator of encoded chunks of the rows selected by
+    ``filters`` (see :func:`iter_batches`) in format ``fmt``.
+
+    Raises ``ValueError`` for an unknown format or Parquet without pyarrow.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'parquet' and pq is None:
+        raise ValueError("Parquet export needs pyarrow")
+    return _WRITERS[fmt](iter_batches(**filters))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export request rows.")
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--job', action='append', dest='job_ids', help="job id, repeatable")
+    parser.add_argument('--from', dest='start', help="first timestamp or date")
+    parser.add_argument('--to', dest='end', help="last timestamp or date")
+    parser.add_argument('--after', type=int, default=0, help="resume after this request id")
+    parser.add_argument('--limit', type=int, help="maximum number of rows")
+    parser.add_argument('--db', help="jobs database (default: JOBS_DB_PATH)")
+    parser.add_argument('--output', '-o', help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+    try:
+        chunks = export_chunks(
+            args.format,
+            job_ids=args.job_ids,
+            start=args.start,
+            end=args.end,
+            after=args.after,
+            limit=args.limit,
+            db_path=args.db,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""Typed fact tables projected from the stored TankReport and BDR JSON.
+
+Totals such as net barrels discharged per product per month would otherwise
+re-parse every ``json`` and ``bdr_json`` blob.  :func:`project` rewrites the
+fact rows of one request whenever its JSON is written, and :func:`aggregate`
+runs group-by queries over them, reading the trigger-maintained daily
+rollups (``<table>_daily``) instead of the rows when a query only needs the
+rollup's dimensions and sums, averages or counts.
+
+Every fact row carries its ``job_id`` and a ``day`` (``YYYY-MM-DD``): the
+earliest date in the report's event timeline, or the day the request was
+logged when the report has none.
+"""
+import json
+import re
+
+# Fact tables with the columns :func:`aggregate` may group by and total.
+# ``month`` and ``year`` are derived from ``day``.
+FACTS = {
+    'tanks': {
+        'table': 'fact_tanks',
+        'dimensions': ('job_id', 'day', 'month', 'year', 'phase', 'tank', 'product'),
+        'measures': (
+            'api', 'ullage_ft', 'ullage_in', 'temp_f', 'water_bbls',
+            'gross_bbls', 'net_bbls', 'metric_tons',
+        ),
+        'rollup': ('day', 'phase', 'product'),
+    },
+    'products': {
+        'table': 'fact_products',
+        'dimensions': ('job_id', 'day', 'month', 'year', 'product'),
+        'measures': ('api', 'gross_bbls', 'net_bbls', 'metric_tons'),
+        'rollup': ('day', 'product'),
+    },
+    'events': {
+        'table': 'fact_events',
+        'dimensions': ('job_id', 'day', 'month', 'year', 'event', 'date'),
+        'measures': (),
+    },
+    'drafts': {
+        'table': 'fact_drafts',
+        'dimensions': ('job_id', 'day', 'month', 'year', 'event', 'position'),
+        'measures': ('port', 'stbd'),
+    },
+    'bdr_products': {
+        'table': 'fact_bdr_products',
+        'dimensions': (
+            'job_id', 'day', 'month', 'year', 'vessel', 'imo', 'port', 'product',
+        ),
+        'measures': (
+            'weight_mt', 'gross_bbls', 'net_bbls', 'api', 'density',
+            'viscosity', 'flash_point_f', 'sulfur_percent',
+        ),
+        'rollup': ('day', 'vessel', 'port', 'product'),
+    },
+}
+AGGREGATES = ('sum', 'avg', 'min', 'max', 'count')
+_DERIVED = {'month': 'substr(day, 1, 7)', 'year': 'substr(day, 1, 4)'}
+# How each aggregate reads a rollup's ``<m>_sum`` and ``<m>_n``; a bare
+# ``count`` reads ``rows`` (``_ROLLUP_ROWS``).
+_ROLLUP_AGGREGATES = {
+    'sum': "CASE WHEN SUM({m}_n) > 0 THEN SUM({m}_sum) END",
+    'avg': "SUM({m}_sum) / SUM({m}_n)",
+    'count': "COALESCE(SUM({m}_n), 0)",
+}
+_ROLLUP_ROWS = "COALESCE(SUM(rows), 0)"
+_DAY = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def _load(text: str | None):
+    try:
+        data = json.loads(text) if text else None
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _list(value) -> list:
+    return [v for v in value if isinstance(v, dict)] if isinstance(value, list) else []
+
+
+def _num(value) -> float | None:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace(',', '').strip())
+        except ValueError:
+            return None
+    return None
+
+
+def _text(value) -> str | None:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value).strip() or None
+
+
+def _day(report: dict | None, timestamp: str | None) -> str | None:
+    dates = sorted(
+        ev['date'] for ev in _list((report or {}).get('eventTimeline'))
+        if isinstance(ev.get('date'), str) and _DAY.fullmatch(ev['date'])
+    )
+    if dates:
+        return dates[0]
+    return timestamp[:10] if timestamp else None
+
+
+def tank_facts(report: dict, key: tuple) -> dict[str, list[tuple]]:
+    """Return the tank, product, event and draft rows of a TankReport.
+
+    ``key`` is ``(request_id, job_id, day)`` and starts every row.
+    """
+    conditions = report.get('tankConditions')
+    conditions = conditions if isinstance(conditions, dict) else {}
+    tanks = [
+        (
+            *key, phase, _text(t.get('tank')), _text(t.get('productName')),
+            _num(t.get('api')), _num(t.get('ullageFt')), _num(t.get('ullageIn')),
+            _num(t.get('tempF')), _num(t.get('waterBbls')), _num(t.get('grossBbls')),
+            _num(t.get('netBbls')), _num(t.get('metricTons')),
+        )
+        for phase in ('arrival', 'departure')
+        for t in _list(conditions.get(phase))
+    ]
+    products = [
+        (
+            *key, _text(p.get('productName')), _num(p.get('api')),
+            _num(p.get('grossBbls')), _num(p.get('netBbls')), _num(p.get('metricTons')),
+        )
+        for p in _list(report.get('productsDischarged'))
+    ]
+    events = [
+        (*key, _text(e.get('event')), _text(e.get('date')), _text(e.get('time')))
+        for e in _list(report.get('eventTimeline'))
+    ]
+    drafts = []
+    for reading in _list(report.get('draftReadings')):
+        for position in ('fwd', 'aft'):
+            end = reading.get(position)
+            if isinstance(end, dict):
+                drafts.append(
+                    (*key, _text(reading.get('event')), position,
+                     _num(end.get('port')), _num(end.get('stbd')))
+                )
+    return {
+        'fact_tanks': tanks,
+        'fact_products': products,
+        'fact_events': events,
+        'fact_drafts': drafts,
+    }
+
+
+def bdr_facts(bdr: dict, key: tuple) -> dict[str, list[tuple]]:
+    """Return the product rows of a BDR, each with the delivery details."""
+    header = (
+        _text(bdr.get('vessel_name')), _text(bdr.get('imo_number')),
+        _text(bdr.get('delivery_port')),
+    )
+    rows = []
+    for p in _list(bdr.get('products')):
+        viscosity = p.get('viscosity')
+        if isinstance(viscosity, dict):
+            viscosity = viscosity.get('value')
+        rows.append(
+            (
+                *key, *header, _text(p.get('product_description')),
+                _num(p.get('weight_mt')), _num(p.get('gross_barrels')),
+                _num(p.get('net_barrels')), _num(p.get('api')), _num(p.get('density')),
+                _num(viscosity), _num(p.get('flash_point_f')), _num(p.get('sulfur_percent')),
+            )
+        )
+    return {'fact_bdr_products': rows}
+
+
+_INSERTS = {
+    'fact_tanks': (
+        "INSERT INTO fact_tanks (request_id, job_id, day, phase, tank, product, api,"
+        " ullage_ft, ullage_in, temp_f, water_bbls, gross_bbls, net_bbls, metric_tons)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'fact_products': (
+        "INSERT INTO fact_products (request_id, job_id, day, product, api,"
+        " gross_bbls, net_bbls, metric_tons) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'fact_events': (
+        "INSERT INTO fact_events (request_id, job_id, day, event, date, time)"
+        " VALUES (?, ?, ?, ?, ?, ?)"
+    ),
+    'fact_drafts': (
+        "INSERT INTO fact_drafts (request_id, job_id, day, event, position, port, stbd)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)"
+    ),
+    'fact_bdr_products': (
+        "INSERT INTO fact_bdr_products (request_id, job_id, day, vessel, imo, port,"
+        " product, weight_mt, gross_bbls, net_bbls, api, density, viscosity,"
+        " flash_point_f, sulfur_percent)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    ),
+}
+
+
+def project(conn, req_id: int) -> None:
+    """Rewrite the fact rows of request ``req_id`` from its JSON columns.
+
+    JSON that does not parse, or does not follow the schemas, yields no rows.
+    """
+    for table in _INSERTS:
+        conn.execute(f"DELETE FROM {table} WHERE request_id=?", (req_id,))
+    row = conn.execute(
+        "SELECT job_id, timestamp, json, bdr_json FROM requests WHERE id=?", (req_id,)
+    ).fetchone()
+    if row is None:
+        return
+    job_id, timestamp, json_text, bdr_text = row
+    report, bdr = _load(json_text), _load(bdr_text)
+    key = (req_id, job_id, _day(report, timestamp))
+    rows = {}
+    if report:
+        rows.update(tank_facts(report, key))
+    if bdr:
+        rows.update(bdr_facts(bdr, key))
+    for table, values in rows.items():
+        if values:
+            conn.executemany(_INSERTS[table], values)
+
+
+def project_all(conn) -> int:
+    """Rebuild every fact row; returns the number of requests projected."""
+    for spec in FACTS.values():
+        if 'rollup' in spec:
+            conn.execute(f"DELETE FROM {spec['table']}_daily")
+    for table in _INSERTS:
+        conn.execute(f"DELETE FROM {table}")
+    ids = [
+        r[0] for r in conn.execute(
+            "SELECT id FROM requests WHERE COALESCE(json, '') != '' OR COALESCE(bdr_json, '') != ''"
+        )
+    ]
+    for req_id in ids:
+        project(conn, req_id)
+    return len(ids)
+
+
+def _parse_measures(fact: str, spec: dict, measures: list[str]) -> list[tuple[str, str]]:
+    parsed = []
+    for measure in measures or ['count']:
+        func, _, column = measure.partition(':')
+        if func == 'count' and not column:
+            parsed.append(('count', ''))
+        elif func in AGGREGATES and column in spec['measures']:
+            parsed.append((func, column))
+        else:
+            raise ValueError(f"Unknown measure for {fact}: {measure}")
+    return parsed
+
+
+def aggregate(
+    conn,
+    fact: str,
+    group_by: list[str],
+    measures: list[str],
+    start: str | None = None,
+    end: str | None = None,
+    job_id: str | None = None,
+    limit: int = 1000,
+) -> list[dict]:
+    """Group the rows of ``fact`` and total ``measures`` over each group.
+
+    ``measures`` are ``<aggregate>:<column>`` such as ``sum:net_bbls``, or
+    ``count``.  ``start`` and ``end`` bound ``day`` inclusively.  Raises
+    ``ValueError`` for unknown facts, columns or aggregates.
+    """
+    spec = FACTS.get(fact)
+    if spec is None:
+        raise ValueError(f"Unknown fact: {fact}")
+    unknown = [d for d in group_by if d not in spec['dimensions']]
+    if unknown:
+        raise ValueError(f"Cannot group {fact} by: {', '.join(unknown)}")
+    parsed = _parse_measures(fact, spec, measures)
+    rollup = spec.get('rollup', ())
+    use_rollup = (
+        not job_id
+        and all(('day' if d in _DERIVED else d) in rollup for d in group_by)
+        and all(func in _ROLLUP_AGGREGATES for func, _ in parsed)
+    )
+
+    columns = []
+    for d in group_by:
+        expr = _DERIVED.get(d, d)
+        columns.append(f"NULLIF({expr}, '') AS {d}" if use_rollup else f"{expr} AS {d}")
+    for func, column in parsed:
+        name = f"{func}_{column}" if column else 'count'
+        if use_rollup:
+            expr = _ROLLUP_AGGREGATES[func].format(m=column) if column else _ROLLUP_ROWS
+        else:
+            expr = f"{func.upper()}({column or '*'})"
+        columns.append(f"{expr} AS {name}")
+    where, params = [], []
+    if start:
+        where.append("day >= ?")
+        params.append(start)
+    if end:
+        # Rollups keep a missing day as '', which sorts before every date.
+        where.append("day <= ? AND day != ''" if use_rollup else "day <= ?")
+        params.append(end)
+    if job_id:
+        where.append("job_id = ?")
+        params.append(job_id)
+    table = f"{spec['table']}_daily" if use_rollup else spec['table']
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    if group_by:
+        keys = ', '.join(str(i) for i in range(1, len(group_by) + 1))
+        sql += f" GROUP BY {keys} ORDER BY {keys}"
+    cur = conn.execute(f"{sql} LIMIT ?", (*params, limit))
+    names = [c[0] for c in cur.description]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
@@ -0,0 +1,168 @@
+"""Hedged vision calls to cut tail latency.
+
+Every vision call records its latency per model.  With ``HEDGE_ENABLED`` a
+call that has not finished within the ``HEDGE_PERCENTILE`` of recent
+latencies for its model gets a duplicate request, optionally to the faster
+``HEDGE_MODEL``.  Whichever answers first wins and the loser is cancelled,
+even while it still waits for response headers (see
+:class:`backend.utils.CancelScope`).
+
+A cancelled loser's run time is recorded as a lower bound of its latency,
+so the slow tail it belongs to keeps counting towards the percentile.  At
+most ``HEDGE_BUDGET`` of the recent calls to a model are hedged.
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'False').lower() == 'true'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+# Model for the duplicate request; empty means the same model.
+HEDGE_MODEL = os.getenv('HEDGE_MODEL', '')
+# Never hedge before this many seconds, whatever the percentile says.
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 2))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+HEDGE_WINDOW = int(os.getenv('HEDGE_WINDOW', 200))
+HEDGE_THREADS = int(os.getenv('HEDGE_THREADS', 32))
+# Largest fraction of the last ``HEDGE_WINDOW`` calls per model that may be hedged.
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', 0.1))
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS)
+
+
+class LatencyTracker:
+    """Rolling window of call latencies per model."""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.window = window
+        self._samples: dict[str, deque] = {}
+        self._hedged: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def record_call(self, model: str, hedged: bool) -> None:
+        """Note whether a call to ``model`` was hedged."""
+        with self._lock:
+            self._hedged.setdefault(model, deque(maxlen=self.window)).append(hedged)
+
+    def hedged_fraction(self, model: str) -> float:
+        with self._lock:
+            calls = self._hedged.get(model)
+            return sum(calls) / len(calls) if calls else 0.0
+
+    def percentile(self, model: str, pct: float, min_samples: int = 1) -> float | None:
+        """Return the ``pct`` percentile (nearest rank) or ``None`` when fewer
+        than ``min_samples`` latencies were recorded for ``model``."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        rank = max(0, min(len(samples) - 1, round(pct / 100 * len(samples)) - 1))
+        return samples[rank]
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                'samples': len(self._samples[model]),
+                'p50': self.percentile(model, 50),
+                'p95': self.percentile(model, 95),
+                'hedged': round(self.hedged_fraction(model), 3),
+            }
+            for model in list(self._samples)
+        }
+
+
+latencies = LatencyTracker()
+
+
+def hedge_delay(model: str) -> float | None:
+    """Seconds to wait before hedging a call to ``model``, or ``None`` when
+    its latencies are not known yet or its hedge budget is spent."""
+    threshold = latencies.percentile(model, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    if threshold is None or latencies.hedged_fraction(model) >= HEDGE_BUDGET:
+        return None
+    return max(threshold, HEDGE_MIN_DELAY)
+
+
+def _streamed_attempt(params: dict, scope, metrics: dict):
+    """Run one streamed attempt inside ``scope``; returns ``(text, model)``
+    or ``None`` when cancelled because the other attempt won."""
+    from backend.utils import chat_completion
+
+    started = time.monotonic()
+    parts = []
+    try:
+        with scope:
+            stream = chat_completion(dict(params, stream=True), metrics)
+            try:
+                for chunk in stream:
+                    if scope.cancelled:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+            finally:
+                # Closing the stream drops the connection so the provider
+                # stops generating the losing response.
+                stream.close()
+    except Exception:
+        if not scope.cancelled:
+            raise
+    # A loser would have taken at least this long.
+    latencies.record(params['model'], time.monotonic() - started)
+    if scope.cancelled:
+        return None
+    return ''.join(parts), params['model']
+
+
+def hedged_completion(params: dict, build_params, metrics: dict | None = None):
+    """Return ``(text, model)`` from the first of a primary and hedge request.
+
+    ``params`` are the primary request's; ``build_params(model)`` builds the
+    duplicate's when ``HEDGE_MODEL`` differs.  Without enough latency history
+    or hedge budget only the primary is sent.
+    """
+    from backend.utils import CancelScope
+
+    model = params['model']
+    hedge_model = HEDGE_MODEL or model
+    scopes = {}
+    # Each attempt records its own latency and usage; the winner's are kept.
+    attempt_metrics = {}
+
+    def submit(attempt_params, name):
+        scope = CancelScope()
+        stats = {}
+        fut = _executor.submit(_streamed_attempt, attempt_params, scope, stats)
+        scopes[fut] = scope
+        attempt_metrics[fut] = stats
+        attempts[fut] = name
+
+    attempts = {}
+    submit(params, 'primary')
+    done, _ = wait(attempts, timeout=hedge_delay(model))
+    if not done:
+        submit(params if hedge_model == model else build_params(hedge_model), 'hedge')
+    latencies.record_call(model, len(attempts) > 1)
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                text, winner = fut.result()
+            except Exception as e:
+                # Keep waiting for the other attempt before giving up.
+                error = e
+                continue
+            for other in pending:
+                scopes[other].cancel()
+            if metrics is not None:
+                metrics.update(attempt_metrics[fut])
+                metrics.update(hedged=len(attempts) > 1, winner=attempts[fut], model_used=winner)
+            return text, winner
+    raise error
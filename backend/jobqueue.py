@@ -0,0 +1,175 @@
+"""Durable extraction queue stored in Redis.
+
+Tasks are JSON payloads kept in a hash and referenced by id from a few lists:
+
+``<name>:pending``     ids waiting for a worker
+``<name>:processing``  ids reserved by a worker
+``<name>:leases``      sorted set of reserved ids scored by lease deadline
+``<name>:dead``        ids that exhausted ``max_attempts``
+
+A worker moves an id from *pending* to *processing* atomically, takes a lease
+and acknowledges the task once it is finished.  When a worker crashes its
+lease runs out and :meth:`RedisWorkQueue.requeue_expired` puts the task back on
+*pending* so another replica picks it up.
+"""
+import os
+import json
+import time
+import uuid
+from dataclasses import dataclass
+
+from redis import Redis
+
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'thread').lower()
+QUEUE_REDIS_URL = os.getenv(
+    'QUEUE_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379')
+)
+QUEUE_NAME = os.getenv('QUEUE_NAME', 'sfk:extract')
+QUEUE_VISIBILITY_TIMEOUT = int(os.getenv('QUEUE_VISIBILITY_TIMEOUT', 300))
+QUEUE_MAX_ATTEMPTS = int(os.getenv('QUEUE_MAX_ATTEMPTS', 3))
+
+
+@dataclass
+class Task:
+    id: str
+    payload: dict
+    attempts: int
+
+
+class RedisWorkQueue:
+    """At-least-once work queue with leases on top of Redis lists."""
+
+    def __init__(
+        self,
+        redis: Redis,
+        name: str = QUEUE_NAME,
+        visibility_timeout: int = QUEUE_VISIBILITY_TIMEOUT,
+        max_attempts: int = QUEUE_MAX_ATTEMPTS,
+    ):
+        self.redis = redis
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.pending_key = f"{name}:pending"
+        self.processing_key = f"{name}:processing"
+        self.leases_key = f"{name}:leases"
+        self.tasks_key = f"{name}:tasks"
+        self.attempts_key = f"{name}:attempts"
+        self.dead_key = f"{name}:dead"
+
+    def enqueue(self, payload: dict) -> str:
+        """Store ``payload`` and make it available to workers."""
+        task_id = uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.hset(self.tasks_key, task_id, json.dumps(payload))
+        pipe.lpush(self.pending_key, task_id)
+        pipe.execute()
+        return task_id
+
+    def reserve(self, timeout: int = 5) -> Task | None:
+        """Block up to ``timeout`` seconds for a task and lease it."""
+        task_id = self.redis.blmove(
+            self.pending_key, self.processing_key, timeout, 'RIGHT', 'LEFT'
+        )
+        if task_id is None:
+            return None
+        if isinstance(task_id, bytes):
+            task_id = task_id.decode()
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.leases_key, {task_id: time.time() + self.visibility_timeout})
+        pipe.hincrby(self.attempts_key, task_id, 1)
+        pipe.hget(self.tasks_key, task_id)
+        _, attempts, raw = pipe.execute()
+        if raw is None:
+            # Acknowledged elsewhere after a duplicate delivery.
+            self._forget(task_id)
+            return None
+        return Task(task_id, json.loads(raw), int(attempts))
+
+    def extend(self, task: Task) -> None:
+        """Push the lease deadline of ``task`` forward (worker heartbeat)."""
+        self.redis.zadd(
+            self.leases_key,
+            {task.id: time.time() + self.visibility_timeout},
+            xx=True,
+        )
+
+    def ack(self, task: Task) -> None:
+        """Mark ``task`` as finished and delete it."""
+        self._forget(task.id)
+
+    def nack(self, task: Task) -> bool:
+        """Return ``task`` to the queue now, or dead-letter it.
+
+        Returns ``True`` when the task was dead-lettered.
+        """
+        if self.redis.zrem(self.leases_key, task.id):
+            return self._release(task.id, task.attempts)
+        return False
+
+    def requeue_expired(self, now: float | None = None, on_dead=None) -> int:
+        """Move tasks whose lease ran out back to *pending*.
+
+        Safe to call from every replica: only the caller that removes the
+        lease re-queues the task.  ``on_dead(task)`` is called for each task
+        dead-lettered instead.  Returns the number of tasks recovered.
+        """
+        if now is None:
+            now = time.time()
+        self._lease_orphans(now)
+        count = 0
+        for raw_id in self.redis.zrangebyscore(self.leases_key, '-inf', now):
+            task_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+            if not self.redis.zrem(self.leases_key, task_id):
+                continue
+            attempts = int(self.redis.hget(self.attempts_key, task_id) or 0)
+            if self._release(task_id, attempts) and on_dead is not None:
+                raw = self.redis.hget(self.tasks_key, task_id)
+                if raw is not None:
+                    on_dead(Task(task_id, json.loads(raw), attempts))
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.redis.llen(self.pending_key),
+            'processing': self.redis.llen(self.processing_key),
+            'dead': self.redis.llen(self.dead_key),
+        }
+
+    def _lease_orphans(self, now: float) -> None:
+        # A worker can die between moving an id to *processing* and taking
+        # the lease.  Give such ids a lease so they expire like any other.
+        for raw_id in self.redis.lrange(self.processing_key, 0, -1):
+            task_id = raw_id.decode() if isinstance(raw_id, bytes) else raw_id
+            self.redis.zadd(
+                self.leases_key,
+                {task_id: now + self.visibility_timeout},
+                nx=True,
+            )
+
+    def _release(self, task_id: str, attempts: int) -> bool:
+        dead = attempts >= self.max_attempts
+        pipe = self.redis.pipeline()
+        pipe.lrem(self.processing_key, 1, task_id)
+        if dead:
+            pipe.lpush(self.dead_key, task_id)
+        else:
+            pipe.rpush(self.pending_key, task_id)
+        pipe.execute()
+        return dead
+
+    def _forget(self, task_id: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.lrem(self.processing_key, 1, task_id)
+        pipe.zrem(self.leases_key, task_id)
+        pipe.hdel(self.tasks_key, task_id)
+        pipe.hdel(self.attempts_key, task_id)
+        pipe.execute()
+
+
+def get_queue() -> RedisWorkQueue | None:
+    """Return the Redis queue when ``QUEUE_BACKEND=redis``, else ``None``."""
+    if QUEUE_BACKEND != 'redis':
+        return None
+    return RedisWorkQueue(Redis.from_url(QUEUE_REDIS_URL))
@@ -0,0 +1,181 @@
+"""Administrative commands for the jobs database.
+
+``migrate`` applies pending schema migrations (see :mod:`backend.migrations`)
+to the jobs database, ``migrate-all`` does the same and then imports any
+per-job files left from older releases.
+
+``import-jobs`` copies the per-job ``<job_id>.db`` files older releases kept
+in ``UPLOAD_FOLDER`` into the consolidated database at ``DB_PATH``.  Jobs
+already present are skipped, so the command can be re-run safely; request
+rows get new ids in the shared ``requests`` table.
+
+``import-uploads`` moves uploads older releases saved flat in
+``UPLOAD_FOLDER`` into the content-addressed store (see :mod:`backend.blobs`).
+An upload preprocessed in place is imported from its ``<file>.orig``.
+
+``rebuild-search`` re-creates the full-text search index and
+``rebuild-facts`` the fact tables (see :mod:`backend.facts`) from the request
+rows, e.g. after restoring a database from a backup taken without them.
+
+Run ``python -m backend.manage --help`` for the command line interface.
+"""
+import os
+import sqlite3
+import argparse
+import datetime
+from pathlib import Path
+
+from backend.utils import UPLOAD_FOLDER, DB_PATH, allowed_file
+from backend import facts
+from backend.models import init_db, job_exists, jobs_db, rebuild_search_index, rebuild_facts
+from backend.migrations import migrate, SCHEMA_VERSION
+from backend.blobs import store, lookup
+
+# Columns copied from a legacy ``requests`` table; older files lack some.
+LEGACY_COLUMNS = (
+    'filename', 'timestamp', 'ip', 'prompt', 'output',
+    'json', 'bdr_json', 'bdr_md', 'status', 'metrics',
+)
+
+
+def legacy_job_files(folder: str = UPLOAD_FOLDER) -> list[Path]:
+    """Return the per-job database files in ``folder``."""
+    skip = {os.path.abspath(DB_PATH), os.path.abspath(os.path.join(folder, 'requests.db'))}
+    return sorted(
+        p for p in Path(folder).glob('*.db') if os.path.abspath(p) not in skip
+    )
+
+
+def _tables(conn) -> set[str]:
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def import_legacy_job(path: Path, db_path: str | None = None) -> int | None:
+    """Import one legacy job file; returns the number of request rows copied
+    or ``None`` when the job was already imported or the file holds no job."""
+    job_id = path.stem
+    if job_exists(job_id, db_path):
+        return None
+    legacy = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = _tables(legacy)
+        if 'requests' not in tables:
+            return None
+        present = {r[1] for r in legacy.execute("PRAGMA table_info(requests)")}
+        select = ', '.join(c if c in present else 'NULL' for c in LEGACY_COLUMNS)
+        rows = legacy.execute(f"SELECT {select} FROM requests ORDER BY id").fetchall()
+        name = ''
+        if 'jobmeta' in tables:
+            row = legacy.execute("SELECT name FROM jobmeta").fetchone()
+            name = (row[0] or '') if row else ''
+        attachments = []
+        if 'job_attachments' in tables:
+            attachments = legacy.execute(
+                "SELECT filename, timestamp FROM job_attachments ORDER BY id"
+            ).fetchall()
+    finally:
+        legacy.close()
+    timestamps = [r[1] for r in rows if r[1]]
+    created = min(timestamps) if timestamps else datetime.datetime.utcfromtimestamp(
+        path.stat().st_mtime
+    ).isoformat()
+    with jobs_db(db_path) as conn:
+        conn.execute(
+            "INSERT INTO jobs (job_id, name, created) VALUES (?, ?, ?)",
+            (job_id, name, created),
+        )
+        conn.executemany(
+            f"INSERT INTO requests (job_id, {', '.join(LEGACY_COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' for _ in LEGACY_COLUMNS)})",
+            [(job_id, *row) for row in rows],
+        )
+        conn.executemany(
+            "INSERT INTO attachments (job_id, filename, timestamp) VALUES (?, ?, ?)",
+            [(job_id, *row) for row in attachments],
+        )
+        for (req_id,) in conn.execute("SELECT id FROM requests WHERE job_id=?", (job_id,)).fetchall():
+            facts.project(conn, req_id)
+    return len(rows)
+
+
+def import_jobs(folder: str = UPLOAD_FOLDER, remove: bool = False, db_path: str | None = None) -> tuple[int, int]:
+    """Import every legacy job file in ``folder``.
+
+    Returns ``(imported, skipped)``.  With ``remove`` the legacy file and its
+    WAL sidecars are deleted once the job is in the consolidated database.
+    """
+    init_db(db_path)
+    imported = skipped = 0
+    for path in legacy_job_files(folder):
+        count = import_legacy_job(path, db_path)
+        if count is None:
+            skipped += 1
+            print(f"{path.stem}: skipped")
+        else:
+            imported += 1
+            print(f"{path.stem}: {count} row(s)")
+        if remove and job_exists(path.stem, db_path):
+            for suffix in ('', '-wal', '-shm'):
+                Path(f"{path}{suffix}").unlink(missing_ok=True)
+    return imported, skipped
+
+
+def import_uploads(folder: str = UPLOAD_FOLDER, remove: bool = False, db_path: str | None = None) -> tuple[int, int]:
+    """Move the flat uploads in ``folder`` into the blob store.
+
+    Returns ``(imported, skipped)``.  With ``remove`` the flat file and its
+    ``.orig`` are deleted once the upload is in the store.
+    """
+    init_db(db_path)
+    imported = skipped = 0
+    for path in sorted(Path(folder).iterdir()):
+        if not path.is_file() or not allowed_file(path.name):
+            continue
+        if lookup(path.name, db_path):
+            skipped += 1
+        else:
+            orig = Path(f"{path}.orig")
+            with open(orig if orig.exists() else path, 'rb') as fh:
+                store(path.name, fh, db_path)
+            imported += 1
+        if remove:
+            path.unlink(missing_ok=True)
+            Path(f"{path}.orig").unlink(missing_ok=True)
+    return imported, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the jobs database.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (
+        ('migrate', "apply pending schema migrations"),
+        ('import-jobs', "import per-job <job_id>.db files into the jobs database"),
+        ('migrate-all', "migrate the jobs database and import per-job files"),
+        ('import-uploads', "move flat uploads into the blob store"),
+        ('rebuild-search', "rebuild the full-text search index"),
+        ('rebuild-facts', "re-project stored JSON into the fact tables"),
+    ):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--db', default=DB_PATH, help="jobs database (default: JOBS_DB_PATH)")
+        if name not in ('migrate', 'rebuild-search', 'rebuild-facts'):
+            p.add_argument('--folder', default=UPLOAD_FOLDER, help="folder holding the legacy files")
+            p.add_argument('--remove', action='store_true', help="delete legacy files once imported")
+    args = parser.parse_args(argv)
+
+    if args.command in ('migrate', 'migrate-all'):
+        applied = migrate(args.db)
+        print(f"{args.db}: {applied} migration(s) applied, schema version {SCHEMA_VERSION}")
+    if args.command in ('import-jobs', 'migrate-all'):
+        imported, skipped = import_jobs(args.folder, args.remove, args.db)
+        print(f"{imported} job(s) imported, {skipped} skipped")
+    if args.command == 'import-uploads':
+        imported, skipped = import_uploads(args.folder, args.remove, args.db)
+        print(f"{imported} upload(s) imported, {skipped} skipped")
+    if args.command == 'rebuild-search':
+        print(f"{rebuild_search_index(args.db)} row(s) indexed")
+    if args.command == 'rebuild-facts':
+        print(f"{rebuild_facts(args.db)} row(s) projected")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""Versioned schema migrations for the jobs database.
+
+Each entry of ``MIGRATIONS`` upgrades the schema by one version.  The version
+a database is at is stored in ``PRAGMA user_version``, so once a database is
+current, checking it costs a single integer read.  Pending migrations run
+together in one ``BEGIN IMMEDIATE`` transaction, which also keeps the web and
+worker processes from migrating the same file at once.
+
+Append new migrations to the list; never edit or reorder released ones.
+"""
+import os
+import sqlite3
+
+
+def _columns(conn, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _initial_schema(conn) -> None:
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL DEFAULT '',
+            created TEXT
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            filename TEXT,
+            timestamp TEXT,
+            ip TEXT,
+            prompt TEXT,
+            output TEXT,
+            json TEXT,
+            bdr_json TEXT,
+            bdr_md TEXT,
+            status TEXT,
+            metrics TEXT
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            filename TEXT,
+            timestamp TEXT
+        )"""
+    )
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_jobs_name ON jobs(name)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_job ON requests(job_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_filename ON requests(filename)",
+        "CREATE INDEX IF NOT EXISTS idx_attachments_job ON attachments(job_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_attachments_filename ON attachments(filename)",
+    ):
+        conn.execute(statement)
+
+
+def _job_summary(conn) -> None:
+    """Latest request and row count per job, kept current by triggers."""
+    cols = _columns(conn, 'jobs')
+    for column, ddl in (
+        ("last_request_id", "INTEGER"),
+        ("last_filename", "TEXT"),
+        ("last_timestamp", "TEXT"),
+        ("last_ip", "TEXT"),
+        ("row_count", "INTEGER NOT NULL DEFAULT 0"),
+    ):
+        if column not in cols:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_last_request ON jobs(last_request_id)"
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_summary_insert
+           AFTER INSERT ON requests BEGIN
+               UPDATE jobs SET
+                   last_request_id = NEW.id,
+                   last_filename = NEW.filename,
+                   last_timestamp = NEW.timestamp,
+                   last_ip = NEW.ip,
+                   row_count = row_count + 1
+               WHERE job_id = NEW.job_id;
+           END"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_summary_delete
+           AFTER DELETE ON requests BEGIN
+               UPDATE jobs SET
+                   (last_request_id, last_filename, last_timestamp, last_ip) = (
+                       SELECT id, filename, timestamp, ip FROM requests
+                       WHERE job_id = OLD.job_id ORDER BY id DESC LIMIT 1
+                   ),
+                   row_count = row_count - 1
+               WHERE job_id = OLD.job_id;
+           END"""
+    )
+    conn.execute(
+        """UPDATE jobs SET
+               (last_request_id, last_filename, last_timestamp, last_ip) = (
+                   SELECT id, filename, timestamp, ip FROM requests
+                   WHERE job_id = jobs.job_id ORDER BY id DESC LIMIT 1
+               ),
+               row_count = (SELECT COUNT(*) FROM requests WHERE job_id = jobs.job_id)"""
+    )
+
+
+def _request_versions(conn) -> None:
+    """Per-row edit version, bumped by any write to an editable column."""
+    conn.execute("ALTER TABLE requests ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_version
+           AFTER UPDATE OF prompt, output, json, bdr_json, bdr_md ON requests BEGIN
+               UPDATE requests SET version = OLD.version + 1 WHERE id = NEW.id;
+           END"""
+    )
+
+
+def _blob_store(conn) -> None:
+    """Content-addressed upload blobs and the upload names pointing at them."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created TEXT
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS files (
+            name TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            created TEXT
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash)")
+
+
+def _search_index(conn) -> None:
+    """FTS5 index over job names and request results, kept current by triggers.
+
+    The index stores its own copy of the text rather than reading it from
+    ``requests``, so deleting a job never needs the old values to unindex it.
+    """
+    conn.execute(
+        """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            job_name, output, json, bdr_md, bdr_json,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_search_insert
+           AFTER INSERT ON requests BEGIN
+               INSERT INTO search_index (rowid, job_name, output, json, bdr_md, bdr_json)
+               VALUES (
+                   NEW.id, (SELECT name FROM jobs WHERE job_id = NEW.job_id),
+                   NEW.output, NEW.json, NEW.bdr_md, NEW.bdr_json
+               );
+           END"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_search_update
+           AFTER UPDATE OF output, json, bdr_md, bdr_json ON requests BEGIN
+               UPDATE search_index SET
+                   output = NEW.output, json = NEW.json,
+                   bdr_md = NEW.bdr_md, bdr_json = NEW.bdr_json
+               WHERE rowid = NEW.id;
+           END"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_search_delete
+           AFTER DELETE ON requests BEGIN
+               DELETE FROM search_index WHERE rowid = OLD.id;
+           END"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS jobs_search_name
+           AFTER UPDATE OF name ON jobs BEGIN
+               UPDATE search_index SET job_name = NEW.name
+               WHERE rowid IN (SELECT id FROM requests WHERE job_id = NEW.job_id);
+           END"""
+    )
+    fill_search_index(conn)
+
+
+def fill_search_index(conn) -> None:
+    """Index every request row; the index is expected to be empty."""
+    conn.execute(
+        """INSERT INTO search_index (rowid, job_name, output, json, bdr_md, bdr_json)
+           SELECT r.id, j.name, r.output, r.json, r.bdr_md, r.bdr_json
+           FROM requests r LEFT JOIN jobs j ON j.job_id = r.job_id"""
+    )
+
+
+def _rollup(conn, fact: str, dimensions: tuple, measures: tuple) -> None:
+    """Create ``<fact>_daily`` with per-group row counts and measure totals,
+    kept current by triggers on ``fact``.
+
+    NULL dimensions are stored as '' so every group has one key.  Each measure
+    ``m`` has ``m_sum`` and ``m_n``, the count of non-NULL values, so sums and
+    averages skip NULLs the way SQL aggregates do.
+    """
+    table = f"{fact}_daily"
+    totals = ', '.join(f"{m}_sum REAL NOT NULL DEFAULT 0, {m}_n INTEGER NOT NULL DEFAULT 0" for m in measures)
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {table} (
+            {', '.join(f"{d} TEXT NOT NULL" for d in dimensions)},
+            rows INTEGER NOT NULL DEFAULT 0,
+            {totals},
+            PRIMARY KEY ({', '.join(dimensions)})
+        )"""
+    )
+    keys = ', '.join(f"IFNULL(NEW.{d}, '')" for d in dimensions)
+    measure_columns = ', '.join(f"{m}_sum, {m}_n" for m in measures)
+    measure_values = ', '.join(f"IFNULL(NEW.{m}, 0), NEW.{m} IS NOT NULL" for m in measures)
+    added = ', '.join(
+        f"{m}_sum = {m}_sum + excluded.{m}_sum, {m}_n = {m}_n + excluded.{m}_n" for m in measures
+    )
+    removed = ', '.join(
+        f"{m}_sum = {m}_sum - IFNULL(OLD.{m}, 0), {m}_n = {m}_n - (OLD.{m} IS NOT NULL)"
+        for m in measures
+    )
+    match = ' AND '.join(f"{d} = IFNULL(OLD.{d}, '')" for d in dimensions)
+    conn.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {fact}_rollup_insert
+            AFTER INSERT ON {fact} BEGIN
+                INSERT INTO {table} ({', '.join(dimensions)}, rows, {measure_columns})
+                VALUES ({keys}, 1, {measure_values})
+                ON CONFLICT ({', '.join(dimensions)}) DO UPDATE SET
+                    rows = rows + 1, {added};
+            END"""
+    )
+    conn.execute(
+        f"""CREATE TRIGGER IF NOT EXISTS {fact}_rollup_delete
+            AFTER DELETE ON {fact} BEGIN
+                UPDATE {table} SET rows = rows - 1, {removed} WHERE {match};
+                DELETE FROM {table} WHERE {match} AND rows <= 0;
+            END"""
+    )
+
+
+def _fact_tables(conn) -> None:
+    """Typed rows projected from the TankReport and BDR JSON (see ``facts``),
+    with daily rollups of the tank, product and BDR product rows.
+
+    The tables start empty: the projection changes with ``facts``, so it is
+    not frozen into this step.  ``manage rebuild-facts`` fills them for rows
+    written before the upgrade.
+    """
+    key = "request_id INTEGER NOT NULL, job_id TEXT NOT NULL, day TEXT"
+    for table, columns in (
+        ("fact_tanks", "phase TEXT, tank TEXT, product TEXT, api REAL, ullage_ft REAL, "
+                       "ullage_in REAL, temp_f REAL, water_bbls REAL, gross_bbls REAL, "
+                       "net_bbls REAL, metric_tons REAL"),
+        ("fact_products", "product TEXT, api REAL, gross_bbls REAL, net_bbls REAL, "
+                          "metric_tons REAL"),
+        ("fact_events", "event TEXT, date TEXT, time TEXT"),
+        ("fact_drafts", "event TEXT, position TEXT, port REAL, stbd REAL"),
+        ("fact_bdr_products", "vessel TEXT, imo TEXT, port TEXT, product TEXT, "
+                              "weight_mt REAL, gross_bbls REAL, net_bbls REAL, api REAL, "
+                              "density REAL, viscosity REAL, flash_point_f REAL, "
+                              "sulfur_percent REAL"),
+    ):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key}, {columns})")
+        for column in ("request_id", "job_id", "day"):
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table}({column})"
+            )
+    _rollup(
+        conn, "fact_tanks", ("day", "phase", "product"),
+        ("api", "ullage_ft", "ullage_in", "temp_f", "water_bbls", "gross_bbls",
+         "net_bbls", "metric_tons"),
+    )
+    _rollup(
+        conn, "fact_products", ("day", "product"),
+        ("api", "gross_bbls", "net_bbls", "metric_tons"),
+    )
+    _rollup(
+        conn, "fact_bdr_products", ("day", "vessel", "port", "product"),
+        ("weight_mt", "gross_bbls", "net_bbls", "api", "density", "viscosity",
+         "flash_point_f", "sulfur_percent"),
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS requests_facts_delete
+           AFTER DELETE ON requests BEGIN
+               DELETE FROM fact_tanks WHERE request_id = OLD.id;
+               DELETE FROM fact_products WHERE request_id = OLD.id;
+               DELETE FROM fact_events WHERE request_id = OLD.id;
+               DELETE FROM fact_drafts WHERE request_id = OLD.id;
+               DELETE FROM fact_bdr_products WHERE request_id = OLD.id;
+           END"""
+    )
+
+
+MIGRATIONS = [
+    _initial_schema,
+    _job_summary,
+    _request_versions,
+    _blob_store,
+    _search_index,
+    _fact_tables,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(path: str) -> int:
+    """Bring the database at ``path`` up to ``SCHEMA_VERSION``.
+
+    Returns the number of migrations applied.  A database newer than this
+    code raises ``RuntimeError`` rather than being touched.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        version = schema_version(conn)
+        if version == SCHEMA_VERSION:
+            return 0
+        applied = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock.
+            version = schema_version(conn)
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(
+                    f"{path} is at schema version {version}, newer than {SCHEMA_VERSION}"
+                )
+            for number in range(version + 1, SCHEMA_VERSION + 1):
+                MIGRATIONS[number - 1](conn)
+                applied += 1
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return applied
+    finally:
+        conn.close()
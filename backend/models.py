@@ -1,115 +1,503 @@
 import os
+import re
+import json
+import hashlib
 import datetime
 
-from backend.utils import UPLOAD_FOLDER, get_db, DB_PATH
+from backend.utils import get_db, DB_PATH
+from backend.migrations import migrate, fill_search_index
+from backend import facts
 
+# Columns of a request row the job page lets users edit.
+EDITABLE_FIELDS = ('prompt', 'output', 'json', 'bdr_json', 'bdr_md')
 
-def init_db(path: str = DB_PATH):
-    """Initialize a ``requests`` table in the SQLite database at ``path``.
+# bm25 weights of the search_index columns: job_name, output, json, bdr_md,
+# bdr_json.  Matches in the job name rank first; JSON repeats the markdown.
+SEARCH_WEIGHTS = (5.0, 1.0, 0.5, 1.0, 0.5)
+# Delimiters ``search_requests`` puts around matched terms in snippets.
+MATCH_START, MATCH_END = '\x02', '\x03'
 
-    If the table already exists but is missing the ``json`` column, it will be
-    added automatically so older databases continue to work with newer code.
+
+class StaleEditError(ValueError):
+    """Rows changed since the edit form was rendered; nothing was saved."""
+
+    def __init__(self, req_ids: list[int]):
+        self.req_ids = req_ids
+        super().__init__(f"Rows changed since they were loaded: {', '.join(map(str, req_ids))}")
+
+
+def jobs_db(db_path: str | None = None):
+    """Open the jobs database; ``DB_PATH`` is looked up at call time so tests
+    and tools can point the whole module at another file."""
+    return get_db(db_path or DB_PATH)
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def init_db(path: str | None = None) -> None:
+    """Create or upgrade the jobs database at ``path`` (default ``DB_PATH``).
+
+    Every job lives in the one database; rows are keyed by ``job_id`` and
+    indexed on the columns the history and search views filter on.  Schema
+    changes are versioned in :mod:`backend.migrations`, so calling this on a
+    current database only reads ``PRAGMA user_version``.  Older per-job files
+    are brought in with ``python -m backend.manage import-jobs``.
     """
-    with get_db(path) as conn:
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT,
-                timestamp TEXT,
-                ip TEXT,
-                prompt TEXT,
-                output TEXT,
-                json TEXT,
-                bdr_json TEXT,
-                bdr_md TEXT
-            )"""
-        )
-        # Upgrade schema if ``json`` column is missing (for databases created
-        # before this column was introduced).
-        cols = [row[1] for row in conn.execute("PRAGMA table_info(requests)")]
-        if "json" not in cols:
-            conn.execute("ALTER TABLE requests ADD COLUMN json TEXT")
-        if "bdr_json" not in cols:
-            conn.execute("ALTER TABLE requests ADD COLUMN bdr_json TEXT")
-        if "bdr_md" not in cols:
-            conn.execute("ALTER TABLE requests ADD COLUMN bdr_md TEXT")
-        # Table for storing per-job metadata such as the job name
+    migrate(path or DB_PATH)
+
+
+def create_job(job_id: str, name: str = '', db_path: str | None = None) -> None:
+    """Register ``job_id``; does nothing when the job already exists."""
+    with jobs_db(db_path) as conn:
         conn.execute(
-            "CREATE TABLE IF NOT EXISTS jobmeta (name TEXT)"
+            "INSERT OR IGNORE INTO jobs (job_id, name, created) VALUES (?, ?, ?)",
+            (job_id, name, _now()),
         )
-        row = conn.execute("SELECT name FROM jobmeta").fetchone()
-        if row is None:
-            conn.execute("INSERT INTO jobmeta (name) VALUES ('')")
-        # Table for storing additional documents uploaded for the job
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS job_attachments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT,
-                timestamp TEXT
-            )"""
+
+
+def job_exists(job_id: str, db_path: str | None = None) -> bool:
+    with jobs_db(db_path) as conn:
+        row = conn.execute("SELECT 1 FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+    return row is not None
+
+
+def delete_job(job_id: str, db_path: str | None = None) -> list[str]:
+    """Remove a job with its request and attachment rows.
+
+    Returns the upload names of the job that no other job refers to, so the
+    caller can delete their files.
+    """
+    with jobs_db(db_path) as conn:
+        names = {
+            row[0]
+            for row in conn.execute(
+                """SELECT filename FROM requests WHERE job_id=?
+                   UNION SELECT filename FROM attachments WHERE job_id=?""",
+                (job_id, job_id),
+            )
+            if row[0]
+        }
+        # The job row goes first so the summary trigger has nothing to update.
+        conn.execute("DELETE FROM jobs WHERE job_id=?", (job_id,))
+        conn.execute("DELETE FROM requests WHERE job_id=?", (job_id,))
+        conn.execute("DELETE FROM attachments WHERE job_id=?", (job_id,))
+        # Retried requests reuse the upload of the job they came from.
+        return sorted(
+            name
+            for name in names
+            if conn.execute(
+                """SELECT 1 FROM requests WHERE filename=?
+                   UNION ALL SELECT 1 FROM attachments WHERE filename=? LIMIT 1""",
+                (name, name),
+            ).fetchone()
+            is None
         )
 
 
+def list_jobs(
+    limit: int = 50, before: int | None = None, db_path: str | None = None
+) -> tuple[list[dict], int | None]:
+    """Return one page of jobs with at least one request, newest first.
+
+    Pages are keyed on the id of each job's latest request: pass the returned
+    cursor as ``before`` to fetch the next page, ``None`` means there is none.
+    """
+    where = "last_request_id < ?" if before is not None else "last_request_id IS NOT NULL"
+    params = (before,) if before is not None else ()
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            f"""SELECT job_id, name, last_filename, last_timestamp, last_ip,
+                       row_count, last_request_id
+                FROM jobs WHERE {where}
+                ORDER BY last_request_id DESC LIMIT ?""",
+            (*params, limit + 1),
+        ).fetchall()
+    jobs = [
+        {
+            "job_id": r[0],
+            "job_name": r[1],
+            "filename": r[2],
+            "timestamp": r[3],
+            "ip": r[4],
+            "rows": r[5],
+        }
+        for r in rows[:limit]
+    ]
+    cursor = rows[limit - 1][6] if len(rows) > limit else None
+    return jobs, cursor
+
+
 def log_request(
+    job_id: str,
     filename: str,
     ip: str,
     prompt: str,
     output: str,
-    db_path: str = DB_PATH,
     json_text: str = "",
     bdr_json_text: str = "",
     bdr_md_text: str = "",
-):
-    """Insert a request row into the database at ``db_path``."""
-    with get_db(db_path) as conn:
+    status: str = "done",
+    metrics: dict | None = None,
+    db_path: str | None = None,
+) -> int:
+    """Insert a request row for ``job_id``, creating the job if needed.
+
+    ``status`` is ``pending`` for rows queued for background extraction and
+    ``done`` (or ``error``) once the output is known.  ``metrics`` holds the
+    vision call measurements (payload bytes, image tokens, latency).
+    Returns the row id.
+    """
+    timestamp = _now()
+    with jobs_db(db_path) as conn:
         conn.execute(
-            "INSERT INTO requests (filename, timestamp, ip, prompt, output, json, bdr_json, bdr_md) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            "INSERT OR IGNORE INTO jobs (job_id, name, created) VALUES (?, '', ?)",
+            (job_id, timestamp),
+        )
+        cur = conn.execute(
+            "INSERT INTO requests (job_id, filename, timestamp, ip, prompt, output, json, bdr_json, bdr_md, status, metrics) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (
+                job_id,
                 filename,
-                datetime.datetime.utcnow().isoformat(),
+                timestamp,
                 ip,
                 prompt,
                 output,
                 json_text,
                 bdr_json_text,
                 bdr_md_text,
+                status,
+                json.dumps(metrics) if metrics else None,
+            ),
+        )
+        if json_text or bdr_json_text:
+            facts.project(conn, cur.lastrowid)
+        return cur.lastrowid
+
+
+def set_request_status(
+    job_id: str, req_id: int, status: str, db_path: str | None = None
+) -> None:
+    """Update the processing status of a single request row."""
+    with jobs_db(db_path) as conn:
+        conn.execute(
+            "UPDATE requests SET status=? WHERE id=? AND job_id=?",
+            (status, req_id, job_id),
+        )
+
+
+def set_request_output(
+    job_id: str,
+    req_id: int,
+    prompt: str,
+    output: str,
+    status: str = "done",
+    json_text: str | None = None,
+    metrics: dict | None = None,
+    db_path: str | None = None,
+) -> None:
+    """Store the extraction result for a request row and mark it finished.
+
+    ``json_text`` is written too when the pipeline produced JSON directly.
+    """
+    with jobs_db(db_path) as conn:
+        conn.execute(
+            "UPDATE requests SET prompt=?, output=?, status=?, metrics=? WHERE id=? AND job_id=?",
+            (
+                prompt,
+                output,
+                status,
+                json.dumps(metrics) if metrics else None,
+                req_id,
+                job_id,
             ),
         )
+        if json_text is not None:
+            cur = conn.execute(
+                "UPDATE requests SET json=? WHERE id=? AND job_id=?",
+                (json_text, req_id, job_id),
+            )
+            if cur.rowcount:
+                facts.project(conn, req_id)
+
+
+def set_request_partial(
+    job_id: str, req_id: int, output: str, db_path: str | None = None
+) -> None:
+    """Store partially streamed output while a request is still running."""
+    with jobs_db(db_path) as conn:
+        conn.execute(
+            "UPDATE requests SET output=? WHERE id=? AND job_id=? AND status='running'",
+            (output, req_id, job_id),
+        )
+
+
+def _update_row(conn, job_id: str, req_id: int, fields: dict) -> int:
+    unknown = set(fields) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Not editable: {', '.join(sorted(unknown))}")
+    if not fields:
+        return 0
+    assignments = ', '.join(f"{name}=?" for name in fields)
+    cur = conn.execute(
+        f"UPDATE requests SET {assignments} WHERE id=? AND job_id=?",
+        (*fields.values(), req_id, job_id),
+    )
+    if cur.rowcount and {'json', 'bdr_json'} & fields.keys():
+        facts.project(conn, req_id)
+    return cur.rowcount
 
 
-def get_job_name(db_path: str = DB_PATH) -> str:
-    """Return the stored name for the job database at ``db_path``."""
-    with get_db(db_path) as conn:
-        row = conn.execute("SELECT name FROM jobmeta").fetchone()
+def update_request(job_id: str, req_id: int, db_path: str | None = None, **fields) -> bool:
+    """Overwrite editable columns (see ``EDITABLE_FIELDS``) of one row.
+
+    Returns ``False`` when no row ``req_id`` belongs to ``job_id``.
+    """
+    with jobs_db(db_path) as conn:
+        return _update_row(conn, job_id, req_id, fields) > 0
+
+
+def field_digest(value: str | None) -> str:
+    """Short digest of a text field, ignoring the CRLF newlines browsers
+    submit textareas with."""
+    text = (value or '').replace('\r\n', '\n')
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def save_edits(
+    job_id: str, edits: list[tuple[int, int, dict]], db_path: str | None = None
+) -> int:
+    """Write ``(req_id, version, {field: value})`` edits in one transaction.
+
+    ``version`` is the row version the edit was based on.  Rows are grouped
+    by the set of fields they change and written with one ``executemany``
+    per group.  If any row's version moved, nothing is written and
+    :class:`StaleEditError` names the stale rows.  Returns the rows updated.
+    """
+    groups: dict[tuple, list] = {}
+    for req_id, version, fields in edits:
+        unknown = set(fields) - set(EDITABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Not editable: {', '.join(sorted(unknown))}")
+        if fields:
+            names = tuple(sorted(fields))
+            groups.setdefault(names, []).append(
+                (*(fields[n] for n in names), req_id, job_id, version)
+            )
+    if not groups:
+        return 0
+    wanted = {req_id: version for req_id, version, fields in edits if fields}
+    marks = ', '.join('?' for _ in wanted)
+    with jobs_db(db_path) as conn:
+        # Take the write lock before comparing versions so no other writer
+        # can slip in between the check and the update.
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        current = dict(conn.execute(
+            f"SELECT id, version FROM requests WHERE job_id=? AND id IN ({marks})",
+            (job_id, *wanted),
+        ).fetchall())
+        stale = sorted(i for i, v in wanted.items() if current.get(i) != v)
+        if stale:
+            raise StaleEditError(stale)
+        updated = 0
+        for names, params in groups.items():
+            assignments = ', '.join(f"{name}=?" for name in names)
+            cur = conn.executemany(
+                f"UPDATE requests SET {assignments} WHERE id=? AND job_id=? AND version=?",
+                params,
+            )
+            updated += cur.rowcount
+        for req_id, version, fields in edits:
+            if {'json', 'bdr_json'} & fields.keys():
+                facts.project(conn, req_id)
+    return updated
+
+
+def get_request_statuses(job_id: str, db_path: str | None = None) -> list[dict]:
+    """Return ``id``, ``filename``, ``status``, ``prompt`` and ``output`` per row.
+
+    Rows written before background processing existed have no status and are
+    reported as ``done``.
+    """
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            "SELECT id, filename, status, prompt, output FROM requests WHERE job_id=? ORDER BY id",
+            (job_id,),
+        ).fetchall()
+    return [
+        {
+            "id": r[0],
+            "filename": r[1],
+            "status": r[2] or "done",
+            "prompt": r[3],
+            "output": r[4],
+        }
+        for r in rows
+    ]
+
+
+_ROW_COLUMNS = ('id', 'filename', 'prompt', 'output', 'json', 'bdr_json', 'bdr_md', 'status', 'version')
+
+
+def _row_dict(row) -> dict:
+    data = dict(zip(_ROW_COLUMNS, row))
+    data['status'] = data['status'] or 'done'
+    return data
+
+
+def get_requests(job_id: str, db_path: str | None = None) -> list[dict]:
+    """Return every request row of ``job_id`` with all editable columns."""
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(_ROW_COLUMNS)} FROM requests WHERE job_id=? ORDER BY id",
+            (job_id,),
+        ).fetchall()
+    return [_row_dict(r) for r in rows]
+
+
+def get_request(job_id: str, req_id: int, db_path: str | None = None) -> dict | None:
+    """Return one request row of ``job_id`` or ``None``."""
+    with jobs_db(db_path) as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(_ROW_COLUMNS)} FROM requests WHERE id=? AND job_id=?",
+            (req_id, job_id),
+        ).fetchone()
+    return _row_dict(row) if row else None
+
+
+def get_job_name(job_id: str, db_path: str | None = None) -> str:
+    """Return the stored name of ``job_id``."""
+    with jobs_db(db_path) as conn:
+        row = conn.execute("SELECT name FROM jobs WHERE job_id=?", (job_id,)).fetchone()
         return row[0] if row else ""
 
 
-def set_job_name(name: str, db_path: str = DB_PATH) -> None:
-    """Update the name for the job database at ``db_path``."""
-    with get_db(db_path) as conn:
-        row = conn.execute("SELECT name FROM jobmeta").fetchone()
-        if row is None:
-            conn.execute("INSERT INTO jobmeta (name) VALUES (?)", (name,))
-        else:
-            conn.execute("UPDATE jobmeta SET name=?", (name,))
+def set_job_name(job_id: str, name: str, db_path: str | None = None) -> None:
+    """Update the name of ``job_id``."""
+    with jobs_db(db_path) as conn:
+        conn.execute("UPDATE jobs SET name=? WHERE job_id=?", (name, job_id))
 
 
-def add_attachment(filename: str, db_path: str = DB_PATH) -> None:
-    """Insert a record into the ``job_attachments`` table."""
-    with get_db(db_path) as conn:
+def add_attachment(job_id: str, filename: str, db_path: str | None = None) -> None:
+    """Insert a record into the ``attachments`` table."""
+    with jobs_db(db_path) as conn:
         conn.execute(
-            "INSERT INTO job_attachments (filename, timestamp) VALUES (?, ?)",
-            (filename, datetime.datetime.utcnow().isoformat()),
+            "INSERT INTO attachments (job_id, filename, timestamp) VALUES (?, ?, ?)",
+            (job_id, filename, _now()),
         )
 
 
-def get_attachments(db_path: str = DB_PATH) -> list[dict]:
-    """Return a list of attachment dictionaries for the job DB."""
-    with get_db(db_path) as conn:
+def get_attachments(job_id: str, db_path: str | None = None) -> list[dict]:
+    """Return a list of attachment dictionaries for ``job_id``."""
+    with jobs_db(db_path) as conn:
         rows = conn.execute(
-            "SELECT id, filename, timestamp FROM job_attachments ORDER BY id"
+            "SELECT id, filename, timestamp FROM attachments WHERE job_id=? ORDER BY id",
+            (job_id,),
         ).fetchall()
     return [
         {"id": r[0], "filename": r[1], "timestamp": r[2]}
         for r in rows
     ]
+
+
+def bdr_image_path(job_id: str, filename: str, db_path: str | None = None) -> str:
+    """Return the image BDR tables are extracted from for a request.
+
+    The most recent job attachment wins over the request's own image.
+    """
+    from backend.blobs import upload_path
+
+    attachments = get_attachments(job_id, db_path)
+    if attachments:
+        att_path = upload_path(attachments[-1]["filename"], db_path)
+        if os.path.exists(att_path):
+            return att_path
+    return upload_path(filename, db_path)
+
+
+def search_query(text: str) -> str:
+    """Turn user input into an FTS5 query matching rows with every term.
+
+    ``"quoted phrases"`` stay phrases and a trailing ``*`` matches a prefix;
+    anything else FTS5 would read as syntax is searched for literally.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        prefix = word.endswith('*')
+        term = (phrase or word.rstrip('*')).strip()
+        if term:
+            quoted = '"' + term.replace('"', '""') + '"'
+            terms.append(quoted + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_requests(
+    text: str, limit: int = 20, offset: int = 0, db_path: str | None = None
+) -> tuple[list[dict], bool]:
+    """Return ranked request rows matching ``text`` and whether more follow.
+
+    Each row carries a ``snippet`` of its best matching column with matched
+    terms between ``MATCH_START`` and ``MATCH_END``.
+    """
+    query = search_query(text)
+    if not query:
+        return [], False
+    weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+    with jobs_db(db_path) as conn:
+        rows = conn.execute(
+            f"""SELECT r.id, r.job_id, j.name, r.filename, r.timestamp,
+                       snippet(search_index, -1, ?, ?, '…', 16)
+                FROM search_index
+                JOIN requests r ON r.id = search_index.rowid
+                JOIN jobs j ON j.job_id = r.job_id
+                WHERE search_index MATCH ?
+                ORDER BY bm25(search_index, {weights})
+                LIMIT ? OFFSET ?""",
+            (MATCH_START, MATCH_END, query, limit + 1, offset),
+        ).fetchall()
+    results = [
+        {
+            'id': r[0],
+            'job_id': r[1],
+            'job_name': r[2],
+            'filename': r[3],
+            'timestamp': r[4],
+            'snippet': r[5],
+        }
+        for r in rows[:limit]
+    ]
+    return results, len(rows) > limit
+
+
+def rebuild_search_index(db_path: str | None = None) -> int:
+    """Re-index every request row; returns the number of rows indexed."""
+    init_db(db_path)
+    with jobs_db(db_path) as conn:
+        conn.execute("DELETE FROM search_index")
+        fill_search_index(conn)
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        return conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0]
+
+
+def aggregate_facts(
+    fact: str,
+    group_by: list[str],
+    measures: list[str],
+    start: str | None = None,
+    end: str | None = None,
+    job_id: str | None = None,
+    limit: int = 1000,
+    db_path: str | None = None,
+) -> list[dict]:
+    """Group and total the rows of a fact table; see :func:`facts.aggregate`."""
+    with jobs_db(db_path) as conn:
+        return facts.aggregate(conn, fact, group_by, measures, start, end, job_id, limit)
+
+
+def rebuild_facts(db_path: str | None = None) -> int:
+    """Re-project every request's JSON; returns the number of requests."""
+    init_db(db_path)
+    with jobs_db(db_path) as conn:
+        return facts.project_all(conn)
@@ -0,0 +1,162 @@
+"""Client-side admission control for model calls.
+
+:class:`AdaptiveLimiter` caps how many calls are in flight across every
+worker thread.  The cap grows by one slot per window of successful calls and
+halves whenever the provider answers 429 (AIMD), so throughput settles just
+below the provider's limit.  ``Retry-After`` and ``x-ratelimit-reset-*``
+headers pause all callers until the provider is ready again, and an optional
+token bucket (``OPENAI_RPM``) keeps the request rate under a known quota.
+"""
+import os
+import re
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+OPENAI_CONCURRENCY = int(os.getenv('OPENAI_CONCURRENCY', 16))
+OPENAI_MIN_CONCURRENCY = int(os.getenv('OPENAI_MIN_CONCURRENCY', 1))
+# Requests per minute allowed by the account; 0 disables the token bucket.
+OPENAI_RPM = float(os.getenv('OPENAI_RPM', 0))
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', 0.5))
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', 30))
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse ``"2"``, ``"1.5s"``, ``"20ms"`` or ``"6m0s"`` into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or ''.join(n + u for n, u in parts) != value:
+        return None
+    return sum(float(n) * _UNITS[u] for n, u in parts)
+
+
+def retry_after(headers) -> float | None:
+    """Return how long the provider asked us to wait, in seconds."""
+    if not headers:
+        return None
+    ms = headers.get('retry-after-ms')
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value:
+        seconds = parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    waits = []
+    for kind in ('requests', 'tokens'):
+        if headers.get(f'x-ratelimit-remaining-{kind}') == '0':
+            wait = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            if wait is not None:
+                waits.append(wait)
+    return max(waits) if waits else None
+
+
+def backoff_delay(
+    attempt: int,
+    hint: float | None = None,
+    base: float | None = None,
+    cap: float | None = None,
+) -> float:
+    """Exponential backoff with full jitter, never shorter than ``hint``."""
+    base = OPENAI_BACKOFF_BASE if base is None else base
+    cap = OPENAI_BACKOFF_MAX if cap is None else cap
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, hint or 0.0)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit plus an optional requests-per-minute bucket."""
+
+    def __init__(
+        self,
+        max_concurrency: int = OPENAI_CONCURRENCY,
+        min_concurrency: int = OPENAI_MIN_CONCURRENCY,
+        rpm: float = OPENAI_RPM,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.rate = rpm / 60
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.in_flight = 0
+        self.throttled = 0
+        self.blocked_until = 0.0
+        self._refilled = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _wait_time(self, now: float) -> float | None:
+        """Seconds until a call may start, ``0`` if it may start now and
+        ``None`` when it has to wait for a slot to be released."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate:
+            self._refill(now)
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+        return 0
+
+    def acquire(self) -> None:
+        """Block until a call may be sent and take a slot for it."""
+        with self._cond:
+            while True:
+                wait = self._wait_time(time.monotonic())
+                if wait == 0:
+                    break
+                self._cond.wait(wait)
+            self.in_flight += 1
+            if self.rate:
+                self.tokens -= 1
+
+    def release(self, throttled: bool = False, retry_after: float | None = None) -> None:
+        """Return a slot and adapt the limit to the call's outcome."""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                if retry_after:
+                    self.blocked_until = max(
+                        self.blocked_until, time.monotonic() + retry_after
+                    )
+            else:
+                # One more slot after roughly ``limit`` successful calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'max': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'throttled': self.throttled,
+                'paused_for': round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            }
+
+
+limiter = AdaptiveLimiter()
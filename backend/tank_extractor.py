@@ -0,0 +1,279 @@
+import re
+import datetime
+from typing import Any, Dict, List
+
+# Column headers requested by ``generate_prompt`` mapped to TankReport keys.
+_TANK_COLUMNS = {
+    "tank": "tank",
+    "product name": "productName",
+    "api": "api",
+    "ullage (ft)": "ullageFt",
+    "ullage (in)": "ullageIn",
+    "temp (°f)": "tempF",
+    "water (bbls)": "waterBbls",
+    "gross bbls": "grossBbls",
+    "net bbls": "netBbls",
+    "metric tons": "metricTons",
+}
+_PRODUCT_COLUMNS = {
+    "product discharged": "productName",
+    "api": "api",
+    "gross bbls": "grossBbls",
+    "net bbls": "netBbls",
+    "metric tons": "metricTons",
+}
+_EVENT_COLUMNS = {"event": "event", "date": "date", "time": "time"}
+_DRAFT_COLUMNS = {
+    "arrival/departure": "event",
+    "fwd/aft": "end",
+    "port": "port",
+    "stbd.": "stbd",
+    "stbd": "stbd",
+}
+_TEXT_FIELDS = {"tank", "productName", "event", "date", "time", "end"}
+
+_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%m/%d/%y",
+    "%m-%d-%Y",
+    "%d-%b-%Y",
+    "%d-%b-%y",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%b %d %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+)
+_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%H%M", "%H.%M", "%I:%M %p", "%I:%M%p", "%I %p")
+
+
+def _split_row(line: str) -> List[str]:
+    # ``tablesToMarkdown`` in the browser escapes literal pipes as ``\|``
+    cells = re.split(r"(?<!\\)\|", line.strip().strip("|"))
+    return [c.strip().replace("\\|", "|") for c in cells]
+
+
+def _is_separator(cells: List[str]) -> bool:
+    return all(re.fullmatch(r":?-{2,}:?", c) for c in cells if c) and any(cells)
+
+
+def _parse_tables(md: str) -> List[List[List[str]]]:
+    """Return every markdown table in ``md`` as a list of rows of cells."""
+    tables: List[List[List[str]]] = []
+    current: List[List[str]] = []
+    for line in md.splitlines():
+        if line.strip().startswith("|"):
+            cells = _split_row(line)
+            if not _is_separator(cells):
+                current.append(cells)
+            continue
+        if current:
+            tables.append(current)
+            current = []
+    if current:
+        tables.append(current)
+    return tables
+
+
+def _to_number(value: str):
+    """Parse a numeric cell; blanks become ``None``.
+
+    Raises ``ValueError`` for text that is not a number so the caller can fall
+    back to the model, which copes better with unusual formatting.
+    """
+    value = value.replace(",", "").strip()
+    if value in ("", "-", "—"):
+        return None
+    if re.fullmatch(r"[+-]?\d+", value):
+        return int(value)
+    return float(value)
+
+
+def _to_date(value: str) -> str:
+    value = value.strip()
+    if not value:
+        return ""
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {value!r}")
+
+
+def _to_time(value: str) -> str:
+    value = value.strip().upper()
+    if not value:
+        return ""
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).strftime("%H:%M")
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized time: {value!r}")
+
+
+def _records(table: List[List[str]], columns: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Map table rows onto dicts keyed by the TankReport field names."""
+    header = [h.lower() for h in table[0]]
+    index = {}
+    for name, key in columns.items():
+        if name in header and key not in index:
+            index[key] = header.index(name)
+    missing = set(columns.values()) - index.keys()
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+    records = []
+    for row in table[1:]:
+        if not any(row):
+            continue
+        rec = {}
+        for key, i in index.items():
+            cell = row[i] if i < len(row) else ""
+            rec[key] = cell if key in _TEXT_FIELDS else _to_number(cell)
+        records.append(rec)
+    return records
+
+
+def _classify(table: List[List[str]]) -> str | None:
+    header = {h.lower() for h in table[0]}
+    if {"tank", "ullage (ft)"} <= header:
+        return "tanks"
+    if "product discharged" in header:
+        return "products"
+    if {"arrival/departure", "fwd/aft"} <= header:
+        return "drafts"
+    if {"event", "date", "time"} <= header:
+        return "events"
+    return None
+
+
+def _drafts(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    readings: List[Dict[str, Any]] = []
+    by_event: Dict[str, Dict[str, Any]] = {}
+    event = ""
+    for rec in records:
+        # Merged cells leave the event blank on the second (aft) row
+        event = rec.get("event") or event
+        end = (rec.get("end") or "").lower()
+        if end.startswith("f"):
+            end = "fwd"
+        elif end.startswith("a"):
+            end = "aft"
+        else:
+            raise ValueError(f"Unrecognized draft position: {rec.get('end')!r}")
+        if event not in by_event:
+            by_event[event] = {
+                "event": event,
+                "fwd": {"port": None, "stbd": None},
+                "aft": {"port": None, "stbd": None},
+            }
+            readings.append(by_event[event])
+        by_event[event][end] = {"port": rec.get("port"), "stbd": rec.get("stbd")}
+    return readings
+
+
+def markdown_to_tank_report(md: str) -> Dict[str, Any]:
+    """Convert the five tables requested by ``generate_prompt`` to a TankReport.
+
+    The first tank table is the arrival condition and the second the
+    departure condition.  Raises ``ValueError`` when a table is missing or a
+    cell cannot be interpreted; callers should then fall back to the model.
+    """
+    found: Dict[str, List] = {"tanks": [], "products": [], "events": [], "drafts": []}
+    for table in _parse_tables(md):
+        kind = _classify(table)
+        if kind:
+            found[kind].append(table)
+    if len(found["tanks"]) != 2 or not all(found[k] for k in ("products", "events", "drafts")):
+        raise ValueError("Markdown does not contain the expected five tables")
+
+    events = _records(found["events"][0], _EVENT_COLUMNS)
+    for ev in events:
+        ev["date"] = _to_date(ev.get("date", ""))
+        ev["time"] = _to_time(ev.get("time", ""))
+
+    return {
+        "tankConditions": {
+            "arrival": _records(found["tanks"][0], _TANK_COLUMNS),
+            "departure": _records(found["tanks"][1], _TANK_COLUMNS),
+        },
+        "productsDischarged": _records(found["products"][0], _PRODUCT_COLUMNS),
+        "eventTimeline": events,
+        "draftReadings": _drafts(_records(found["drafts"][0], _DRAFT_COLUMNS)),
+    }
+
+
+_TITLES = {
+    "tank": "Tank",
+    "product name": "Product Name",
+    "api": "API",
+    "ullage (ft)": "Ullage (Ft)",
+    "ullage (in)": "Ullage (in)",
+    "temp (°f)": "Temp (°F)",
+    "water (bbls)": "Water (Bbls)",
+    "gross bbls": "Gross Bbls",
+    "net bbls": "Net Bbls",
+    "metric tons": "Metric Tons",
+    "product discharged": "Product Discharged",
+}
+
+
+def _header_titles(names: List[str]) -> List[str]:
+    return [_TITLES[n] for n in names]
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("|", "\\|")
+
+
+def _table(headers: List[str], rows: List[List[Any]]) -> str:
+    lines = [
+        "| " + " | ".join(headers) + " |",
+        "| " + " | ".join("-" * len(h) for h in headers) + " |",
+    ]
+    lines += ["| " + " | ".join(_cell(v) for v in row) + " |" for row in rows]
+    return "\n".join(lines)
+
+
+def tank_report_to_markdown(report: Dict[str, Any]) -> str:
+    """Render a TankReport as the five markdown tables of ``generate_prompt``.
+
+    The result parses back with :func:`markdown_to_tank_report`.
+    """
+    tank_headers = list(_TANK_COLUMNS)
+    tank_keys = list(_TANK_COLUMNS.values())
+    conditions = report.get("tankConditions") or {}
+    sections = []
+    for title, phase in (("Arrival Tank Values", "arrival"), ("Departure Tank Values", "departure")):
+        rows = [[t.get(k) for k in tank_keys] for t in conditions.get(phase) or []]
+        sections.append((title, _table(_header_titles(tank_headers), rows)))
+
+    products = [
+        [p.get(k) for k in _PRODUCT_COLUMNS.values()]
+        for p in report.get("productsDischarged") or []
+    ]
+    sections.append(("Products Discharged", _table(_header_titles(list(_PRODUCT_COLUMNS)), products)))
+
+    events = [
+        [e.get("event"), e.get("date"), e.get("time")]
+        for e in report.get("eventTimeline") or []
+    ]
+    sections.append(("Time Log", _table(["Event", "Date", "Time"], events)))
+
+    drafts = []
+    for d in report.get("draftReadings") or []:
+        for end, label in (("fwd", "Fwd"), ("aft", "Aft")):
+            reading = d.get(end) or {}
+            drafts.append([d.get("event"), label, reading.get("port"), reading.get("stbd")])
+    sections.append(
+        ("Draft Readings", _table(["Arrival/Departure", "Fwd/Aft", "Port", "Stbd."], drafts))
+    )
+    return "\n\n".join(f"**{title}**\n\n{table}" for title, table in sections) + "\n"
+
@@ -1,18 +1,21 @@
 import os
 import uuid
 import datetime
-import base64
-import io
-import shutil
-import sqlite3
 import json
 import re
 import math
-from werkzeug.utils import secure_filename
+import time
+import socket
+import logging
+import threading
+import httpx
+import httpcore
 import openai
 from markdown2 import markdown
 import bleach
-from PIL import Image, ImageOps
+
+from backend.ratelimit import limiter, retry_after, backoff_delay
+from backend.db import pool as db_pool
 
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join('backend', 'data'))
 ALLOWED_EXTENSIONS = {
@@ -22,8 +25,144 @@ ALLOWED_EXTENSIONS = {
 MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', 8))
 MODEL = os.getenv('MODEL', 'gpt-4.1-mini')
 
+# HTTP pool shared by every worker thread; keep it at least as large as
+# WORKER_THREADS so extractions never queue for a connection.
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 32))
+OPENAI_MAX_KEEPALIVE = int(os.getenv('OPENAI_MAX_KEEPALIVE', 16))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 60))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', 5))
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', 120))
+# Retries of 429/5xx/connection errors done by ``chat_completion``; the SDK's
+# own retries are disabled so every 429 reaches the adaptive limiter.
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 5))
+
+logger = logging.getLogger(__name__)
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 openai.api_key = os.getenv('OPENAI_API_KEY')
+# ``openai.chat`` builds its client lazily from these module settings, so
+# every call site (and every test patch of ``openai.chat``) shares one pool.
+openai.timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+openai.max_retries = 0
+_scope = threading.local()
+
+
+class CancelScope:
+    """Lets another thread abort the model calls a thread makes inside
+    ``with scope:``.
+
+    :meth:`cancel` shuts down the socket a call in the scope is reading or
+    writing, so a call still waiting for response headers fails at once
+    rather than at its read timeout; later reads fail straight away and
+    :func:`chat_completion` does not retry them.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._streams = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        _scope.current = self
+        return self
+
+    def __exit__(self, *exc):
+        _scope.current = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            streams = list(self._streams)
+        for stream in streams:
+            stream.abort()
+
+    def _enter(self, stream) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise httpcore.ReadError("Call cancelled")
+            self._streams.add(stream)
+
+    def _exit(self, stream) -> None:
+        with self._lock:
+            self._streams.discard(stream)
+
+
+def _cancelled() -> bool:
+    scope = getattr(_scope, 'current', None)
+    return scope is not None and scope.cancelled
+
+
+class _ScopedStream(httpcore.NetworkStream):
+    """Connection that registers with the :class:`CancelScope` of the thread
+    using it for the duration of each read and write."""
+
+    def __init__(self, stream: httpcore.NetworkStream):
+        self._stream = stream
+
+    def _io(self, op, *args):
+        scope = getattr(_scope, 'current', None)
+        if scope is None:
+            return op(*args)
+        scope._enter(self)
+        try:
+            return op(*args)
+        finally:
+            scope._exit(self)
+
+    def read(self, max_bytes, timeout=None):
+        return self._io(self._stream.read, max_bytes, timeout)
+
+    def write(self, buffer, timeout=None):
+        return self._io(self._stream.write, buffer, timeout)
+
+    def close(self):
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+        return _ScopedStream(self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info):
+        return self._stream.get_extra_info(info)
+
+    def abort(self) -> None:
+        """Wake a blocked read or write; unlike ``close`` this works from
+        another thread.  The base method skips ``SSLSocket.shutdown``, which
+        would tear down the TLS state under the reading thread."""
+        sock = self._stream.get_extra_info('socket')
+        try:
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except (OSError, TypeError):
+            pass
+
+
+class _ScopedBackend(httpcore.NetworkBackend):
+    def __init__(self, backend: httpcore.NetworkBackend):
+        self._backend = backend
+
+    def connect_tcp(self, *args, **kwargs):
+        return _ScopedStream(self._backend.connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs):
+        return _ScopedStream(self._backend.connect_unix_socket(*args, **kwargs))
+
+    def sleep(self, seconds):
+        self._backend.sleep(seconds)
+
+
+def _http_transport() -> httpx.HTTPTransport:
+    transport = httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+    # httpx has no public way to pass httpcore a network backend.
+    transport._pool._network_backend = _ScopedBackend(transport._pool._network_backend)
+    return transport
+
+
+openai.http_client = httpx.Client(transport=_http_transport(), timeout=openai.timeout)
 
 SCHEMA_KEYS = {"arrival_tanks", "departure_tanks", "products", "time_log", "draft_readings"}
 
@@ -37,15 +176,17 @@ def markdown_looks_like_json(md: str) -> bool:
         return False
     return SCHEMA_KEYS <= obj.keys()
 
-# Database path shared across the app
-DB_PATH = os.path.join(UPLOAD_FOLDER, 'requests.db')
+# Single SQLite database holding every job
+DB_PATH = os.getenv('JOBS_DB_PATH', os.path.join(UPLOAD_FOLDER, 'jobs.sqlite'))
 
 
 def get_db(path: str = DB_PATH):
-    """Return a SQLite connection to the given ``path``."""
-    conn = sqlite3.connect(path, check_same_thread=False)
-    conn.execute('PRAGMA journal_mode=WAL;')
-    return conn
+    """Return a pooled connection to ``path`` for use in a ``with`` block.
+
+    The block commits on success and rolls back on error; the connection then
+    goes back to :data:`backend.db.pool` rather than being left open.
+    """
+    return db_pool.connection(path)
 
 
 def get_file_size(file) -> int:
@@ -66,32 +207,6 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def save_file(file):
-    """Save an uploaded file to ``UPLOAD_FOLDER`` with a unique name."""
-    now = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
-    filename = secure_filename(file.filename)
-    ext = filename.rsplit('.', 1)[1].lower()
-    new_name = f"{now}_{uuid.uuid4().hex[:8]}.{ext}"
-    path = os.path.join(UPLOAD_FOLDER, new_name)
-    file.save(path)
-    return new_name, path
-
-
-def preprocess_image(path: str) -> None:
-    """Convert image to grayscale and apply autocontrast in-place.
-
-    The original image is preserved as ``<file>.orig`` so retries start
-    from the unmodified source.
-    """
-    orig_path = f"{path}.orig"
-    if not os.path.exists(orig_path):
-        shutil.copy(path, orig_path)
-    with Image.open(orig_path) as img:
-        gray = ImageOps.grayscale(img)
-        processed = ImageOps.autocontrast(gray)
-        processed.save(path)
-
-
 def generate_prompt() -> str:
     return (
         "Please analyze the attached image and extract the tank data as five separate tables, in markdown format:\n"
@@ -125,62 +240,361 @@ def generate_prompt() -> str:
     )
 
 
+def _vision_params(
+    path: str,
+    prompt: str,
+    model: str,
+    crop_top_fraction: float | None = None,
+    metrics: dict | None = None,
+) -> dict:
+    """Build chat completion params for the preprocessed image at ``path``.
+
+    The upload itself is left untouched; the payload comes from the variant
+    store, sized and encoded according to the model's image policy.  Payload
+    size and the estimated image tokens are added to ``metrics`` if given.
+    """
+    from backend.variants import variant_store, image_policy, estimate_image_tokens
+
+    policy = image_policy(model)
+    variant = variant_store.get(
+        path,
+        crop_top_fraction=crop_top_fraction,
+        fmt=policy.fmt,
+        max_edge=policy.max_edge,
+        quality=policy.quality,
+    )
+    if metrics is not None:
+        metrics.update(
+            {
+                "model": model,
+                "format": policy.fmt.lower(),
+                "detail": policy.detail,
+                "width": variant.width,
+                "height": variant.height,
+                "payload_bytes": len(variant.b64),
+                "image_tokens": estimate_image_tokens(
+                    variant.width, variant.height, policy.detail
+                ),
+            }
+        )
+
+    params = {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": variant.data_url, "detail": policy.detail},
+                    },
+                ],
+            }
+        ],
+    }
+    if model not in {"o3", "o3-mini", "o4-mini"}:
+        params["temperature"] = 0.25
+    return params
+
+
+class LLMStats:
+    """Per-model call counters, latency and token usage since start-up."""
+
+    def __init__(self):
+        self._models: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency_ms: int, usage=None, error: bool = False) -> None:
+        with self._lock:
+            m = self._models.setdefault(
+                model,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "latency_ms_total": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                },
+            )
+            m["calls"] += 1
+            m["errors"] += int(error)
+            m["latency_ms_total"] += latency_ms
+            for field in ("prompt_tokens", "completion_tokens"):
+                value = getattr(usage, field, None)
+                if isinstance(value, int):
+                    m[field] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                model: dict(m, latency_ms_avg=round(m["latency_ms_total"] / m["calls"]))
+                for model, m in self._models.items()
+            }
+
+
+llm_stats = LLMStats()
+
+
+def _temperature_rejected(e: openai.BadRequestError) -> bool:
+    error = (getattr(e, "body", None) or {}).get("error") or {}
+    return error.get("code") == "unsupported_value" and error.get("param") == "temperature"
+
+
+def _create_completion(params: dict):
+    try:
+        return openai.chat.completions.create(**params)
+    except openai.BadRequestError as e:
+        if "temperature" not in params or not _temperature_rejected(e):
+            raise
+        params.pop("temperature")
+        return openai.chat.completions.create(**params)
+
+
+def _retryable(e: openai.OpenAIError) -> bool:
+    if isinstance(e, openai.RateLimitError):
+        # An exhausted quota will not recover by waiting
+        error = (getattr(e, "body", None) or {})
+        error = error.get("error", error) if isinstance(error, dict) else {}
+        return error.get("code") != "insufficient_quota"
+    return isinstance(e, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def is_transient(e: BaseException) -> bool:
+    """Return whether ``e`` raised by the OpenAI helpers is a passing API
+    failure (connection, timeout, rate limit or server error)."""
+    while isinstance(e, RuntimeError) and e.__cause__ is not None:
+        e = e.__cause__
+    return isinstance(e, openai.OpenAIError) and _retryable(e)
+
+
+class _SlotStream:
+    """A streamed completion holding its limiter slot until it has been read
+    to the end or closed, so long streams count towards the concurrency limit."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._released = False
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        limiter.release()
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self._release()
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def chat_completion(params: dict, metrics: dict | None = None, timeout=None):
+    """Create a chat completion through the shared, pooled client.
+
+    Every model call in the app goes through here.  Calls wait for a slot
+    from :data:`backend.ratelimit.limiter`; 429s, 5xx responses and
+    connection errors are retried up to ``OPENAI_MAX_RETRIES`` times with
+    jittered exponential backoff that honours ``Retry-After``.  Models that
+    reject a custom ``temperature`` are retried without it.  API errors are
+    raised as ``RuntimeError`` and the call's latency and token usage are
+    logged, added to :data:`llm_stats` and copied into ``metrics`` if given.
+    ``timeout`` overrides the default connect/read timeouts for this call.
+    A streamed response keeps its slot until it is read to the end or closed.
+    """
+    if timeout is not None:
+        params = dict(params, timeout=timeout)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            response = _create_completion(params)
+        except openai.OpenAIError as e:
+            hint = retry_after(getattr(getattr(e, "response", None), "headers", None))
+            limiter.release(
+                throttled=isinstance(e, openai.RateLimitError), retry_after=hint
+            )
+            if _retryable(e) and attempt < OPENAI_MAX_RETRIES and not _cancelled():
+                delay = backoff_delay(attempt, hint)
+                logger.warning(
+                    "OpenAI call to %s failed (%s); retry %s in %.2fs",
+                    params["model"], e.__class__.__name__, attempt + 1, delay,
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            latency_ms = round((time.monotonic() - started) * 1000)
+            llm_stats.record(params["model"], latency_ms, error=True)
+            logger.warning("OpenAI call to %s failed after %sms: %s", params["model"], latency_ms, e)
+            raise RuntimeError(f"OpenAI API error: {e}") from e
+        except BaseException:
+            limiter.release()
+            raise
+        if params.get("stream"):
+            response = _SlotStream(response)
+        else:
+            limiter.release()
+        break
+    latency_ms = round((time.monotonic() - started) * 1000)
+    usage = getattr(response, "usage", None)
+    llm_stats.record(params["model"], latency_ms, usage)
+    logger.info(
+        "OpenAI call to %s took %sms (prompt_tokens=%s, completion_tokens=%s)",
+        params["model"],
+        latency_ms,
+        getattr(usage, "prompt_tokens", None),
+        getattr(usage, "completion_tokens", None),
+    )
+    if metrics is not None:
+        metrics["latency_ms"] = latency_ms
+        metrics["cached"] = False
+        if attempt:
+            metrics["retries"] = attempt
+        for field in ("prompt_tokens", "completion_tokens"):
+            value = getattr(usage, field, None)
+            if isinstance(value, int):
+                metrics[field] = value
+    return response
+
+
+def _cached_lookup(params: dict, crop_top_fraction: float | None, use_cache: bool = True):
+    """Return ``(cache, key, cached_text)`` for a vision request.
+
+    ``cache`` is ``None`` when result caching is disabled.  With
+    ``use_cache=False`` the cache is not read, so ``cached_text`` is ``None``
+    and the lookup does not count as a hit or miss.
+    """
+    from backend.cache import get_result_cache, cache_key
+
+    cache = get_result_cache()
+    if cache is None:
+        return None, None, None
+    content = params["messages"][0]["content"]
+    image_url = content[1]["image_url"]
+    key = cache_key(
+        image_url["url"],
+        content[0]["text"],
+        params["model"],
+        crop_top_fraction,
+        image_url.get("detail"),
+    )
+    return cache, key, cache.get(key) if use_cache else None
+
+
+def _record_cached(metrics: dict | None) -> None:
+    if metrics is not None:
+        metrics["latency_ms"] = 0
+        metrics["cached"] = True
+
+
 def call_openai(
     path: str,
     prompt: str,
     filename: str,
     model: str | None = None,
     crop_top_fraction: float | None = None,
+    use_cache: bool = True,
+    metrics: dict | None = None,
 ) -> str:
+    """Send the image at ``path`` with ``prompt`` and return the model output.
+
+    Results are cached by preprocessed image, prompt, model and crop.  With
+    ``use_cache=False`` the cache is not consulted but is refreshed with the
+    new result.  ``metrics`` receives payload size, image tokens and latency.
+    Slow calls are duplicated when hedging is enabled (see ``backend.hedge``).
+    """
+    from backend.hedge import HEDGE_ENABLED, latencies, hedged_completion
+
     if model is None:
         model = MODEL
-    try:
-        preprocess_image(path)
-        with Image.open(path) as img:
-            if crop_top_fraction:
-                crop_height = int(img.height * crop_top_fraction)
-                img = img.crop((0, 0, img.width, crop_height))
-            buf = io.BytesIO()
-            img.save(buf, format="PNG")
-            ext = "png"
-            b64 = base64.b64encode(buf.getbuffer()).decode()
-
-        params = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/{ext};base64,{b64}"},
-                        },
-                    ],
-                }
-            ],
-        }
-        if model not in {"o3", "o3-mini", "o4-mini"}:
-            params["temperature"] = 0.25
+    params = _vision_params(path, prompt, model, crop_top_fraction, metrics)
+    cache, key, cached = _cached_lookup(params, crop_top_fraction, use_cache)
+    if cached is not None:
+        _record_cached(metrics)
+        return cached
+    started = time.monotonic()
+    if HEDGE_ENABLED:
+        text, used_model = hedged_completion(
+            params, lambda m: _vision_params(path, prompt, m, crop_top_fraction), metrics
+        )
+        if metrics is not None:
+            metrics["latency_ms"] = round((time.monotonic() - started) * 1000)
+            metrics["cached"] = False
+    else:
+        text = chat_completion(params, metrics).choices[0].message.content
+        used_model = model
+        latencies.record(model, time.monotonic() - started)
+    # A fallback model's answer is not cached under the requested model.
+    if cache is not None and text is not None and used_model == model:
+        cache.set(key, text)
+    return text
+
+
+def call_openai_stream(
+    path: str,
+    prompt: str,
+    filename: str,
+    model: str | None = None,
+    crop_top_fraction: float | None = None,
+    use_cache: bool = True,
+    metrics: dict | None = None,
+):
+    """Like :func:`call_openai` but yield the markdown as it is generated.
 
-        try:
-            response = openai.chat.completions.create(**params)
-        except openai.BadRequestError as e:
-            if (
-                getattr(e, "body", None)
-                and e.body.get("error", {}).get("code") == "unsupported_value"
-                and e.body.get("error", {}).get("param") == "temperature"
-            ):
-                params.pop("temperature", None)
-                try:
-                    response = openai.chat.completions.create(**params)
-                except openai.OpenAIError as e:
-                    raise RuntimeError(f"OpenAI API error: {e}") from e
-            else:
-                raise RuntimeError(f"OpenAI API error: {e}") from e
-        return response.choices[0].message.content
+    Joining every yielded chunk gives exactly the text :func:`call_openai`
+    would have returned.  A cached result is yielded as a single chunk.
+    """
+    if model is None:
+        model = MODEL
+    started = time.monotonic()
+    params = _vision_params(path, prompt, model, crop_top_fraction, metrics)
+    cache, key, cached = _cached_lookup(params, crop_top_fraction, use_cache)
+    if cached is not None:
+        _record_cached(metrics)
+        yield cached
+        return
+    params["stream"] = True
+    stream = chat_completion(params, metrics)
+    parts = []
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts and metrics is not None:
+                    metrics["first_token_ms"] = round((time.monotonic() - started) * 1000)
+                parts.append(delta)
+                yield delta
     except openai.OpenAIError as e:
         raise RuntimeError(f"OpenAI API error: {e}") from e
+    finally:
+        # Also when the caller stops early, so the connection and the
+        # limiter slot are given back.
+        stream.close()
+    if metrics is not None:
+        # ``chat_completion`` only saw the response headers; report the total
+        metrics["latency_ms"] = round((time.monotonic() - started) * 1000)
+    if cache is not None:
+        cache.set(key, "".join(parts))
 
 
 def convert_markdown(md: str) -> str:
@@ -207,6 +621,35 @@ def convert_markdown(md: str) -> str:
     )
 
 
+
+class MarkdownStreamRenderer:
+    """Render markdown that grows over time without re-rendering all of it.
+
+    Text is split into blank-line separated blocks (each table the prompt
+    asks for is one block).  Every block except the last is complete, so its
+    HTML is cached; only the trailing block is rendered on each update.
+    """
+
+    def __init__(self):
+        self._blocks: list[str] = []
+        self._html: list[str] = []
+
+    def render(self, md: str) -> str:
+        """Return sanitized HTML for ``md``, a prefix-extension of earlier input."""
+        blocks = re.split(r"\n\s*\n", md)
+        complete = blocks[:-1]
+        for i, block in enumerate(complete):
+            if i < len(self._blocks) and self._blocks[i] == block:
+                continue
+            del self._blocks[i:]
+            del self._html[i:]
+            self._blocks.append(block)
+            self._html.append(convert_markdown(block))
+        del self._blocks[len(complete):]
+        del self._html[len(complete):]
+        return "\n".join(self._html + [convert_markdown(blocks[-1])])
+
+
 JSON_PROMPT = """Please convert the tables below into a single JSON object that strictly follows this JSON Schema:
 
 ```
@@ -311,44 +754,145 @@ Output only valid JSON."""
 
 
 def call_openai_json(tables: str, model: str | None = None) -> str:
-    if model is None:
-        model = MODEL
     """Convert extracted tables to JSON via a second model call.
 
     High-reasoning models such as ``o3`` and ``o4-mini`` ignore custom
     ``temperature`` values.  When using these models the parameter is omitted;
     otherwise ``temperature`` defaults to ``0.25``.  If the API still rejects the
-    parameter, the call is retried without it.
+    parameter, :func:`chat_completion` retries without it.
     """
+    if model is None:
+        model = MODEL
+    return chat_completion(_json_params(tables, model)).choices[0].message.content
+
 
-    message = tables + "\n\n" + JSON_PROMPT
+def _json_params(tables: str, model: str) -> dict:
+    """Build chat completion params converting ``tables`` with ``JSON_PROMPT``."""
     params = {
         "model": model,
-        "messages": [{"role": "user", "content": message}],
+        "messages": [{"role": "user", "content": tables + "\n\n" + JSON_PROMPT}],
         "response_format": {"type": "json_object"},
     }
     if model not in {"o3", "o3-mini", "o4-mini"}:
         params["temperature"] = 0.25
+    return params
 
-    try:
-        response = openai.chat.completions.create(**params)
-    except openai.BadRequestError as e:
-        if (
-            getattr(e, "body", None)
-            and e.body.get("error", {}).get("code") == "unsupported_value"
-            and e.body.get("error", {}).get("param") == "temperature"
-        ):
-            params.pop("temperature", None)
-            try:
-                response = openai.chat.completions.create(**params)
-            except openai.OpenAIError as e:
-                raise RuntimeError(f"OpenAI API error: {e}") from e
-        else:
-            raise RuntimeError(f"OpenAI API error: {e}") from e
-    except openai.OpenAIError as e:
-        raise RuntimeError(f"OpenAI API error: {e}") from e
 
-    return response.choices[0].message.content
+def _nullable_numbers(*names: str) -> dict:
+    return {name: {"type": ["number", "null"]} for name in names}
+
+
+def _strict_object(properties: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+_TANK_CONDITION_SCHEMA = _strict_object(
+    {
+        "tank": {"type": "string"},
+        "productName": {"type": "string"},
+        **_nullable_numbers(
+            "api",
+            "ullageFt",
+            "ullageIn",
+            "tempF",
+            "waterBbls",
+            "grossBbls",
+            "netBbls",
+            "metricTons",
+        ),
+    }
+)
+_DRAFT_END_SCHEMA = _strict_object(_nullable_numbers("port", "stbd"))
+
+# TankReport schema from ``JSON_PROMPT`` in the strict form accepted by
+# ``response_format={"type": "json_schema"}``: every property is required and
+# missing numbers are ``null``.
+TANK_REPORT_SCHEMA = _strict_object(
+    {
+        "tankConditions": _strict_object(
+            {
+                "arrival": {"type": "array", "items": _TANK_CONDITION_SCHEMA},
+                "departure": {"type": "array", "items": _TANK_CONDITION_SCHEMA},
+            }
+        ),
+        "productsDischarged": {
+            "type": "array",
+            "items": _strict_object(
+                {
+                    "productName": {"type": "string"},
+                    **_nullable_numbers("api", "grossBbls", "netBbls", "metricTons"),
+                }
+            ),
+        },
+        "eventTimeline": {
+            "type": "array",
+            "items": _strict_object(
+                {
+                    "event": {"type": "string"},
+                    "date": {"type": "string", "description": "YYYY-MM-DD"},
+                    "time": {"type": "string", "description": "HH:MM, 24-hour"},
+                }
+            ),
+        },
+        "draftReadings": {
+            "type": "array",
+            "items": _strict_object(
+                {
+                    "event": {"type": "string", "description": "Arrival or Departure"},
+                    "fwd": _DRAFT_END_SCHEMA,
+                    "aft": _DRAFT_END_SCHEMA,
+                }
+            ),
+        },
+    }
+)
+
+STRUCTURED_PROMPT = (
+    "Please analyze the attached image and extract the tank data as a TankReport JSON object:\n"
+    "- tankConditions.arrival and tankConditions.departure: every individual tank in the arrival and departure conditions.\n"
+    "- productsDischarged: the products discharged totals, typically found at the bottom of the document.\n"
+    "- eventTimeline: the date and time log, typically found near the top right of the document, with dates as YYYY-MM-DD and times as 24-hour HH:MM.\n"
+    "- draftReadings: the arrival and departure drafts, typically found on the right side of the document, converted to decimal format if needed.\n"
+    "\nIf a value is missing or unclear, use null (or an empty string for text).\n"
+)
+
+
+def call_openai_structured(
+    path: str,
+    model: str | None = None,
+    crop_top_fraction: float | None = None,
+    use_cache: bool = True,
+    metrics: dict | None = None,
+) -> str:
+    """Extract a TankReport JSON string from the image in a single call.
+
+    The model is constrained with ``TANK_REPORT_SCHEMA`` so the response can be
+    stored directly and rendered to markdown locally.
+    """
+    if model is None:
+        model = MODEL
+    params = _vision_params(path, STRUCTURED_PROMPT, model, crop_top_fraction, metrics)
+    params["response_format"] = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "TankReport",
+            "strict": True,
+            "schema": TANK_REPORT_SCHEMA,
+        },
+    }
+    cache, key, cached = _cached_lookup(params, crop_top_fraction, use_cache)
+    if cached is not None:
+        _record_cached(metrics)
+        return cached
+    text = chat_completion(params, metrics).choices[0].message.content
+    if cache is not None and text is not None:
+        cache.set(key, text)
+    return text
 
 
 def enhance_tank_conditions(json_text: str) -> str:
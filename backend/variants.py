@@ -0,0 +1,290 @@
+import os
+import io
+import math
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+from backend.utils import UPLOAD_FOLDER
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FOLDER = os.getenv('VARIANT_FOLDER', os.path.join(UPLOAD_FOLDER, 'variants'))
+VARIANT_MEMORY_MB = int(os.getenv('VARIANT_MEMORY_MB', 64))
+# Source files whose hash is remembered, most recently used first.
+VARIANT_DIGEST_ENTRIES = 4096
+
+# Operations applied to every image before it is sent to the model.
+DEFAULT_OPERATIONS = ('grayscale', 'autocontrast')
+
+# Image sizing/encoding policy for vision calls.  The model resizes anything
+# larger than 2048px itself, so sending more only costs upload time.
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', 2048))
+# Per-model overrides of ``IMAGE_MAX_EDGE``, e.g. ``gpt-4.1-mini=1536,o3=2048``
+IMAGE_MAX_EDGE_BY_MODEL = os.getenv('IMAGE_MAX_EDGE_BY_MODEL', '')
+# ``png`` (lossless), ``jpeg`` or ``webp``
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'png').lower()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+# ``high``, ``low`` or ``auto``
+IMAGE_DETAIL = os.getenv('IMAGE_DETAIL', 'high').lower()
+
+_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'webp': 'WEBP'}
+
+
+@dataclass(frozen=True)
+class ImagePolicy:
+    max_edge: int | None
+    fmt: str
+    quality: int | None
+    detail: str
+
+
+def _max_edge_overrides(spec: str) -> dict[str, int]:
+    overrides = {}
+    for item in spec.split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip():
+            overrides[name.strip()] = int(value)
+    return overrides
+
+
+def image_policy(model: str) -> ImagePolicy:
+    """Return the sizing and encoding policy for images sent to ``model``."""
+    max_edge = _max_edge_overrides(IMAGE_MAX_EDGE_BY_MODEL).get(model, IMAGE_MAX_EDGE)
+    fmt = _FORMATS.get(IMAGE_FORMAT)
+    if fmt is None:
+        raise ValueError(f"Unsupported IMAGE_FORMAT: {IMAGE_FORMAT}")
+    return ImagePolicy(
+        max_edge=max_edge or None,
+        fmt=fmt,
+        quality=None if fmt == 'PNG' else IMAGE_QUALITY,
+        detail=IMAGE_DETAIL,
+    )
+
+
+def upload_max_edge() -> int | None:
+    """Return the longest edge any model is sent, or ``None`` when some
+    model gets images at full size."""
+    edges = [IMAGE_MAX_EDGE, *_max_edge_overrides(IMAGE_MAX_EDGE_BY_MODEL).values()]
+    return max(edges) if all(edges) else None
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = 'high') -> int:
+    """Approximate the input tokens billed for an image.
+
+    Uses the published tile formula: fit within 2048x2048, scale the short
+    side down to 768px, then 170 tokens per 512px tile plus 85 base tokens.
+    """
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+@dataclass(frozen=True)
+class Variant:
+    key: str
+    b64: str
+    mime: str
+    width: int = 0
+    height: int = 0
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.b64}"
+
+
+def source_path(path: str) -> str:
+    """Return the unmodified source for ``path``.
+
+    Images preprocessed in place by older versions keep their original as
+    ``<file>.orig``.
+    """
+    orig = f"{path}.orig"
+    return orig if os.path.exists(orig) else path
+
+
+def _apply(img: Image.Image, op: str) -> Image.Image:
+    if op == 'grayscale':
+        return ImageOps.grayscale(img)
+    if op == 'autocontrast':
+        return ImageOps.autocontrast(img)
+    raise ValueError(f"Unknown image operation: {op}")
+
+
+class VariantStore:
+    """Encoded image variants keyed by (source hash, operations, crop, format).
+
+    Payloads are kept on disk under ``folder``, grouped by source hash so
+    :meth:`discard` can drop them with their source, and in a bounded
+    in-memory LRU, so repeated calls for the same image skip all Pillow work.
+    """
+
+    def __init__(
+        self,
+        folder: str = VARIANT_FOLDER,
+        max_memory_bytes: int = VARIANT_MEMORY_MB * 1024 * 1024,
+        max_digests: int = VARIANT_DIGEST_ENTRIES,
+    ):
+        self.folder = folder
+        self.max_memory_bytes = max_memory_bytes
+        self.max_digests = max_digests
+        self._memory: OrderedDict[str, Variant] = OrderedDict()
+        self._memory_bytes = 0
+        # LRU of (path, size, mtime) -> sha256 so unchanged sources are not re-hashed
+        self._digests: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, path: str) -> str:
+        st = os.stat(path)
+        sig = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._digests.get(sig)
+            if cached:
+                self._digests.move_to_end(sig)
+                return cached
+        h = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                h.update(chunk)
+        with self._lock:
+            self._digests[sig] = h.hexdigest()
+            while len(self._digests) > self.max_digests:
+                self._digests.popitem(last=False)
+        return h.hexdigest()
+
+    def key(
+        self,
+        digest: str,
+        operations: tuple,
+        crop_top_fraction: float | None,
+        fmt: str,
+        max_edge: int | None = None,
+        quality: int | None = None,
+    ) -> str:
+        spec = (
+            f"{digest}|{','.join(operations)}|{crop_top_fraction!r}|{fmt}"
+            f"|{max_edge!r}|{quality!r}"
+        )
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def _disk_path(self, digest: str, key: str) -> str:
+        return os.path.join(self.folder, digest[:2], digest, f"{key}.b64")
+
+    def discard(self, digest: str) -> int:
+        """Delete the stored variants of the source with ``digest``.
+
+        Returns the number of bytes freed on disk.
+        """
+        folder = os.path.join(self.folder, digest[:2], digest)
+        freed = 0
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                freed += size
+            except OSError:
+                pass
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+        return freed
+
+    def get(
+        self,
+        path: str,
+        operations: tuple = DEFAULT_OPERATIONS,
+        crop_top_fraction: float | None = None,
+        fmt: str = 'PNG',
+        max_edge: int | None = None,
+        quality: int | None = None,
+    ) -> Variant:
+        """Return the encoded variant of the image at ``path``.
+
+        ``max_edge`` bounds the longer side after cropping; ``quality`` applies
+        to lossy formats.
+        """
+        src = source_path(path)
+        digest = self.digest(src)
+        key = self.key(
+            digest, tuple(operations), crop_top_fraction, fmt, max_edge, quality
+        )
+        with self._lock:
+            variant = self._memory.get(key)
+            if variant is not None:
+                self._memory.move_to_end(key)
+                return variant
+        mime = f"image/{fmt.lower()}"
+        disk_path = self._disk_path(digest, key)
+        try:
+            with open(disk_path) as fh:
+                # First line holds the encoded dimensions, e.g. ``1024x768``
+                width, _, height = fh.readline().strip().partition('x')
+                variant = Variant(key, fh.read(), mime, int(width), int(height))
+        except (OSError, ValueError):
+            b64, width, height = self._render(
+                src, operations, crop_top_fraction, fmt, max_edge, quality
+            )
+            variant = Variant(key, b64, mime, width, height)
+            self._write(disk_path, variant)
+        self._remember(variant)
+        return variant
+
+    def _render(self, src: str, operations, crop_top_fraction, fmt, max_edge, quality):
+        with Image.open(src) as img:
+            for op in operations:
+                img = _apply(img, op)
+            if crop_top_fraction:
+                crop_height = int(img.height * crop_top_fraction)
+                img = img.crop((0, 0, img.width, crop_height))
+            if max_edge and max(img.size) > max_edge:
+                img = img.copy()
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if fmt == 'JPEG' and img.mode not in ('L', 'RGB'):
+                img = img.convert('RGB')
+            options = {} if quality is None else {'quality': quality}
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, **options)
+            width, height = img.size
+        return base64.b64encode(buf.getbuffer()).decode(), width, height
+
+    def _write(self, disk_path: str, variant: Variant) -> None:
+        try:
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(disk_path))
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(f"{variant.width}x{variant.height}\n")
+                fh.write(variant.b64)
+            os.replace(tmp, disk_path)
+        except OSError:
+            logger.exception("Could not store image variant %s", disk_path)
+
+    def _remember(self, variant: Variant) -> None:
+        size = len(variant.b64)
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if variant.key in self._memory:
+                return
+            self._memory[variant.key] = variant
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old.b64)
+
+
+variant_store = VariantStore()
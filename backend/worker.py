@@ -1,7 +1,349 @@
-from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-executor = ThreadPoolExecutor(max_workers=4)
+from backend.utils import (
+    MODEL,
+    generate_prompt,
+    is_transient,
+    call_openai,
+    call_openai_stream,
+    call_openai_structured,
+    enhance_tank_conditions,
+    STRUCTURED_PROMPT,
+)
+from backend.tank_extractor import tank_report_to_markdown
+from backend.models import (
+    init_db,
+    set_request_status,
+    set_request_output,
+    set_request_partial,
+)
+from backend.jobqueue import get_queue, RedisWorkQueue
+from backend.blobs import upload_path
+
+logger = logging.getLogger(__name__)
+
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 16))
+# Maximum number of images from a single upload processed at the same time.
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 8))
+# Stream model output into the job database while it is generated.
+STREAM_OUTPUT = os.getenv('STREAM_OUTPUT', 'False').lower() == 'true'
+STREAM_FLUSH_INTERVAL = float(os.getenv('STREAM_FLUSH_INTERVAL', 0.5))
+# Longest pause of a consumer after Redis errors, doubling from one second.
+QUEUE_ERROR_BACKOFF_MAX = 30
+# ``markdown``: vision -> markdown, JSON generated later on request.
+# ``structured``: one schema-constrained call fills both output and json.
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'markdown').lower()
+PIPELINE_MODES = ('markdown', 'structured')
+
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
 
 
 def run_async(func, *args, **kwargs):
     return executor.submit(func, *args, **kwargs)
+
+
+def run_batch(func, arg_list, max_in_flight: int | None = None) -> list:
+    """Run ``func(*args)`` for every tuple in ``arg_list`` on the executor.
+
+    No more than ``max_in_flight`` calls are pending at once; the next call is
+    submitted as soon as any running one completes.  Results are returned in
+    the order of ``arg_list``.  A call that raised is represented by its
+    exception instance so one failure does not abort the rest of the batch.
+    """
+    limit = max(1, max_in_flight or UPLOAD_CONCURRENCY)
+    results: list = [None] * len(arg_list)
+    items = iter(enumerate(arg_list))
+    pending = {}
+
+    def submit_next():
+        try:
+            idx, args = next(items)
+        except StopIteration:
+            return
+        pending[run_async(func, *args)] = idx
+
+    for _ in range(limit):
+        submit_next()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            idx = pending.pop(fut)
+            try:
+                results[idx] = fut.result()
+            except Exception as e:
+                results[idx] = e
+            submit_next()
+    return results
+
+
+def start_batch(func, arg_list, max_in_flight: int | None = None) -> None:
+    """Schedule ``func(*args)`` for every tuple in ``arg_list`` and return.
+
+    Like :func:`run_batch` but non-blocking: each completed call submits the
+    next one from a done-callback, so no thread waits on the batch.  ``func``
+    is expected to record its own result and handle its own errors.
+    """
+    limit = max(1, max_in_flight or UPLOAD_CONCURRENCY)
+    items = iter(list(arg_list))
+    lock = threading.Lock()
+
+    def submit_next(_=None):
+        with lock:
+            args = next(items, None)
+        if args is not None:
+            run_async(func, *args).add_done_callback(submit_next)
+
+    for _ in range(limit):
+        submit_next()
+
+
+def vision_pipeline(
+    image_path: str,
+    model: str | None = None,
+    on_partial=None,
+    metrics: dict | None = None,
+):
+    """Extract the tank tables from ``image_path``.
+
+    When ``on_partial`` is given the response is streamed and the callback
+    receives the markdown generated so far after every chunk.  ``metrics`` is
+    filled with the vision call measurements.
+    """
+    if model is None:
+        model = MODEL
+    prompt = generate_prompt()
+    filename = os.path.basename(image_path)
+    if on_partial is None:
+        return prompt, call_openai(image_path, prompt, filename, model, metrics=metrics)
+    parts = []
+    for delta in call_openai_stream(image_path, prompt, filename, model, metrics=metrics):
+        parts.append(delta)
+        on_partial(''.join(parts))
+    return prompt, ''.join(parts)
+
+
+def structured_pipeline(
+    image_path: str, model: str | None = None, metrics: dict | None = None
+):
+    """Extract a TankReport with one call and render its markdown locally.
+
+    Returns ``(prompt, markdown, json_text)``.
+    """
+    raw = call_openai_structured(image_path, model, metrics=metrics)
+    json_text = json.dumps(json.loads(enhance_tank_conditions(raw)), indent=2)
+    md = tank_report_to_markdown(json.loads(raw))
+    return STRUCTURED_PROMPT, md, json_text
+
+
+def process_job_request(
+    job_id: str,
+    req_id: int,
+    filename: str,
+    model: str,
+    mode: str = PIPELINE_MODE,
+    raise_transient: bool = False,
+):
+    """Run the extraction pipeline for a queued request row and store the result.
+
+    Failures are stored as the row's output, except that transient API errors
+    are re-raised when ``raise_transient`` is set so the queue can retry them.
+    """
+    image_path = upload_path(filename)
+    set_request_status(job_id, req_id, 'running')
+    on_partial = None
+    if STREAM_OUTPUT and mode != 'structured':
+        last_flush = 0.0
+
+        def on_partial(text):
+            nonlocal last_flush
+            now = time.monotonic()
+            if now - last_flush >= STREAM_FLUSH_INTERVAL:
+                last_flush = now
+                set_request_partial(job_id, req_id, text)
+
+    json_text = None
+    metrics = {}
+    try:
+        if mode == 'structured':
+            prompt, output_text, json_text = structured_pipeline(image_path, model, metrics)
+        else:
+            prompt, output_text = vision_pipeline(image_path, model, on_partial, metrics)
+        status = 'done'
+    except Exception as e:
+        if raise_transient and is_transient(e):
+            raise
+        prompt, output_text, status = generate_prompt(), str(e), 'error'
+    if metrics:
+        logger.info("Vision call for %s: %s", filename, metrics)
+    set_request_output(
+        job_id,
+        req_id,
+        prompt,
+        output_text,
+        status,
+        json_text=json_text,
+        metrics=metrics,
+    )
+
+
+def dispatch(tasks: list[dict], max_in_flight: int | None = None) -> None:
+    """Hand extraction tasks to the Redis queue or the local thread pool.
+
+    Each task is a dict with ``job_id``, ``req_id``, ``filename``, ``model``
+    and optionally ``mode`` keys matching :func:`process_job_request`.
+    """
+    queue = get_queue()
+    if queue is None:
+        start_batch(
+            process_job_request,
+            [
+                (t['job_id'], t['req_id'], t['filename'], t['model'], t.get('mode', PIPELINE_MODE))
+                for t in tasks
+            ],
+            max_in_flight=max_in_flight,
+        )
+        return
+    for t in tasks:
+        queue.enqueue(t)
+
+
+def _mark_dead(task, reason: str) -> None:
+    """Fail the request row of a dead-lettered task so its job settles."""
+    p = task.payload
+    try:
+        set_request_output(
+            p['job_id'],
+            p['req_id'],
+            generate_prompt(),
+            f"Extraction failed after {task.attempts} attempt(s): {reason}",
+            'error',
+        )
+    except Exception:
+        logger.exception("Could not mark dead-lettered task %s as failed", task.id)
+
+
+def consume(queue: RedisWorkQueue, stop: threading.Event, poll_timeout: int = 5):
+    """Process tasks from ``queue`` until ``stop`` is set.
+
+    Tasks failing with a transient API error or a crash go back to the queue
+    until their attempts run out.  Redis errors are logged and retried with
+    backoff rather than ending the consumer; the lease of a task that could not be acknowledged runs out and
+    it is delivered again.
+    """
+    failures = 0
+    while not stop.is_set():
+        try:
+            task = queue.reserve(timeout=poll_timeout)
+        except Exception:
+            failures += 1
+            delay = min(QUEUE_ERROR_BACKOFF_MAX, 2 ** (failures - 1))
+            logger.exception("Could not reserve a task; retrying in %ss", delay)
+            stop.wait(delay)
+            continue
+        failures = 0
+        if task is None:
+            continue
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(queue.visibility_timeout / 3):
+                try:
+                    queue.extend(task)
+                except Exception:
+                    logger.warning("Could not extend the lease of task %s", task.id, exc_info=True)
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        try:
+            p = task.payload
+            process_job_request(
+                p['job_id'],
+                p['req_id'],
+                p['filename'],
+                p['model'],
+                p.get('mode', PIPELINE_MODE),
+                raise_transient=True,
+            )
+        except Exception as e:
+            logger.exception("Task %s failed (attempt %s)", task.id, task.attempts)
+            try:
+                if queue.nack(task):
+                    _mark_dead(task, str(e))
+                else:
+                    set_request_status(p['job_id'], p['req_id'], 'pending')
+            except Exception:
+                logger.exception("Could not return task %s to the queue", task.id)
+        else:
+            try:
+                queue.ack(task)
+            except Exception:
+                logger.exception("Could not acknowledge task %s", task.id)
+        finally:
+            done.set()
+            beat.join()
+
+
+def reap(queue: RedisWorkQueue, stop: threading.Event, interval: float):
+    """Periodically re-queue tasks abandoned by crashed workers."""
+    while not stop.wait(interval):
+        try:
+            recovered = queue.requeue_expired(
+                on_dead=lambda task: _mark_dead(task, "the worker stopped responding")
+            )
+        except Exception:
+            logger.exception("Could not re-queue expired tasks")
+            continue
+        if recovered:
+            logger.warning("Re-queued %s expired task(s)", recovered)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Consume extraction tasks from the Redis work queue."
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=UPLOAD_CONCURRENCY,
+        help="tasks processed in parallel by this replica",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    queue = get_queue()
+    if queue is None:
+        parser.error("QUEUE_BACKEND=redis is required to run a standalone worker")
+    init_db()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    threads = [
+        threading.Thread(target=consume, args=(queue, stop), daemon=True)
+        for _ in range(max(1, args.concurrency))
+    ]
+    threads.append(
+        threading.Thread(
+            target=reap,
+            args=(queue, stop, max(1, queue.visibility_timeout / 4)),
+            daemon=True,
+        )
+    )
+    for t in threads:
+        t.start()
+    logger.info("Worker started with %s consumer thread(s)", args.concurrency)
+    while not stop.is_set():
+        time.sleep(0.5)
+    for t in threads:
+        t.join()
+
+
+if __name__ == '__main__':
+    main()
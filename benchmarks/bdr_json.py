@@ -0,0 +1,61 @@
+"""Compare local and LLM conversion of BDR markdown tables to JSON.
+
+Runs every ``tests/fixtures/bdr/*.md`` file through ``bdr_markdown_to_json``
+and, with ``--llm``, through ``call_openai_bdr_json`` (needs
+``OPENAI_API_KEY``)::
+
+    python -m benchmarks.bdr_json --iterations 1000 --llm
+"""
+import sys
+import time
+import pathlib
+import argparse
+import statistics
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+from backend.bdr_extractor import (  # noqa: E402
+    bdr_markdown_to_json,
+    bdr_missing_fields,
+    call_openai_bdr_json,
+)
+
+FIXTURES = pathlib.Path(__file__).resolve().parents[1] / "tests" / "fixtures" / "bdr"
+
+
+def _time_call(func, *args, iterations: int = 1) -> float:
+    """Return the median wall-clock time of ``func(*args)`` in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--llm", action="store_true", help="also time the model call")
+    parser.add_argument("--model", default=None)
+    args = parser.parse_args(argv)
+
+    print(f"{'fixture':<24} {'local ms':>9} {'conf':>5} {'escalate':>8} {'llm ms':>9}")
+    for path in sorted(FIXTURES.glob("*.md")):
+        md = path.read_text()
+        data, confidence = bdr_markdown_to_json(md)
+        escalate = bool(bdr_missing_fields(data))
+        local_ms = _time_call(bdr_markdown_to_json, md, iterations=args.iterations)
+        llm_ms = (
+            f"{_time_call(call_openai_bdr_json, md, args.model):9.1f}"
+            if args.llm
+            else f"{'-':>9}"
+        )
+        print(
+            f"{path.stem:<24} {local_ms:9.3f} {confidence:5.2f} "
+            f"{'yes' if escalate else 'no':>8} {llm_ms}"
+        )
+
+
+if __name__ == "__main__":
+    main()
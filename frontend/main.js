@@ -3,7 +3,6 @@ let fileElem = document.getElementById('fileElem');
 let gallery = document.getElementById('gallery');
 let progressContainer = document.getElementById('progress-container');
 let progressBar = document.getElementById('progress-bar');
-let progressInterval;
 let filesToUpload = [];
 let editorModal = document.getElementById('editor-modal');
 let editorImg = document.getElementById('editor-image');
@@ -63,44 +62,81 @@ if (dropArea) {
   fileElem.addEventListener('change', () => previewFiles(fileElem.files));
 }
 
+// Files over the server's size limit, such as full-resolution phone photos,
+// are scaled down to the longest edge any model is sent; the rest go up as
+// they are and the server sizes and encodes them per model.
+async function fitUpload(file, maxBytes, maxEdge){
+  if (!maxBytes || !maxEdge || file.size <= maxBytes) return file;
+  let img;
+  try {
+    img = await createImageBitmap(file);
+  } catch (err) {
+    return file;
+  }
+  const scale = Math.min(1, maxEdge / Math.max(img.width, img.height));
+  const width = Math.round(img.width * scale);
+  const height = Math.round(img.height * scale);
+  let canvas;
+  if (typeof OffscreenCanvas !== 'undefined') {
+    canvas = new OffscreenCanvas(width, height);
+  } else {
+    canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+  }
+  canvas.getContext('2d').drawImage(img, 0, 0, width, height);
+  let blob;
+  if (canvas.convertToBlob) {
+    blob = await canvas.convertToBlob({ type: 'image/jpeg', quality: 0.92 });
+  } else {
+    blob = await new Promise(res => canvas.toBlob(res, 'image/jpeg', 0.92));
+  }
+  const name = file.name.replace(/\.[^.]*$/, '') + '.jpg';
+  return new File([blob], name, { type: 'image/jpeg' });
+}
+
 let form = document.getElementById('form');
 if (form) {
   form.addEventListener('submit', async e => {
     e.preventDefault();
     startProgress();
-    const dt = new DataTransfer();
-
-    const processed = await Promise.all(
-      filesToUpload.map(async file => {
-        const img = await createImageBitmap(file);
-        const width = Math.min(img.width, 1024);
-        const height = Math.min(img.height, 1024);
-        let canvas;
-        if (typeof OffscreenCanvas !== 'undefined') {
-          canvas = new OffscreenCanvas(width, height);
-        } else {
-          canvas = document.createElement('canvas');
-          canvas.width = width;
-          canvas.height = height;
-        }
-        const ctx = canvas.getContext('2d');
-        ctx.drawImage(img, 0, 0, width, height);
-        let blob;
-        if (canvas.convertToBlob) {
-          blob = await canvas.convertToBlob({ type: 'image/jpeg', quality: 0.8 });
-        } else {
-          blob = await new Promise(res => canvas.toBlob(res, 'image/jpeg', 0.8));
-        }
-        return new File([blob], file.name, { type: 'image/jpeg' });
-      })
-    );
 
-    processed.forEach(f => dt.items.add(f));
-    fileElem.files = dt.files;
-    form.submit();
+    const maxBytes = Number(form.dataset.maxFileBytes);
+    const maxEdge = Number(form.dataset.maxEdge);
+    const files = await Promise.all(
+      filesToUpload.map(f => fitUpload(f, maxBytes, maxEdge))
+    );
+    const data = new FormData(form);
+    data.delete('files');
+    files.forEach(f => data.append('files', f));
+    submitUpload(data);
   });
 }
 
+function submitUpload(data){
+  const xhr = new XMLHttpRequest();
+  xhr.open('POST', '/submit');
+  xhr.setRequestHeader('X-CSRFToken', getCSRFToken());
+  xhr.upload.onprogress = e => {
+    if (e.lengthComputable) setProgress(e.loaded, e.total);
+  };
+  xhr.onload = () => {
+    let res = {};
+    try { res = JSON.parse(xhr.responseText); } catch {}
+    if (xhr.status === 202 && res.results_url) {
+      window.location = res.results_url;
+      return;
+    }
+    stopProgress();
+    alert(res.error || 'Upload failed');
+  };
+  xhr.onerror = () => {
+    stopProgress();
+    alert('Upload failed');
+  };
+  xhr.send(data);
+}
+
 document.querySelectorAll('.retry-form').forEach(f => {
   f.addEventListener('submit', startProgress);
 });
@@ -113,22 +149,23 @@ function handleDrop(e) {
   previewFiles(files);
 }
 
+// Indeterminate indicator for single requests with no measurable progress.
 function startProgress() {
   if (!progressContainer) return;
   progressContainer.style.display = 'block';
-  progressBar.style.width = '0%';
-  let width = 0;
-  progressInterval = setInterval(() => {
-    if (width < 95) {
-      width += 1;
-      progressBar.style.width = width + '%';
-    }
-  }, 150);
+  progressContainer.classList.add('busy');
+}
+
+function setProgress(done, total) {
+  if (!progressContainer) return;
+  progressContainer.style.display = 'block';
+  progressContainer.classList.remove('busy');
+  progressBar.style.width = (total ? Math.round(100 * done / total) : 0) + '%';
 }
 
 function stopProgress() {
   if (!progressContainer) return;
-  clearInterval(progressInterval);
+  progressContainer.classList.remove('busy');
   progressBar.style.width = '100%';
   setTimeout(() => {
     progressContainer.style.display = 'none';
@@ -136,6 +173,85 @@ function stopProgress() {
   }, 300);
 }
 
+// Follow a background job over SSE, calling ``onRow`` for each row update
+// and ``onPartial`` with streamed output while a row is still running.
+function watchJob(jobId, onRow, onPartial){
+  const source = new EventSource(`/job/${jobId}/events`);
+  source.addEventListener('row', e => onRow(JSON.parse(e.data)));
+  if (onPartial) {
+    source.addEventListener('partial', e => onPartial(JSON.parse(e.data)));
+  }
+  source.addEventListener('progress', e => {
+    const d = JSON.parse(e.data);
+    setProgress(d.done, d.total);
+  });
+  source.addEventListener('done', () => {
+    source.close();
+    stopProgress();
+  });
+  // The server gave up on a job that stopped changing; keep checking
+  // without holding a connection open.
+  source.addEventListener('timeout', () => {
+    source.close();
+    pollJob(jobId, onRow);
+  });
+  return source;
+}
+
+function pollJob(jobId, onRow, interval = 5000){
+  fetch(`/job/${jobId}/status`)
+    .then(r => r.json())
+    .then(data => {
+      data.rows.forEach(onRow);
+      setProgress(data.done, data.total);
+      if (data.done === data.total) {
+        stopProgress();
+      } else {
+        setTimeout(() => pollJob(jobId, onRow, interval), interval);
+      }
+    })
+    .catch(() => setTimeout(() => pollJob(jobId, onRow, interval), interval));
+}
+
+function isFinished(status){
+  return status === 'done' || status === 'error';
+}
+
+function fillResultRow(row){
+  const el = document.querySelector(`.result[data-req-id='${row.id}']`);
+  if (!el || isFinished(el.dataset.status)) return;
+  const i = el.dataset.index;
+  const status = document.getElementById('status'+i);
+  el.dataset.status = row.status;
+  if (!isFinished(row.status)) {
+    status.textContent = row.status === 'running' ? 'Processing…' : 'Queued…';
+    return;
+  }
+  status.textContent = row.status === 'error' ? 'Extraction failed' : '';
+  document.getElementById('md'+i).textContent = row.output;
+  const table = document.getElementById('table'+i);
+  table.innerHTML = row.html;
+  makeTableEditable(table);
+  document.getElementById('prompt'+i).value = row.prompt;
+}
+
+function fillResultPartial(row){
+  const el = document.querySelector(`.result[data-req-id='${row.id}']`);
+  if (!el || isFinished(el.dataset.status)) return;
+  const i = el.dataset.index;
+  document.getElementById('status'+i).textContent = 'Receiving…';
+  document.getElementById('md'+i).textContent = row.output;
+  document.getElementById('table'+i).innerHTML = row.html;
+}
+
+function fillJobDetailRow(row){
+  if (!isFinished(row.status)) return;
+  const txt = document.querySelector(`textarea[name='output_${row.id}']`);
+  if (txt && !txt.value) txt.value = row.output;
+  const prompt = document.querySelector(`textarea[name='prompt_${row.id}']`);
+  if (prompt && !prompt.value) prompt.value = row.prompt;
+}
+
 function previewFiles(files) {
   filesToUpload = [...files];
   Array.from(gallery.querySelectorAll('img')).forEach(img => {
@@ -360,6 +476,14 @@ function tablesToMarkdown(container){
 
 document.addEventListener('DOMContentLoaded', () => {
   document.querySelectorAll('[data-editable-table]').forEach(el => makeTableEditable(el));
+  const body = document.body;
+  if (body.dataset.watchJob) {
+    if (body.dataset.jobId) {
+      watchJob(body.dataset.watchJob, fillJobDetailRow);
+    } else {
+      watchJob(body.dataset.watchJob, fillResultRow, fillResultPartial);
+    }
+  }
 });
 
 function adminGenerateJSON(id){
@@ -428,7 +552,9 @@ function bdrTablesToJSON(jobId, id){
       }
       const txt = document.querySelector(`textarea[name='bdr_json_${id}']`);
       if (txt) txt.value = data.bdr_json;
-      showStatus('BDR JSON generated');
+      showStatus(data.source === 'local'
+        ? `BDR JSON parsed locally (confidence ${data.confidence})`
+        : 'BDR JSON generated');
     })
     .finally(() => {
       stopProgress();
@@ -1,14 +1,17 @@
 import sys, pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 import os
+import shutil
 import tempfile
 import io
+import re
 import pytest
 
 UPLOAD_DIR = tempfile.mkdtemp()
 os.environ.setdefault('UPLOAD_FOLDER', UPLOAD_DIR)
 os.environ.setdefault('REDIS_URL', 'memory://')
 os.environ.setdefault('APP_PASSWORD', 'API2025')
+os.environ.setdefault('RESULT_CACHE', 'off')
 from backend.app import app
 from backend.models import init_db
 
@@ -22,38 +25,40 @@ def client():
     init_db()
     with app.test_client() as client:
         yield client
-    for f in os.listdir(db_dir):
-        os.remove(os.path.join(db_dir, f))
-    os.rmdir(db_dir)
+    shutil.rmtree(db_dir)
 
 
 def test_login(client):
     rv = client.post('/', data={'password': 'API2025'}, follow_redirects=True)
     assert b'Upload Images' in rv.data
+    assert b'data-max-file-bytes="8388608" data-max-edge="2048"' in rv.data
 
 
 def test_preprocess_image(tmp_path):
-    from backend.utils import preprocess_image
+    import base64
+    import io
+    from backend.variants import VariantStore
     from PIL import Image
 
     img_path = tmp_path / 'color.png'
     Image.new('RGB', (10, 10), 'red').save(img_path)
-    preprocess_image(str(img_path))
-    processed = Image.open(img_path)
+    variant = VariantStore(str(tmp_path / 'variants')).get(str(img_path))
+    processed = Image.open(io.BytesIO(base64.b64decode(variant.b64)))
     assert processed.mode == 'L'
-    assert (img_path.with_suffix(img_path.suffix + '.orig')).exists()
+    # The upload itself is left untouched
+    assert Image.open(img_path).mode == 'RGB'
 
 
 def test_log_request_saves_json(tmp_path):
     from backend.models import init_db, log_request
     from backend.utils import get_db
 
-    db = tmp_path / 't.db'
+    db = tmp_path / 'jobs.sqlite'
     init_db(str(db))
-    log_request('f', '1.1.1.1', 'p', 'o', db_path=str(db), json_text='{"a":1}')
+    log_request('job', 'f', '1.1.1.1', 'p', 'o', json_text='{"a":1}', db_path=str(db))
     with get_db(str(db)) as conn:
-        row = conn.execute('SELECT json FROM requests').fetchone()
-    assert row[0] == '{"a":1}'
+        row = conn.execute('SELECT job_id, json FROM requests').fetchone()
+    assert row == ('job', '{"a":1}')
 
 
 def test_job_detail_missing_db(client):
@@ -63,11 +68,14 @@ def test_job_detail_missing_db(client):
     assert b'Job not found' in rv.data
 
 
-def test_job_detail_upgrades_schema(client, tmp_path):
-    """Older job databases without the ``json`` column should be upgraded"""
+def test_job_detail_shows_imported_legacy_job(client, tmp_path):
+    """Per-job databases from older releases, even ones without the ``json``
+    column, show up once imported into the jobs database"""
     import sqlite3
     from pathlib import Path
     from backend.utils import UPLOAD_FOLDER
+    from backend.manage import import_jobs
+    from backend.models import get_requests
 
     client.post('/', data={'password': 'API2025'}, follow_redirects=True)
 
@@ -90,28 +98,132 @@ def test_job_detail_upgrades_schema(client, tmp_path):
     conn.commit()
     conn.close()
 
+    assert client.get('/job/old').status_code == 404
+    assert import_jobs(UPLOAD_FOLDER) == (1, 0)
     rv = client.get(f'/job/{db_path.stem}')
     assert rv.status_code == 200
     assert b'f' in rv.data
-    with sqlite3.connect(db_path) as conn_check:
-        cols = [r[1] for r in conn_check.execute('PRAGMA table_info(requests)')]
-    assert 'json' in cols
-    assert 'bdr_json' in cols
-    assert 'bdr_md' in cols
+    row = get_requests('old')[0]
+    assert (row['filename'], row['json'], row['status']) == ('f', None, 'done')
 
 
 def test_delete_job(client, tmp_path):
     client.post('/', data={'password': 'API2025'}, follow_redirects=True)
-    from pathlib import Path
-    from backend.utils import UPLOAD_FOLDER
-    from backend.models import init_db
+    from backend.models import log_request, job_exists
 
-    db_path = Path(UPLOAD_FOLDER) / 'del.db'
-    init_db(str(db_path))
+    log_request('del', 'f', 'ip', 'p', 'o')
 
-    rv = client.post(f'/delete_job/{db_path.stem}', follow_redirects=True)
+    rv = client.post('/delete_job/del', follow_redirects=True)
     assert rv.status_code == 200
-    assert not db_path.exists()
+    assert not job_exists('del')
+
+
+def test_history_pages_with_keyset_cursor(client):
+    from backend.app import limiter
+    from backend.models import log_request, delete_job
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    for n in range(5):
+        log_request(f'job-{n}', f'f{n}.png', 'ip', 'p', 'o')
+    log_request('job-0', 'latest.png', 'ip2', 'p', 'o')
+    delete_job('job-4')
+
+    first = client.get('/history/jobs?limit=2').get_json()
+    assert [j['job_id'] for j in first['jobs']] == ['job-0', 'job-3']
+    assert first['jobs'][0]['filename'] == 'latest.png'
+    assert first['jobs'][0]['rows'] == 2
+    second = client.get(f"/history/jobs?limit=2&before={first['next']}").get_json()
+    assert [j['job_id'] for j in second['jobs']] == ['job-2', 'job-1']
+    assert second['next'] is None
+
+    rv = client.get('/history?limit=2')
+    assert b'job-3' in rv.data and b'job-2' not in rv.data
+    assert f"before={first['next']}".encode() in rv.data
+
+
+def test_search_highlights_and_escapes_matches(client):
+    from backend.app import limiter
+    from backend.models import log_request, set_job_name
+    limiter.reset()
+    assert client.get('/search/requests?q=x').status_code == 401
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    log_request('job-s', 'a.png', 'ip', 'p', '<b>IFO 380</b> at Tacoma')
+    set_job_name('job-s', 'Vessel X')
+    data = client.get('/search/requests?q=tacoma').get_json()
+    assert [r['job_id'] for r in data['results']] == ['job-s']
+    assert data['results'][0]['job_name'] == 'Vessel X'
+    assert '&lt;b&gt;IFO 380&lt;/b&gt; at <mark>Tacoma</mark>' in data['results'][0]['highlight']
+    assert data['more'] is False
+
+    rv = client.get('/search?q=vessel')
+    assert b'job-s' in rv.data and b'<mark>Vessel</mark>' in rv.data
+    assert b'No matches' in client.get('/search?q=nothing').data
+
+
+def test_facts_endpoint_aggregates_stored_json(client):
+    from backend.app import limiter
+    import json
+    from backend.models import log_request
+    limiter.reset()
+    assert client.get('/facts/products').status_code == 401
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    report = {'productsDischarged': [{'productName': 'MGO', 'netBbls': 10}],
+              'eventTimeline': [{'event': 'Arrived', 'date': '2025-04-02', 'time': ''}]}
+    log_request('job-f', 'a.png', 'ip', 'p', 'o', json_text=json.dumps(report))
+    rv = client.get('/facts/products?group=product,month&measure=sum:net_bbls')
+    assert rv.get_json() == {'rows': [{'product': 'MGO', 'month': '2025-04', 'sum_net_bbls': 10.0}]}
+    rv = client.get('/facts/products?group=ip')
+    assert rv.status_code == 400 and 'ip' in rv.get_json()['message']
+
+
+def test_export_streams_rows(client):
+    from backend.app import limiter
+    import json
+    from backend.models import log_request
+    limiter.reset()
+    assert client.get('/export').status_code == 302
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    first = log_request('job-e', 'a.png', 'ip', 'p', 'one')
+    log_request('job-e', 'b.png', 'ip', 'p', 'two')
+    rv = client.get(f'/export?format=ndjson&job_id=job-e&after={first}')
+    assert rv.mimetype == 'application/x-ndjson'
+    assert 'attachment' in rv.headers['Content-Disposition']
+    assert [line['output'] for line in map(json.loads, rv.data.splitlines())] == ['two']
+    assert client.get('/export?format=xml').status_code == 400
+
+
+def test_job_archive_download(client):
+    from backend.app import limiter
+    import io
+    import zipfile
+    from backend.models import log_request
+    limiter.reset()
+    assert client.get('/job/job-z/archive').status_code == 302
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    assert client.get('/job/job-z/archive').status_code == 404
+    log_request('job-z', 'a.png', 'ip', 'p', 'table')
+    rv = client.get('/job/job-z/archive')
+    assert rv.mimetype == 'application/zip'
+    assert 'job-z.zip' in rv.headers['Content-Disposition']
+    assert 'manifest.json' in zipfile.ZipFile(io.BytesIO(rv.data)).namelist()
+
+
+def test_events_stream_times_out_on_stuck_job(client):
+    from unittest.mock import patch
+    from backend.app import limiter
+    from backend.models import log_request
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    log_request('stuck', 'a.png', 'ip', 'p', '', status='running')
+    with patch('backend.app.SSE_IDLE_SECONDS', 0.2), patch('backend.app.SSE_POLL_INTERVAL', 0.05):
+        body = client.get('/job/stuck/events').get_data(as_text=True)
+    assert 'event: timeout' in body and 'event: done' not in body
 
 
 def test_login_rate_limit(client):
@@ -128,49 +240,45 @@ def test_update_json_endpoint(client):
     from backend.app import limiter
     limiter.reset()
     client.post('/', data={'password': 'API2025'}, follow_redirects=True)
-    from pathlib import Path
-    from backend.utils import UPLOAD_FOLDER, get_db
-    from backend.models import init_db
+    from backend.models import log_request, get_request
 
-    db_path = Path(UPLOAD_FOLDER) / 'u.db'
-    init_db(str(db_path))
-    with get_db(str(db_path)) as conn:
-        conn.execute(
-            "INSERT INTO requests (filename, timestamp, ip, prompt, output, json) VALUES (?,?,?,?,?,?)",
-            ('f', 't', '1.1.1.1', 'p', 'o', '{"a":1}')
-        )
-        req_id = conn.execute("SELECT id FROM requests").fetchone()[0]
+    req_id = log_request('u', 'f', '1.1.1.1', 'p', 'o', json_text='{"a":1}')
 
-    rv = client.post(f'/update_json/{db_path.stem}/{req_id}', json={'json': '{"b":2}'})
+    rv = client.post(f'/update_json/u/{req_id}', json={'json': '{"b":2}'})
     assert rv.status_code == 200
-    with get_db(str(db_path)) as conn:
-        row = conn.execute('SELECT json FROM requests WHERE id=?', (req_id,)).fetchone()
-    assert row[0] == '{"b":2}'
+    assert get_request('u', req_id)['json'] == '{"b":2}'
+
+    rv = client.post(f'/update_json/other/{req_id}', json={'json': '{"b":3}'})
+    assert rv.status_code == 404
 
-    rv = client.post(f'/update_json/{db_path.stem}/{req_id}', json={'json': '{bad'})
+    rv = client.post(f'/update_json/u/{req_id}', json={'json': '{bad'})
     assert rv.status_code == 400
 
 
-def test_init_db_creates_attachment_table(tmp_path):
+def test_init_db_creates_job_tables(tmp_path):
     import sqlite3
     from backend.models import init_db
 
-    db = tmp_path / 'a.db'
+    db = tmp_path / 'jobs.sqlite'
     init_db(str(db))
     with sqlite3.connect(db) as conn:
-        cols = [r[1] for r in conn.execute('PRAGMA table_info(job_attachments)')]
-    assert {'id', 'filename', 'timestamp'} <= set(cols)
+        cols = {
+            table: {r[1] for r in conn.execute(f'PRAGMA table_info({table})')}
+            for table in ('jobs', 'requests', 'attachments')
+        }
+        indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {'job_id', 'name', 'created'} <= cols['jobs']
+    assert {'job_id', 'filename', 'timestamp', 'status', 'metrics'} <= cols['requests']
+    assert {'id', 'job_id', 'filename', 'timestamp'} <= cols['attachments']
+    assert {'idx_jobs_name', 'idx_requests_timestamp', 'idx_requests_filename'} <= indexes
 
 
 def test_upload_attachment(client, tmp_path):
     client.post('/', data={'password': 'API2025'}, follow_redirects=True)
-    from pathlib import Path
-    from backend.utils import UPLOAD_FOLDER, get_db
-    from backend.models import init_db
+    from backend.models import create_job, get_attachments
 
     job_id = 'attjob'
-    db_path = Path(UPLOAD_FOLDER) / f'{job_id}.db'
-    init_db(str(db_path))
+    create_job(job_id)
     data = {
         'attachment': (io.BytesIO(b'data'), 'doc.txt'),
     }
@@ -181,6 +289,173 @@ def test_upload_attachment(client, tmp_path):
         follow_redirects=True,
     )
     assert rv.status_code == 200
-    with get_db(str(db_path)) as conn:
-        row = conn.execute('SELECT filename FROM job_attachments').fetchone()
-    assert row is not None
+    assert len(get_attachments(job_id)) == 1
+
+
+def test_job_detail_saves_only_changed_fields(client):
+    from backend.app import limiter
+    from backend.models import log_request, get_request, set_request_output
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    first = log_request('edit', 'a.png', 'ip', 'p', 'line 1\nline 2')
+    second = log_request('edit', 'b.png', 'ip', 'p', 'o2')
+    page = client.get('/job/edit').data.decode()
+    form = dict(re.findall(r'<input type="hidden" name="(\w+_\d+)" value="(\w*)">', page))
+    assert form[f'version_{first}'] == '0'
+    for req_id, output in ((first, 'line 1\r\nline 2'), (second, 'o2')):
+        form.update({
+            f'prompt_{req_id}': 'p', f'output_{req_id}': output, f'json_{req_id}': '',
+            f'bdr_md_{req_id}': '', f'bdr_json_{req_id}': '',
+        })
+    form['job_name'] = 'Renamed'
+    form[f'json_{second}'] = '{"a": 1}'
+
+    rv = client.post('/job/edit', data=form, follow_redirects=True)
+    assert b'Job updated' in rv.data
+    assert get_request('edit', first)['version'] == 0
+    row = get_request('edit', second)
+    assert (row['json'], row['output'], row['version']) == ('{"a": 1}', 'o2', 1)
+    assert b'Renamed' in rv.data
+
+    # The worker rewrote the row after the form was rendered
+    set_request_output('edit', first, 'p', 'fresh')
+    form[f'output_{first}'] = 'mine'
+    rv = client.post('/job/edit', data=form, follow_redirects=True)
+    assert b'Not saved' in rv.data
+    assert get_request('edit', first)['output'] == 'fresh'
+    assert get_request('edit', second)['version'] == 1
+
+
+def test_upload_processes_files_concurrently(client):
+    import time
+    from unittest.mock import patch
+    from backend.app import limiter
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    def fake_call(path, prompt, filename, model=None, crop_top_fraction=None, metrics=None):
+        with open(path, 'rb') as fh:
+            idx = int(fh.read().decode())
+        # Earlier files finish last to check results keep upload order
+        time.sleep(0.1 * (4 - idx))
+        return f'output-{idx}'
+
+    data = {
+        'files': [
+            (io.BytesIO(str(i).encode()), f'{i}.png') for i in range(4)
+        ],
+    }
+    start = time.monotonic()
+    with patch('backend.worker.call_openai', side_effect=fake_call):
+        rv = client.post('/upload', data=data, content_type='multipart/form-data')
+    elapsed = time.monotonic() - start
+    assert rv.status_code == 200
+    assert elapsed < 0.8
+    outputs = re.findall(r'output-(\d)', rv.data.decode())
+    # Each output appears in the markdown block and the rendered table
+    assert outputs == ['0', '0', '1', '1', '2', '2', '3', '3']
+
+
+def test_submit_processes_in_background(client):
+    import json
+    import time
+    import threading
+    from unittest.mock import patch
+    from backend.app import limiter
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    release = threading.Event()
+
+    def fake_call(path, prompt, filename, model=None, crop_top_fraction=None, metrics=None):
+        release.wait(5)
+        return '|A|B|\n|--|--|\n|1|2|'
+
+    data = {'files': [(io.BytesIO(b'x'), 'a.png'), (io.BytesIO(b'y'), 'b.png')]}
+    with patch('backend.worker.call_openai', side_effect=fake_call):
+        rv = client.post('/submit', data=data, content_type='multipart/form-data')
+        assert rv.status_code == 202
+        job_id = rv.get_json()['job_id']
+
+        status = client.get(f'/job/{job_id}/status').get_json()
+        assert status['total'] == 2
+        assert status['done'] == 0
+        assert all(r['status'] in ('pending', 'running') for r in status['rows'])
+
+        release.set()
+        rv = client.get(f'/job/{job_id}/events')
+        assert rv.mimetype == 'text/event-stream'
+        body = rv.get_data(as_text=True)
+
+    assert 'event: done' in body
+    rows = [
+        json.loads(line[len('data: '):])
+        for event, line in zip(body.splitlines(), body.splitlines()[1:])
+        if event == 'event: row'
+    ]
+    finished = [r for r in rows if r['status'] == 'done']
+    assert len(finished) == 2
+    assert '<table>' in finished[0]['html']
+
+    status = client.get(f'/job/{job_id}/status').get_json()
+    assert status['done'] == 2
+    rv = client.get(f'/results/{job_id}')
+    assert rv.status_code == 200
+    assert b'<table>' in rv.data
+
+
+def test_json_export_parses_tables_locally(client):
+    import json
+    from unittest.mock import patch
+    from backend.app import limiter
+    from tests.test_tank_extractor import SAMPLE
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    with patch('backend.app.call_openai_json') as llm:
+        rv = client.post('/json', json={'markdown': SAMPLE})
+        assert not llm.called
+    data = rv.get_json()
+    assert data['source'] == 'local'
+    tank = json.loads(data['json'])['tankConditions']['arrival'][0]
+    assert 'VCF' in tank
+
+    with patch('backend.app.call_openai_json', return_value='{"a": 1}') as llm:
+        rv = client.post('/json', json={'markdown': 'no tables'})
+        assert llm.called
+    assert rv.get_json()['source'] == 'llm'
+
+
+def test_bdr_json_local_first(client):
+    import json
+    from pathlib import Path
+    from unittest.mock import patch
+    from backend.app import limiter
+    limiter.reset()
+    client.post('/', data={'password': 'API2025'}, follow_redirects=True)
+
+    from backend.models import log_request
+    req_id = log_request('bdrjob', 'f', 'ip', 'p', 'o')
+    fixtures = Path(__file__).resolve().parent / 'fixtures' / 'bdr'
+
+    with patch('backend.app.call_openai_bdr_json') as llm:
+        rv = client.post(
+            f'/bdr_json/bdrjob/{req_id}',
+            json={'markdown': (fixtures / 'matson_anchorage.md').read_text()},
+        )
+        assert not llm.called
+    data = rv.get_json()
+    assert data['source'] == 'local'
+    assert data['confidence'] == 1.0
+    assert json.loads(data['bdr_json'])['vessel_name'] == 'MATSON ANCHORAGE'
+
+    with patch(
+        'backend.app.call_openai_bdr_json', return_value='{"vessel_name": "X"}'
+    ) as llm:
+        rv = client.post(
+            f'/bdr_json/bdrjob/{req_id}',
+            json={'markdown': (fixtures / 'missing_weight.md').read_text()},
+        )
+        assert llm.called
+    assert rv.get_json()['source'] == 'llm'
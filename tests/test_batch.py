@@ -0,0 +1,108 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+import json
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from backend import batch
+from backend.models import init_db, log_request, add_attachment
+from backend.utils import get_db
+from backend.variants import VariantStore
+
+from test_tank_extractor import SAMPLE
+
+
+@pytest.fixture(autouse=True)
+def variants(tmp_path, monkeypatch):
+    """Keep image variants rendered by these tests out of the source tree."""
+    monkeypatch.setattr('backend.variants.variant_store', VariantStore(str(tmp_path / 'variants')))
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Two stored jobs with images in a temporary upload folder."""
+    with patch('backend.blobs.UPLOAD_FOLDER', str(tmp_path)), patch(
+        'backend.models.DB_PATH', str(tmp_path / 'jobs.sqlite')
+    ):
+        init_db()
+        for job_id, files in (('job-a', ['a1.png', 'a2.png']), ('job-b', ['b1.png'])):
+            for name in files:
+                Image.new('RGB', (8, 8), 'white').save(tmp_path / name)
+                log_request(job_id, name, 'ip', 'old prompt', 'old output')
+        yield tmp_path
+
+
+def _rows(path, job_id, columns='output, prompt'):
+    with get_db(str(path / 'jobs.sqlite')) as conn:
+        return conn.execute(
+            f'SELECT {columns} FROM requests WHERE job_id=? ORDER BY id', (job_id,)
+        ).fetchall()
+
+
+def test_run_tables_backfill_offline(archive, tmp_path):
+    bodies = []
+
+    def respond(body):
+        bodies.append(body)
+        return f"| new | {body['model']} |"
+
+    prompt_file = tmp_path / 'prompt.txt'
+    prompt_file.write_text('new prompt')
+    client = batch.LocalBatchClient(respond)
+    batch.main(
+        ['run', 'tables', '--model', 'gpt-4.1', '--prompt-file', str(prompt_file), '--poll-interval', '0'],
+        client=client,
+    )
+    assert len(bodies) == 3
+    assert bodies[0]['messages'][0]['content'][0]['text'] == 'new prompt'
+    assert bodies[0]['messages'][0]['content'][1]['image_url']['url'].startswith('data:image/')
+    assert _rows(archive, 'job-a') == [('| new | gpt-4.1 |', 'new prompt')] * 2
+    assert _rows(archive, 'job-b') == [('| new | gpt-4.1 |', 'new prompt')]
+
+
+def test_failed_requests_leave_rows_untouched(archive):
+    def respond(body):
+        raise RuntimeError('nope')
+
+    client = batch.LocalBatchClient(respond)
+    ids = batch.submit(client, 'tables', ['job-b'])
+    assert batch.collect(client, ids, poll_interval=0) == (0, 1)
+    assert _rows(archive, 'job-b') == [('old output', 'old prompt')]
+
+
+def test_json_backfill_parses_locally_first(archive):
+    with get_db(str(archive / 'jobs.sqlite')) as conn:
+        conn.execute("UPDATE requests SET output=? WHERE id=1", (SAMPLE,))
+    report = json.dumps({'tankConditions': {'arrival': [], 'departure': []}})
+    client = batch.LocalBatchClient(lambda body: report)
+    ids = batch.submit(client, 'json', ['job-a'])
+    # Only the row that did not parse locally went to the batch
+    assert [r['custom_id'] for r in client.batches[ids[0]]] == ['json:job-a:2']
+    assert batch.collect(client, ids, poll_interval=0) == (1, 0)
+    rows = _rows(archive, 'job-a', 'json')
+    assert json.loads(rows[0][0])['tankConditions']['arrival'][0]['tank'] == '1P'
+    assert json.loads(rows[1][0]) == json.loads(report)
+
+
+def test_bdr_backfill_uses_latest_attachment(archive):
+    Image.new('RGB', (8, 10), 'black').save(archive / 'bdr.png')
+    add_attachment('job-b', 'bdr.png')
+    client = batch.LocalBatchClient(lambda body: '| Vessel Name |')
+    with patch('backend.batch._vision_params', wraps=batch._vision_params) as params:
+        ids = batch.submit(client, 'bdr', ['job-b'])
+    path, prompt, _, crop = params.call_args.args
+    assert path == str(archive / 'bdr.png')
+    assert crop == batch.BDR_CROP_TOP_FRACTION
+    batch.collect(client, ids, poll_interval=0)
+    assert _rows(archive, 'job-b', 'bdr_md') == [('| Vessel Name |',)]
+
+
+def test_chunk_requests_respects_limits():
+    lines = [{'custom_id': str(i), 'body': {}} for i in range(5)]
+    assert len(list(batch.chunk_requests(lines, max_requests=2))) == 3
+    one = len(json.dumps(lines[0])) + 1
+    assert len(list(batch.chunk_requests(lines, max_bytes=one * 2))) == 3
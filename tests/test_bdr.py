@@ -41,3 +41,34 @@ def test_extract_bdr_variant_headers():
     assert prod["weight_mt"] == 100
 
 
+
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / "fixtures" / "bdr"
+
+
+def test_bdr_markdown_to_json_fixture():
+    from backend.bdr_extractor import bdr_markdown_to_json, bdr_missing_fields
+
+    data, confidence = bdr_markdown_to_json((FIXTURES / "two_products.md").read_text())
+    assert data["vessel_name"] == "PACIFIC STAR"
+    assert data["imo_number"] == "9456123"
+    assert data["delivery_port"] == "LONG BEACH, CA"
+    assert [p["product_description"] for p in data["products"]] == ["VLSFO", "MGO"]
+    mgo = data["products"][1]
+    assert mgo["weight_mt"] == 98.10
+    assert mgo["viscosity"] == {"value": 3.1, "unit": "cSt", "measured_at": "40C"}
+    assert math.isclose(mgo["flash_point_f"], 147.2, abs_tol=0.1)
+    assert confidence == 1.0
+    assert bdr_missing_fields(data) == []
+
+
+def test_bdr_markdown_to_json_reports_missing_fields():
+    from backend.bdr_extractor import bdr_markdown_to_json, bdr_missing_fields
+
+    data, confidence = bdr_markdown_to_json((FIXTURES / "missing_weight.md").read_text())
+    assert data["imo_number"] is None
+    assert confidence < 1.0
+    assert bdr_missing_fields(data) == ["products[0].weight_mt"]
+    empty, confidence = bdr_markdown_to_json("nothing here")
+    assert confidence == 0
+    assert bdr_missing_fields(empty) == ["vessel_name", "products"]
@@ -0,0 +1,108 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import io
+import os
+import tempfile
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp())
+os.environ.setdefault('REDIS_URL', 'memory://')
+os.environ.setdefault('APP_PASSWORD', 'API2025')
+os.environ.setdefault('RESULT_CACHE', 'off')
+
+import pytest
+
+from backend import blobs
+from backend.manage import main
+from backend.models import init_db
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    db = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', db)
+    monkeypatch.setattr('backend.blobs.UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr('backend.blobs.BLOB_FOLDER', str(tmp_path / 'blobs'))
+    init_db(db)
+    return tmp_path
+
+
+def test_identical_uploads_share_one_blob(store):
+    first = blobs.store('a.png', io.BytesIO(b'same bytes'))
+    second = blobs.store('b.png', io.BytesIO(b'same bytes'))
+    other = blobs.store('c.png', io.BytesIO(b'other'))
+    assert first == second != other
+    digest = os.path.basename(first)
+    assert first == str(store / 'blobs' / digest[:2] / digest[2:4] / digest)
+    assert blobs.upload_path('b.png') == first
+    assert blobs.stats() == {
+        'files': 3, 'blobs': 2, 'stored_bytes': 15, 'deduplicated_bytes': 10,
+    }
+    assert not os.listdir(store / 'blobs' / 'tmp')
+
+    assert blobs.release('a.png') == 0
+    assert os.path.exists(first)
+    assert blobs.release('b.png') == len(b'same bytes')
+    assert not os.path.exists(first)
+    assert blobs.release('b.png') == 0
+
+
+def test_blob_is_unlinked_after_its_rows_are_committed(store, monkeypatch):
+    import sqlite3
+
+    path = blobs.store('a.png', io.BytesIO(b'bytes'))
+    remove = os.remove
+    seen = []
+
+    def checked_remove(p):
+        # A fresh connection sees only committed data
+        with sqlite3.connect(store / 'jobs.sqlite') as conn:
+            seen.append(conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0])
+        remove(p)
+
+    monkeypatch.setattr('backend.blobs.os.remove', checked_remove)
+    assert blobs.release('a.png') == len(b'bytes')
+    assert seen == [0]
+    assert not os.path.exists(path)
+
+
+def test_unknown_names_fall_back_to_flat_uploads(store):
+    assert blobs.upload_path('old.png') == str(store / 'old.png')
+
+
+def test_import_uploads_moves_flat_files(store, capsys):
+    (store / 'old.png').write_bytes(b'processed')
+    (store / 'old.png.orig').write_bytes(b'original')
+    (store / 'notes.txt').write_bytes(b'ignored')
+    db = str(store / 'jobs.sqlite')
+
+    main(['import-uploads', '--folder', str(store), '--db', db])
+    assert '1 upload(s) imported, 0 skipped' in capsys.readouterr().out
+    with open(blobs.upload_path('old.png'), 'rb') as fh:
+        assert fh.read() == b'original'
+
+    main(['import-uploads', '--folder', str(store), '--db', db, '--remove'])
+    assert '0 upload(s) imported, 1 skipped' in capsys.readouterr().out
+    assert sorted(p.name for p in store.iterdir() if p.is_file() and 'jobs' not in p.name) == ['notes.txt']
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    from backend.app import app, limiter
+
+    monkeypatch.setitem(app.config, 'TESTING', True)
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    monkeypatch.setattr('backend.app.UPLOAD_FOLDER', str(store))
+    limiter.reset()
+    with app.test_client() as client:
+        client.post('/', data={'password': 'API2025'})
+        yield client
+
+
+def test_uploads_route_serves_blobs_and_legacy_files(store, client):
+    blobs.store('new.png', io.BytesIO(b'blob bytes'))
+    (store / 'legacy.png').write_bytes(b'flat bytes')
+    rv = client.get('/uploads/new.png')
+    assert rv.data == b'blob bytes'
+    assert rv.mimetype == 'image/png'
+    rv.close()
+    assert client.get('/uploads/legacy.png').data == b'flat bytes'
+    assert client.get('/uploads/missing.png').status_code == 404
@@ -0,0 +1,89 @@
+import sys, pathlib, os
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+os.environ.setdefault('RESULT_CACHE', 'off')
+from unittest.mock import patch, MagicMock
+import fakeredis
+import pytest
+
+from backend.cache import SQLiteResultCache, RedisResultCache, cache_key
+from backend.variants import VariantStore
+
+
+@pytest.fixture(autouse=True)
+def variants(tmp_path, monkeypatch):
+    """Keep image variants rendered by these tests out of the source tree."""
+    monkeypatch.setattr('backend.variants.variant_store', VariantStore(str(tmp_path / 'variants')))
+
+
+def test_cache_key_depends_on_every_input():
+    base = cache_key(b'img', 'prompt', 'model', None)
+    assert base == cache_key(b'img', 'prompt', 'model', None)
+    assert base != cache_key(b'img2', 'prompt', 'model', None)
+    assert base != cache_key(b'img', 'prompt2', 'model', None)
+    assert base != cache_key(b'img', 'prompt', 'model2', None)
+    assert base != cache_key(b'img', 'prompt', 'model', 0.4)
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def make_cache(request, tmp_path):
+    def factory(**kwargs):
+        if request.param == 'sqlite':
+            return SQLiteResultCache(str(tmp_path / 'cache.sqlite'), **kwargs)
+        return RedisResultCache(fakeredis.FakeRedis(), **kwargs)
+    return factory
+
+
+def test_cache_hits_misses_and_size_eviction(make_cache):
+    cache = make_cache(ttl=60, max_entries=2)
+    assert cache.get('a') is None
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C')
+    # ``b`` is the least recently used entry
+    assert cache.get('b') is None
+    assert cache.get('c') == 'C'
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['entries'] == 2
+
+
+def test_sqlite_cache_expires_entries(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    with patch('backend.cache.time.time', return_value=1000):
+        cache.set('a', 'A')
+    with patch('backend.cache.time.time', return_value=1059):
+        assert cache.get('a') == 'A'
+    with patch('backend.cache.time.time', return_value=1061):
+        assert cache.get('a') is None
+
+
+def test_call_openai_uses_cache_and_bypass_refreshes(tmp_path):
+    from PIL import Image
+    from backend.utils import call_openai
+
+    img = tmp_path / 'img.png'
+    Image.new('RGB', (10, 10), 'red').save(img)
+    copy = tmp_path / 'copy.png'
+    Image.new('RGB', (10, 10), 'red').save(copy)
+    cache = SQLiteResultCache(str(tmp_path / 'cache.sqlite'))
+    chat_mock = MagicMock()
+    chat_mock.completions.create.side_effect = [
+        MagicMock(choices=[MagicMock(message=MagicMock(content=text))])
+        for text in ('first', 'second', 'third')
+    ]
+    with patch('backend.cache.get_result_cache', return_value=cache), patch(
+        'backend.utils.openai.chat', chat_mock
+    ):
+        assert call_openai(str(img), 'p', img.name) == 'first'
+        # Same image content under another name is served from the cache
+        assert call_openai(str(copy), 'p', copy.name) == 'first'
+        assert chat_mock.completions.create.call_count == 1
+        hits, misses = cache.stats()['hits'], cache.stats()['misses']
+        assert call_openai(str(img), 'p', img.name, use_cache=False) == 'second'
+        # A bypass neither reads the cache nor counts towards its stats
+        assert (cache.stats()['hits'], cache.stats()['misses']) == (hits, misses)
+        assert call_openai(str(img), 'p', img.name) == 'second'
+        assert call_openai(str(img), 'other', img.name) == 'third'
+    assert chat_mock.completions.create.call_count == 3
@@ -1,20 +1,85 @@
 import sys, pathlib, os
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+os.environ.setdefault('RESULT_CACHE', 'off')
+import io
 from datetime import datetime, timedelta
-import importlib
-
-
-def test_purge_old_uploads(tmp_path, monkeypatch):
-    old_file = tmp_path / 'old.txt'
-    new_file = tmp_path / 'new.txt'
-    old_file.write_text('x')
-    new_file.write_text('y')
-    old_time = (datetime.utcnow() - timedelta(days=8)).timestamp()
-    os.utime(old_file, (old_time, old_time))
-    monkeypatch.setenv('UPLOAD_FOLDER', str(tmp_path))
-    from backend import utils, cleanup
-    importlib.reload(utils)
-    importlib.reload(cleanup)
-    cleanup.purge_old_uploads(days=7)
-    assert not old_file.exists()
-    assert new_file.exists()
+
+import pytest
+from PIL import Image
+
+from backend import cleanup
+from backend.blobs import store, lookup
+from backend.models import init_db, log_request, add_attachment, job_exists, jobs_db
+from backend.variants import VariantStore
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    db = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', db)
+    monkeypatch.setattr('backend.blobs.UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr('backend.blobs.BLOB_FOLDER', str(tmp_path / 'blobs'))
+    monkeypatch.setattr('backend.cleanup.BLOB_FOLDER', str(tmp_path / 'blobs'))
+    monkeypatch.setattr('backend.cleanup.variant_store', VariantStore(str(tmp_path / 'variants')))
+    init_db(db)
+    return tmp_path
+
+
+def _png(color):
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buf, format='PNG')
+    buf.seek(0)
+    return buf
+
+
+def _age(job_id, days):
+    stamp = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    with jobs_db() as conn:
+        conn.execute("UPDATE jobs SET last_timestamp=?, created=? WHERE job_id=?", (stamp, stamp, job_id))
+
+
+def test_purge_job_removes_its_files_only(uploads):
+    path = store('a.png', _png('red'))
+    cleanup.variant_store.get(path)
+    store('bdr.png', _png('blue'))
+    log_request('old', 'a.png', 'ip', 'p', 'o')
+    add_attachment('old', 'bdr.png')
+    # A retry of the same upload in another job keeps it alive
+    log_request('retry', 'a.png', 'ip', 'p', 'o')
+    (uploads / 'legacy.png').write_bytes(b'x' * 10)
+    (uploads / 'legacy.png.orig').write_bytes(b'y' * 5)
+    log_request('old', 'legacy.png', 'ip', 'p', 'o')
+    for suffix in ('.db', '.db-wal'):
+        (uploads / f'old{suffix}').write_bytes(b'z')
+
+    freed = cleanup.purge_job('old')
+    assert not job_exists('old')
+    assert lookup('bdr.png') is None and lookup('a.png')
+    assert os.path.exists(path)
+    assert not list(uploads.glob('legacy.png*')) and not list(uploads.glob('old.db*'))
+    assert freed >= 10 + 5 + 2
+
+    assert cleanup.purge_job('retry') > 0
+    assert not os.path.exists(path)
+    assert not os.listdir(uploads / 'variants' / os.path.basename(path)[:2])
+
+
+def test_collect_applies_age_and_quota(uploads):
+    for n, color in enumerate(('red', 'green', 'blue', 'white')):
+        store(f'{n}.png', _png(color))
+        log_request(f'job-{n}', f'{n}.png', 'ip', 'p', 'o')
+    store('abandoned.png', _png('black'))
+    _age('job-0', 10)
+    with jobs_db() as conn:
+        conn.execute("UPDATE files SET created=? WHERE name='abandoned.png'", ('2000-01-01',))
+
+    report = cleanup.collect(days=7, quota_mb=0)
+    assert (report['expired'], report['over_quota'], report['orphans']) == (1, 0, 1)
+    assert report['bytes'] > 0
+    assert not job_exists('job-0') and lookup('abandoned.png') is None
+    assert cleanup.last_report == report
+
+    # Over quota: the oldest jobs go until the store fits
+    report = cleanup.collect(days=0, quota_mb=1e-9, batch=2)
+    assert report['over_quota'] == 2
+    assert [job_exists(f'job-{n}') for n in (1, 2, 3)] == [False, False, True]
@@ -1,10 +1,11 @@
-import sys, pathlib, os, re, tempfile
+import sys, pathlib, os, re, shutil, tempfile
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 
 UPLOAD_DIR = tempfile.mkdtemp()
 os.environ.setdefault('UPLOAD_FOLDER', UPLOAD_DIR)
 os.environ.setdefault('REDIS_URL', 'memory://')
 os.environ.setdefault('APP_PASSWORD', 'API2025')
+os.environ.setdefault('RESULT_CACHE', 'off')
 
 from backend.app import app
 from backend.models import init_db
@@ -19,12 +20,10 @@ def csrf_client():
     from backend.app import limiter
     limiter.reset()
     os.makedirs(db_dir, exist_ok=True)
-    init_db(os.path.join(db_dir, 'requests.db'))
+    init_db()
     with app.test_client() as client:
         yield client
-    for f in os.listdir(db_dir):
-        os.remove(os.path.join(db_dir, f))
-    os.rmdir(db_dir)
+    shutil.rmtree(db_dir)
 
 def test_login_csrf(csrf_client):
     rv = csrf_client.get('/')
@@ -0,0 +1,75 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import threading
+
+import pytest
+
+from backend.db import ConnectionPool, SQLITE_BUSY_TIMEOUT_MS
+
+
+def test_connections_are_reused_with_pragmas(tmp_path):
+    pool = ConnectionPool(size=4)
+    db = str(tmp_path / 'a.sqlite')
+    for _ in range(5):
+        with pool.connection(db) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS t (x)')
+    stats = pool.stats()
+    assert (stats['opened'], stats['reused'], stats['idle'], stats['in_use']) == (1, 4, 1, 0)
+    with pool.connection(db) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == SQLITE_BUSY_TIMEOUT_MS
+    pool.close_all()
+    assert pool.stats()['open'] == 0
+
+
+def test_nested_use_shares_the_outer_transaction(tmp_path):
+    pool = ConnectionPool()
+    db = str(tmp_path / 'a.sqlite')
+    with pool.connection(db) as conn:
+        conn.execute('CREATE TABLE t (x)')
+    with pytest.raises(RuntimeError):
+        with pool.connection(db) as outer:
+            outer.execute('INSERT INTO t VALUES (1)')
+            with pool.connection(db) as inner:
+                assert inner is outer
+                inner.execute('INSERT INTO t VALUES (2)')
+            raise RuntimeError('boom')
+    with pool.connection(db) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    assert pool.stats()['opened'] == 1
+
+
+def test_pool_is_bounded_and_drops_replaced_files(tmp_path):
+    pool = ConnectionPool(size=2)
+    paths = [str(tmp_path / f'{n}.sqlite') for n in range(3)]
+    for path in paths:
+        with pool.connection(path) as conn:
+            conn.execute('CREATE TABLE t (x)')
+    assert pool.stats()['evicted'] == 1
+    assert pool.stats()['open'] == 2
+
+    (tmp_path / '2.sqlite').unlink()
+    with pool.connection(paths[2]) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master").fetchall() == []
+    assert pool.stats()['stale'] == 1
+
+
+def test_threads_get_their_own_connections(tmp_path):
+    pool = ConnectionPool()
+    db = str(tmp_path / 'a.sqlite')
+    inside = threading.Barrier(3)
+    seen = []
+
+    def use():
+        with pool.connection(db) as conn:
+            seen.append(id(conn))
+            inside.wait(timeout=5)
+
+    threads = [threading.Thread(target=use) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(seen)) == 3
+    assert pool.stats()['in_use'] == 0
@@ -0,0 +1,62 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+import csv
+import io
+import json
+
+import pytest
+
+from backend import export
+from backend.models import init_db, log_request, set_job_name, jobs_db
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', path)
+    init_db(path)
+    for n in range(7):
+        log_request(f'job-{n % 2}', f'{n}.png', 'ip', 'p', f'out "{n}",\nline', json_text='{"a": 1}')
+    set_job_name('job-1', 'Vessel X')
+    with jobs_db() as conn:
+        conn.execute("UPDATE requests SET timestamp = '2025-03-0' || id || 'T12:00:00'")
+    return path
+
+
+def _ndjson(**filters):
+    data = b''.join(export.export_chunks('ndjson', batch_size=3, **filters))
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+def test_ndjson_streams_in_batches_and_resumes(db):
+    chunks = list(export.export_chunks('ndjson', batch_size=3))
+    assert len(chunks) == 3
+    rows = _ndjson()
+    assert [r['id'] for r in rows] == list(range(1, 8))
+    assert rows[1]['job_name'] == 'Vessel X' and rows[1]['output'] == 'out "1",\nline'
+    assert [r['id'] for r in _ndjson(after=rows[3]['id'])] == [5, 6, 7]
+    assert [r['id'] for r in _ndjson(job_ids=['job-1'])] == [2, 4, 6]
+    assert [r['id'] for r in _ndjson(start='2025-03-03', end='2025-03-05')] == [3, 4, 5]
+    assert [r['id'] for r in _ndjson(end='2025-03-02T12:00', limit=1)] == [1]
+
+
+def test_csv_round_trips_and_cli_writes_a_file(db, tmp_path):
+    text = b''.join(export.export_chunks('csv', job_ids=['job-0'])).decode()
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [r['filename'] for r in rows] == ['0.png', '2.png', '4.png', '6.png']
+    assert rows[0]['output'] == 'out "0",\nline'
+    assert b''.join(export.export_chunks('csv', job_ids=['none'])).decode().strip() == ','.join(export.COLUMNS)
+
+    out = tmp_path / 'rows.ndjson'
+    export.main(['--format', 'ndjson', '--db', db, '--after', '5', '-o', str(out)])
+    assert [json.loads(line)['id'] for line in out.read_text().splitlines()] == [6, 7]
+
+
+def test_unknown_format_is_rejected(db):
+    with pytest.raises(ValueError):
+        export.export_chunks('xml')
+    if export.pq is None:
+        with pytest.raises(ValueError):
+            export.export_chunks('parquet')
@@ -0,0 +1,134 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+import json
+
+import pytest
+
+from backend.manage import main
+from backend.models import (
+    init_db, log_request, update_request, set_request_output, save_edits,
+    delete_job, get_request, aggregate_facts, jobs_db,
+)
+
+REPORT = {
+    'tankConditions': {
+        'arrival': [
+            {'tank': '1P', 'productName': 'IFO 380', 'api': 12.1, 'netBbls': 1000},
+            {'tank': '2S', 'productName': 'MGO', 'api': '33.0', 'netBbls': '2,000.5'},
+        ],
+        'departure': [{'tank': '1P', 'productName': 'IFO 380', 'netBbls': 0}],
+    },
+    'productsDischarged': [
+        {'productName': 'IFO 380', 'netBbls': 1000, 'metricTons': 150.5},
+        {'productName': 'MGO', 'netBbls': 2000.5, 'metricTons': 'n/a'},
+    ],
+    'eventTimeline': [
+        {'event': 'All Fast', 'date': '2025-03-02', 'time': '10:00'},
+        {'event': 'Arrived', 'date': '2025-03-01', 'time': '08:00'},
+    ],
+    'draftReadings': [
+        {'event': 'Arrival', 'fwd': {'port': 10.5, 'stbd': 10.4}, 'aft': {'port': 12, 'stbd': 12.1}},
+    ],
+}
+BDR = {
+    'vessel_name': 'Xenia', 'imo_number': '9123456', 'delivery_port': 'Tacoma',
+    'products': [
+        {'product_description': 'VLSFO', 'weight_mt': 500, 'viscosity': {'value': 380.0}},
+    ],
+}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', path)
+    init_db(path)
+    return path
+
+
+def _count(table):
+    with jobs_db() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_writes_project_json_into_fact_tables(db):
+    req = log_request('job', 'a.png', 'ip', 'p', 'o', json_text=json.dumps(REPORT))
+    assert aggregate_facts('products', ['month', 'product'], ['sum:net_bbls', 'sum:metric_tons']) == [
+        {'month': '2025-03', 'product': 'IFO 380', 'sum_net_bbls': 1000.0, 'sum_metric_tons': 150.5},
+        {'month': '2025-03', 'product': 'MGO', 'sum_net_bbls': 2000.5, 'sum_metric_tons': None},
+    ]
+    assert aggregate_facts('tanks', ['phase'], ['count', 'max:api']) == [
+        {'phase': 'arrival', 'count': 2, 'max_api': 33.0},
+        {'phase': 'departure', 'count': 1, 'max_api': None},
+    ]
+    # The earliest event date is the report's day
+    assert aggregate_facts('events', ['day'], []) == [{'day': '2025-03-01', 'count': 2}]
+    assert aggregate_facts('drafts', ['position'], ['avg:port']) == [
+        {'position': 'aft', 'avg_port': 12.0}, {'position': 'fwd', 'avg_port': 10.5},
+    ]
+
+    update_request('job', req, bdr_json=json.dumps(BDR))
+    assert aggregate_facts('bdr_products', ['vessel', 'port'], ['sum:weight_mt', 'max:viscosity']) == [
+        {'vessel': 'Xenia', 'port': 'Tacoma', 'sum_weight_mt': 500.0, 'max_viscosity': 380.0},
+    ]
+
+    save_edits('job', [(req, get_request('job', req)['version'], {'json': 'not json'})])
+    assert _count('fact_tanks') == 0 and _count('fact_bdr_products') == 1
+    set_request_output('job', req, 'p', 'o', json_text=json.dumps(REPORT))
+    assert _count('fact_tanks') == 3
+    delete_job('job')
+    assert _count('fact_tanks') == _count('fact_bdr_products') == 0
+
+
+def test_aggregate_filters_and_rejects_unknown_columns(db):
+    for job_id, day in (('a', '2025-01-05'), ('b', '2025-02-05')):
+        report = dict(REPORT, eventTimeline=[{'event': 'Arrived', 'date': day, 'time': ''}])
+        log_request(job_id, 'x.png', 'ip', 'p', 'o', json_text=json.dumps(report))
+    rows = aggregate_facts('products', ['job_id'], ['sum:net_bbls'], start='2025-02-01')
+    assert rows == [{'job_id': 'b', 'sum_net_bbls': 3000.5}]
+    assert aggregate_facts('products', [], ['count'], job_id='a') == [{'count': 2}]
+    for args in (('nope', [], []), ('tanks', ['ip'], []), ('tanks', [], ['sum:tank']),
+                 ('tanks', [], ['median:api'])):
+        with pytest.raises(ValueError):
+            aggregate_facts(*args)
+
+
+def test_rollups_match_the_fact_rows(db):
+    reqs = [
+        log_request(f'job-{n}', 'x.png', 'ip', 'p', 'o', json_text=json.dumps(REPORT))
+        for n in range(3)
+    ]
+    delete_job('job-0')
+    update_request('job-1', reqs[1], json=json.dumps(dict(REPORT, productsDischarged=[])))
+    args = ('products', ['product', 'month'], ['sum:net_bbls', 'avg:net_bbls', 'count'])
+    from_rollup = aggregate_facts(*args)
+    # min cannot be read from a rollup, so this query scans the fact rows
+    from_rows = aggregate_facts(args[0], args[1], args[2] + ['min:api'])
+    assert from_rollup == [{k: v for k, v in r.items() if k != 'min_api'} for r in from_rows]
+    assert [r['count'] for r in from_rollup] == [1, 1]
+    delete_job('job-2')
+    assert _count('fact_products_daily') == 0
+
+
+def test_count_of_a_column_skips_missing_values_on_both_paths(db):
+    report = dict(REPORT, productsDischarged=[
+        {'productName': 'MGO', 'netBbls': 10}, {'productName': 'MGO', 'netBbls': None},
+    ])
+    log_request('job', 'a.png', 'ip', 'p', 'o', json_text=json.dumps(report))
+    measures = ['count', 'count:net_bbls']
+    from_rollup = aggregate_facts('products', ['product'], measures)
+    # Grouping by job_id is not in the rollup, so the fact rows are read
+    from_rows = aggregate_facts('products', ['product', 'job_id'], measures)
+    assert from_rollup == [{'product': 'MGO', 'count': 2, 'count_net_bbls': 1}]
+    assert from_rollup == [{k: v for k, v in r.items() if k != 'job_id'} for r in from_rows]
+
+
+def test_rebuild_facts_command(db, capsys):
+    log_request('job', 'a.png', 'ip', 'p', 'o', json_text=json.dumps(REPORT))
+    with jobs_db() as conn:
+        conn.execute("DELETE FROM fact_tanks")
+    main(['rebuild-facts', '--db', db])
+    assert '1 row(s) projected' in capsys.readouterr().out
+    assert _count('fact_tanks') == 3
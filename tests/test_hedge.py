@@ -0,0 +1,168 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+import socket
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+import pytest
+from PIL import Image
+
+from backend.hedge import LatencyTracker, hedge_delay
+from backend.ratelimit import AdaptiveLimiter
+from backend.variants import VariantStore
+
+
+@pytest.fixture(autouse=True)
+def variants(tmp_path, monkeypatch):
+    """Keep image variants rendered by these tests out of the source tree."""
+    monkeypatch.setattr('backend.variants.variant_store', VariantStore(str(tmp_path / 'variants')))
+
+
+class FakeStream:
+    def __init__(self, parts, delay):
+        self.parts = parts
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for part in self.parts:
+            time.sleep(self.delay)
+            yield MagicMock(choices=[MagicMock(delta=MagicMock(content=part))])
+
+    def close(self):
+        self.closed = True
+
+
+def test_latency_percentiles():
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile('m', 95) is None
+    for i in range(1, 101):
+        tracker.record('m', i / 100)
+    assert tracker.percentile('m', 50) == 0.5
+    assert tracker.percentile('m', 95) == 0.95
+    assert tracker.percentile('m', 95, min_samples=101) is None
+    tracker.record('m', 5.0)
+    # Oldest sample dropped from the window
+    assert tracker.percentile('m', 100) == 5.0
+    assert tracker.stats()['m']['samples'] == 100
+
+
+def test_slow_call_is_hedged_to_fallback_model(tmp_path):
+    from backend.utils import call_openai
+
+    img = tmp_path / 'img.png'
+    Image.new('RGB', (10, 10), 'red').save(img)
+    streams = {}
+
+    def create(**params):
+        assert params['stream'] is True
+        if params['model'] == 'fast-model' and 'fast-model' not in streams:
+            streams['fast-model'] = None
+            raise openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com'))
+        delay = 0.3 if params['model'] == 'slow-model' else 0.01
+        streams[params['model']] = FakeStream(['| ', params['model'], ' |'], delay)
+        return streams[params['model']]
+
+    chat_mock = MagicMock()
+    chat_mock.completions.create.side_effect = create
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record('slow-model', 0.05)
+    metrics = {}
+    with patch('backend.utils.openai.chat', chat_mock), patch(
+        'backend.hedge.HEDGE_ENABLED', True
+    ), patch('backend.hedge.HEDGE_MODEL', 'fast-model'), patch(
+        'backend.hedge.HEDGE_MIN_DELAY', 0
+    ), patch('backend.hedge.latencies', tracker), patch(
+        'backend.utils.backoff_delay', return_value=0
+    ):
+        start = time.monotonic()
+        text = call_openai(str(img), 'p', img.name, 'slow-model', metrics=metrics)
+        elapsed = time.monotonic() - start
+        deadline = time.monotonic() + 2
+        while tracker.stats()['slow-model']['samples'] < 21 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert text == '| fast-model |'
+    assert elapsed < 0.6
+    assert metrics['hedged'] is True
+    assert metrics['winner'] == 'hedge'
+    assert metrics['model_used'] == 'fast-model'
+    # The winning attempt's call metrics are kept
+    assert metrics['retries'] == 1
+    # The losing stream was closed instead of being read to the end
+    assert streams['slow-model'].closed
+    # and its run time counts as a lower bound of the slow model's latency
+    assert tracker.percentile('slow-model', 100) >= 0.3
+
+
+def test_fast_call_is_not_hedged(tmp_path):
+    from backend.utils import call_openai
+
+    img = tmp_path / 'img.png'
+    Image.new('RGB', (10, 10), 'red').save(img)
+    chat_mock = MagicMock()
+    chat_mock.completions.create.side_effect = lambda **p: FakeStream(['ok'], 0)
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record('m', 1.0)
+    metrics = {}
+    with patch('backend.utils.openai.chat', chat_mock), patch(
+        'backend.hedge.HEDGE_ENABLED', True
+    ), patch('backend.hedge.latencies', tracker):
+        assert call_openai(str(img), 'p', img.name, 'm', metrics=metrics) == 'ok'
+    assert chat_mock.completions.create.call_count == 1
+    assert metrics['hedged'] is False
+
+
+def test_hedging_stops_when_the_budget_is_spent():
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record('m', 1.0)
+    with patch('backend.hedge.latencies', tracker), patch('backend.hedge.HEDGE_BUDGET', 0.25):
+        assert hedge_delay('m') == 2
+        for hedged in (False, False, False, True):
+            tracker.record_call('m', hedged)
+        assert hedge_delay('m') is None
+    assert tracker.stats()['m']['hedged'] == 0.25
+
+
+def test_cancel_scope_aborts_a_call_waiting_for_headers(monkeypatch):
+    import openai
+    from backend.utils import CancelScope, chat_completion
+
+    # Accepts connections and reads requests, but never answers them
+    server = socket.create_server(('127.0.0.1', 0))
+    conns = []
+    threading.Thread(target=lambda: conns.append(server.accept()), daemon=True).start()
+    monkeypatch.setattr(openai, 'api_key', 'test')
+    monkeypatch.setattr(openai, 'base_url', f'http://127.0.0.1:{server.getsockname()[1]}/v1')
+    limiter = AdaptiveLimiter()
+    monkeypatch.setattr('backend.utils.limiter', limiter)
+    scope = CancelScope()
+    errors = []
+
+    def call():
+        with scope:
+            try:
+                chat_completion({'model': 'm', 'messages': []})
+            except RuntimeError as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 2
+    while not conns and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    started = time.monotonic()
+    scope.cancel()
+    thread.join(5)
+    assert not thread.is_alive() and time.monotonic() - started < 1
+    assert errors and len(conns) == 1
+    assert limiter.stats()['in_flight'] == 0
+    server.close()
@@ -0,0 +1,56 @@
+import sys, pathlib, os
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+os.environ.setdefault('RESULT_CACHE', 'off')
+import io
+import json
+import zipfile
+
+import pytest
+
+from backend.archive import archive_chunks
+from backend.blobs import store
+from backend.models import init_db, log_request, add_attachment, update_request, set_job_name
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    db = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', db)
+    monkeypatch.setattr('backend.blobs.UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr('backend.blobs.BLOB_FOLDER', str(tmp_path / 'blobs'))
+    init_db(db)
+    return tmp_path
+
+
+def test_archive_streams_images_results_and_manifest(uploads):
+    image = os.urandom(50_000)
+    store('a.png', io.BytesIO(image))
+    req = log_request('job', 'a.png', 'ip', 'p', '| tank |', json_text='{"a": 1}')
+    update_request('job', req, bdr_json='{"b": 2}')
+    # A legacy upload preprocessed in place is archived from its original
+    (uploads / 'old.png').write_bytes(b'processed')
+    (uploads / 'old.png.orig').write_bytes(b'original')
+    log_request('job', 'old.png', 'ip', 'p', 'o')
+    log_request('job', 'gone.png', 'ip', 'p', '')
+    store('att.pdf', io.BytesIO(b'%PDF'))
+    add_attachment('job', 'att.pdf')
+    set_job_name('job', 'Vessel X')
+
+    chunks = list(archive_chunks('job', chunk_size=8192))
+    assert max(map(len, chunks)) < 20_000
+    zf = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert zf.testzip() is None
+    assert zf.read(f'requests/{req}/a.png') == image
+    assert zf.read(f'requests/{req}/output.md') == b'| tank |'
+    assert json.loads(zf.read(f'requests/{req}/bdr.json')) == {'b': 2}
+    assert zf.read(f'requests/{req + 1}/old.png') == b'original'
+    assert zf.read('attachments/att.pdf') == b'%PDF'
+
+    manifest = json.loads(zf.read('manifest.json'))
+    assert manifest['name'] == 'Vessel X'
+    first, _, missing = manifest['requests']
+    assert first['image']['size'] == len(image) and first['image']['sha256']
+    assert first['results'] == [f'requests/{req}/{n}' for n in ('output.md', 'result.json', 'bdr.json')]
+    assert missing['image']['path'] is None and missing['results'] == []
+    assert zf.namelist()[0] == 'manifest.json'
+    assert not any('gone.png' in n for n in zf.namelist())
@@ -0,0 +1,125 @@
+import sys, pathlib, threading, time
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from unittest.mock import patch
+import fakeredis
+import pytest
+
+from backend.jobqueue import RedisWorkQueue
+
+
+@pytest.fixture
+def queue():
+    return RedisWorkQueue(fakeredis.FakeRedis(), name='test', visibility_timeout=30, max_attempts=2)
+
+
+def test_enqueue_reserve_ack(queue):
+    queue.enqueue({'n': 1})
+    task = queue.reserve(timeout=1)
+    assert task.payload == {'n': 1}
+    assert task.attempts == 1
+    assert queue.stats() == {'pending': 0, 'processing': 1, 'dead': 0}
+    queue.ack(task)
+    assert queue.stats() == {'pending': 0, 'processing': 0, 'dead': 0}
+    assert queue.reserve(timeout=1) is None
+
+
+def test_expired_lease_is_retried_then_dead_lettered(queue):
+    queue.enqueue({'n': 1})
+    task = queue.reserve(timeout=1)
+    # Worker "crashes": no ack before the lease runs out.
+    assert queue.requeue_expired(now=time.time() + 10) == 0
+    assert queue.requeue_expired(now=time.time() + 31) == 1
+    retry = queue.reserve(timeout=1)
+    assert retry.id == task.id
+    assert retry.attempts == 2
+    dead = []
+    assert queue.requeue_expired(now=time.time() + 31, on_dead=dead.append) == 1
+    assert queue.stats() == {'pending': 0, 'processing': 0, 'dead': 1}
+    assert [(t.id, t.payload, t.attempts) for t in dead] == [(task.id, {'n': 1}, 2)]
+
+
+def test_nack_reports_dead_letter(queue):
+    queue.enqueue({'n': 1})
+    assert queue.nack(queue.reserve(timeout=1)) is False
+    assert queue.nack(queue.reserve(timeout=1)) is True
+    assert queue.stats() == {'pending': 0, 'processing': 0, 'dead': 1}
+
+
+def test_orphaned_reservation_gets_lease(queue):
+    queue.enqueue({'n': 1})
+    # Simulate a crash between moving the id and taking the lease.
+    queue.redis.lmove(queue.pending_key, queue.processing_key, 'RIGHT', 'LEFT')
+    assert queue.requeue_expired() == 0
+    assert queue.requeue_expired(now=time.time() + 31) == 1
+    assert queue.reserve(timeout=1).payload == {'n': 1}
+
+
+def test_consumer_processes_dispatched_task(tmp_path, queue):
+    from backend import worker
+    from backend.models import init_db, log_request, get_request_statuses
+
+    job_id = 'queued-job'
+    with patch('backend.blobs.UPLOAD_FOLDER', str(tmp_path)), patch(
+        'backend.models.DB_PATH', str(tmp_path / 'jobs.sqlite')
+    ), patch(
+        'backend.worker.get_queue', return_value=queue
+    ), patch(
+        'backend.worker.call_openai', return_value='| a |'
+    ) as call:
+        db_path = str(tmp_path / 'jobs.sqlite')
+        init_db(db_path)
+        req_id = log_request(job_id, 'img.png', 'ip', 'p', '', status='pending', db_path=db_path)
+        worker.dispatch([{'job_id': job_id, 'req_id': req_id, 'filename': 'img.png', 'model': 'm'}])
+
+        stop = threading.Event()
+        t = threading.Thread(target=worker.consume, args=(queue, stop, 1))
+        t.start()
+        deadline = time.time() + 5
+        while get_request_statuses(job_id, db_path)[0]['status'] != 'done' and time.time() < deadline:
+            time.sleep(0.05)
+        stop.set()
+        t.join()
+
+    row = get_request_statuses(job_id, db_path)[0]
+    assert row['status'] == 'done'
+    assert row['output'] == '| a |'
+    assert call.call_args.args[0] == str(tmp_path / 'img.png')
+    assert queue.stats() == {'pending': 0, 'processing': 0, 'dead': 0}
+
+
+def test_failing_task_is_dead_lettered_and_row_failed(tmp_path, queue):
+    from redis.exceptions import ConnectionError as RedisConnectionError
+    from backend import worker
+    from backend.models import init_db, log_request, get_request_statuses
+
+    db_path = str(tmp_path / 'jobs.sqlite')
+    reserve = queue.reserve
+    outages = [RedisConnectionError('down')]
+
+    def flaky_reserve(timeout=5):
+        if outages:
+            raise outages.pop()
+        return reserve(timeout)
+
+    with patch('backend.blobs.UPLOAD_FOLDER', str(tmp_path)), patch(
+        'backend.models.DB_PATH', db_path
+    ), patch('backend.worker.get_queue', return_value=queue), patch(
+        'backend.worker.process_job_request', side_effect=RuntimeError('crashed')
+    ), patch.object(queue, 'reserve', flaky_reserve):
+        init_db(db_path)
+        req_id = log_request('dead-job', 'img.png', 'ip', 'p', '', status='running', db_path=db_path)
+        queue.enqueue({'job_id': 'dead-job', 'req_id': req_id, 'filename': 'img.png', 'model': 'm'})
+
+        stop = threading.Event()
+        t = threading.Thread(target=worker.consume, args=(queue, stop, 1))
+        t.start()
+        deadline = time.time() + 5
+        while queue.stats()['dead'] == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        stop.set()
+        t.join()
+
+    # The consumer survived the Redis outage and the row settled
+    row = get_request_statuses('dead-job', db_path)[0]
+    assert row['status'] == 'error'
+    assert 'after 2 attempt(s): crashed' in row['output']
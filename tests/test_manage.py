@@ -0,0 +1,100 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+import sqlite3
+
+import pytest
+
+from backend.manage import main
+from backend.migrations import migrate, SCHEMA_VERSION
+from backend.models import get_requests, get_job_name, get_attachments
+
+
+def _legacy_job(path):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """CREATE TABLE requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT, timestamp TEXT, ip TEXT, prompt TEXT, output TEXT,
+            json TEXT, status TEXT
+        )"""
+    )
+    conn.executemany(
+        "INSERT INTO requests (filename, timestamp, ip, prompt, output, json, status) VALUES (?,?,?,?,?,?,?)",
+        [('a.png', '2025-01-01T10:00', 'ip', 'p', 'o1', '{}', None),
+         ('b.png', '2025-01-01T10:01', 'ip', 'p', 'o2', '', 'error')],
+    )
+    conn.execute("CREATE TABLE jobmeta (name TEXT)")
+    conn.execute("INSERT INTO jobmeta (name) VALUES ('Vessel X')")
+    conn.execute("CREATE TABLE job_attachments (id INTEGER PRIMARY KEY, filename TEXT, timestamp TEXT)")
+    conn.execute("INSERT INTO job_attachments (filename, timestamp) VALUES ('bdr.png', 't')")
+    conn.commit()
+    conn.close()
+
+
+def test_import_jobs_copies_legacy_files(tmp_path, monkeypatch, capsys):
+    db = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', db)
+    _legacy_job(tmp_path / 'job-1.db')
+    _legacy_job(tmp_path / 'job-2.db')
+
+    main(['import-jobs', '--folder', str(tmp_path), '--db', db])
+    assert '2 job(s) imported, 0 skipped' in capsys.readouterr().out
+    rows = get_requests('job-1')
+    assert [(r['filename'], r['output'], r['status']) for r in rows] == [
+        ('a.png', 'o1', 'done'), ('b.png', 'o2', 'error')
+    ]
+    assert rows[0]['bdr_md'] is None
+    assert get_job_name('job-1') == 'Vessel X'
+    assert [a['filename'] for a in get_attachments('job-2')] == ['bdr.png']
+    # Request ids are unique across jobs now
+    assert get_requests('job-2')[0]['id'] == 3
+
+    main(['migrate-all', '--folder', str(tmp_path), '--db', db, '--remove'])
+    assert '0 job(s) imported, 2 skipped' in capsys.readouterr().out
+    assert not list(tmp_path.glob('*.db'))
+    assert len(get_requests('job-1')) == 2
+
+
+def test_migrate_is_versioned(tmp_path):
+    db = tmp_path / 'jobs.sqlite'
+    # A database from before versioning: base tables only, user_version 0
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, name TEXT NOT NULL DEFAULT '', created TEXT)")
+    conn.execute("CREATE TABLE requests (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, filename TEXT, timestamp TEXT, ip TEXT, prompt TEXT, output TEXT, json TEXT, bdr_json TEXT, bdr_md TEXT, status TEXT, metrics TEXT)")
+    conn.execute("INSERT INTO jobs (job_id) VALUES ('j')")
+    conn.execute("INSERT INTO requests (job_id, filename) VALUES ('j', 'a.png')")
+    conn.commit()
+    conn.close()
+
+    assert migrate(str(db)) == SCHEMA_VERSION
+    assert migrate(str(db)) == 0
+    with sqlite3.connect(db) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("SELECT last_filename, row_count FROM jobs").fetchone() == ('a.png', 1)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION + 1}')
+    with pytest.raises(RuntimeError):
+        migrate(str(db))
+
+
+def test_fact_tables_are_filled_by_rebuild_not_migration(tmp_path, capsys):
+    db = tmp_path / 'jobs.sqlite'
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, name TEXT NOT NULL DEFAULT '', created TEXT)")
+    conn.execute("CREATE TABLE requests (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, filename TEXT, timestamp TEXT, ip TEXT, prompt TEXT, output TEXT, json TEXT, bdr_json TEXT, bdr_md TEXT, status TEXT, metrics TEXT)")
+    conn.execute("INSERT INTO jobs (job_id) VALUES ('j')")
+    conn.execute(
+        "INSERT INTO requests (job_id, filename, json) VALUES ('j', 'a.png', ?)",
+        ('{"productsDischarged": [{"productName": "MGO", "netBbls": 10}]}',),
+    )
+    conn.commit()
+    conn.close()
+
+    migrate(str(db))
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM fact_products").fetchone()[0] == 0
+    main(['rebuild-facts', '--db', str(db)])
+    assert '1 row(s) projected' in capsys.readouterr().out
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT product, net_bbls FROM fact_products").fetchall() == [('MGO', 10.0)]
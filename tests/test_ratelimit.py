@@ -0,0 +1,232 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import openai
+import pytest
+
+from backend.ratelimit import AdaptiveLimiter, parse_duration, retry_after, backoff_delay
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4.1-mini",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "ok"},
+            "finish_reason": "stop",
+        }
+    ],
+    "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+}
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    """Chat completions endpoint that answers 429 for the first ``fail`` calls
+    and tracks the highest number of concurrent requests it saw."""
+
+    def __init__(self, fail=0, headers=None, delay=0.0):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.fail = fail
+        self.fail_headers = headers or {'retry-after-ms': '20'}
+        self.delay = delay
+        self.requests = 0
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            limited = server.requests <= server.fail
+        time.sleep(server.delay)
+        if limited:
+            body = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            status, headers = 429, server.fail_headers
+        else:
+            body, status, headers = COMPLETION, 200, {}
+        data = json.dumps(body).encode()
+        with server.lock:
+            server.active -= 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    monkeypatch.setattr('backend.ratelimit.OPENAI_BACKOFF_BASE', 0.01)
+    servers = []
+
+    def start(**kwargs):
+        server = FakeOpenAI(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        client = openai.OpenAI(api_key='test', base_url=server.base_url, max_retries=0)
+        return server, client
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_parse_rate_limit_headers():
+    assert parse_duration('6m0s') == 360
+    assert parse_duration('20ms') == pytest.approx(0.02)
+    assert parse_duration('1.5s') == 1.5
+    assert parse_duration('soon') is None
+    assert retry_after({'retry-after-ms': '250'}) == 0.25
+    assert retry_after({'retry-after': '3'}) == 3
+    assert retry_after(
+        {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s',
+         'x-ratelimit-remaining-tokens': '10', 'x-ratelimit-reset-tokens': '9s'}
+    ) == 2
+    assert retry_after({}) is None
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(3, base=1, cap=5) for _ in range(50)]
+    assert all(0 <= d <= 5 for d in delays)
+    assert len(set(delays)) > 1
+    assert backoff_delay(0, hint=2, base=0.1) == 2
+
+
+def test_limiter_aimd():
+    limiter = AdaptiveLimiter(max_concurrency=8, min_concurrency=1)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.stats()['limit'] == 4
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.stats()['limit'] > 4
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.stats()['limit'] == 1
+
+
+def test_limiter_pauses_for_retry_after():
+    limiter = AdaptiveLimiter(max_concurrency=4)
+    limiter.acquire()
+    limiter.release(throttled=True, retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+    limiter.release()
+
+
+def test_limiter_token_bucket():
+    limiter = AdaptiveLimiter(max_concurrency=4, rpm=600)
+    start = time.monotonic()
+    for _ in range(12):
+        limiter.acquire()
+        limiter.release()
+    # 10 tokens burst, then 10 per second
+    assert time.monotonic() - start >= 0.15
+
+
+def test_chat_completion_retries_429_from_server(fake_openai):
+    from backend.utils import chat_completion
+
+    server, client = fake_openai(fail=2)
+    limiter = AdaptiveLimiter(max_concurrency=8)
+    metrics = {}
+    with patch('backend.utils.openai.chat', client.chat), patch(
+        'backend.utils.limiter', limiter
+    ):
+        response = chat_completion(
+            {'model': 'gpt-4.1-mini', 'messages': [{'role': 'user', 'content': 'hi'}]},
+            metrics,
+        )
+    assert response.choices[0].message.content == 'ok'
+    assert server.requests == 3
+    assert metrics['retries'] == 2
+    assert limiter.stats()['throttled'] == 2
+    assert limiter.stats()['limit'] < 8
+
+
+def test_chat_completion_gives_up_after_max_retries(fake_openai):
+    from backend.utils import chat_completion
+
+    server, client = fake_openai(fail=100)
+    with patch('backend.utils.openai.chat', client.chat), patch(
+        'backend.utils.limiter', AdaptiveLimiter()
+    ), patch('backend.utils.OPENAI_MAX_RETRIES', 2):
+        with pytest.raises(RuntimeError):
+            chat_completion({'model': 'm', 'messages': []})
+    assert server.requests == 3
+
+
+def test_streamed_call_holds_its_slot_until_closed():
+    from backend.utils import chat_completion
+
+    class FakeStream(list):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    limiter = AdaptiveLimiter(max_concurrency=8)
+    with patch('backend.utils._create_completion', lambda params: FakeStream(['a', 'b'])), patch(
+        'backend.utils.limiter', limiter
+    ):
+        stream = chat_completion({'model': 'm', 'messages': [], 'stream': True})
+        assert limiter.stats()['in_flight'] == 1
+        assert list(stream) == ['a', 'b']
+        assert limiter.stats()['in_flight'] == 0
+
+        stream = chat_completion({'model': 'm', 'messages': [], 'stream': True})
+        stream.close()
+        stream.close()
+        assert stream.closed and limiter.stats()['in_flight'] == 0
+
+
+def test_concurrency_adapts_to_server_limit(fake_openai):
+    from backend.utils import chat_completion
+
+    server, client = fake_openai(fail=4, delay=0.05)
+    limiter = AdaptiveLimiter(max_concurrency=8)
+    with patch('backend.utils.openai.chat', client.chat), patch(
+        'backend.utils.limiter', limiter
+    ):
+        threads = [
+            threading.Thread(
+                target=chat_completion, args=({'model': 'm', 'messages': []},)
+            )
+            for _ in range(16)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert server.requests == 20
+    assert server.peak <= 8
+    assert limiter.stats()['in_flight'] == 0
+    assert limiter.stats()['limit'] < 8
@@ -0,0 +1,66 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
+
+import pytest
+
+from backend.manage import main
+from backend.models import (
+    init_db, log_request, update_request, set_job_name, delete_job, jobs_db,
+    search_requests, MATCH_START, MATCH_END,
+)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr('backend.models.DB_PATH', path)
+    init_db(path)
+    return path
+
+
+def _ids(text, **kwargs):
+    return [r['id'] for r in search_requests(text, **kwargs)[0]]
+
+
+def test_index_follows_every_write(db):
+    a = log_request('job-a', 'a.png', 'ip', 'p', '| IFO 380 | Tacoma |')
+    b = log_request('job-b', 'b.png', 'ip', 'p', '| MGO | Seattle |', bdr_md_text='IFO 380 delivered')
+    assert sorted(_ids('ifo 380')) == [a, b]
+    assert _ids('IFO Tacoma') == [a]
+    assert _ids('"380 at"') == []
+
+    set_job_name('job-b', 'Vessel Xenia')
+    assert _ids('xen*') == [b]
+    # Name matches outrank body matches
+    set_job_name('job-a', 'Tacoma run')
+    assert _ids('tacoma')[0] == a
+
+    update_request('job-a', a, output='| HSFO |')
+    assert _ids('ifo') == [b]
+    assert _ids('hsfo') == [a]
+    delete_job('job-b')
+    assert _ids('ifo') == []
+
+
+def test_results_are_paged_and_highlighted(db):
+    ids = [log_request('job', f'{n}.png', 'ip', 'p', f'Tacoma row {n}') for n in range(5)]
+    first, more = search_requests('tacoma', limit=3)
+    rest, last = search_requests('tacoma', limit=3, offset=3)
+    assert more and not last
+    assert sorted(r['id'] for r in first + rest) == ids
+    assert f'{MATCH_START}Tacoma{MATCH_END}' in first[0]['snippet']
+    # Stray FTS syntax is searched for literally instead of raising
+    assert search_requests('tacoma AND (" -:') == ([], False)
+    assert search_requests('') == ([], False)
+
+
+def test_rebuild_search_command(db, capsys):
+    log_request('job', 'a.png', 'ip', 'p', 'Tacoma')
+    with jobs_db() as conn:
+        conn.execute("DELETE FROM search_index")
+    assert _ids('tacoma') == []
+    main(['rebuild-search', '--db', db])
+    assert '1 row(s) indexed' in capsys.readouterr().out
+    assert len(_ids('tacoma')) == 1
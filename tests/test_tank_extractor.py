@@ -0,0 +1,81 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import pytest
+from backend.tank_extractor import markdown_to_tank_report
+
+SAMPLE = """**Arrival Tank Values**
+
+| Tank | Product Name | API | Ullage (Ft) | Ullage (in) | Temp (°F) | Water (Bbls) | Gross Bbls | Net Bbls | Metric Tons |
+| ---- | ------------ | --- | ----------- | ----------- | --------- | ------------ | ---------- | -------- | ----------- |
+| 1P | IFO 380 | 12.1 | 3 | 4.5 | 120 | 0 | 5,888.17 | 5,781.07 | 903.81 |
+| 1S | IFO 380 | 12.1 | 3 | 6 |  | 0 | 5,800 | 5,700 | 890.2 |
+
+**Departure Tank Values**
+
+| Tank | Product Name | API | Ullage (Ft) | Ullage (in) | Temp (°F) | Water (Bbls) | Gross Bbls | Net Bbls | Metric Tons |
+| ---- | ------------ | --- | ----------- | ----------- | --------- | ------------ | ---------- | -------- | ----------- |
+| 1P | IFO 380 | 12.1 | 30 | 0 | 110 | 0 | 10 | 9.8 | 1.5 |
+
+| Product Discharged | API | Gross Bbls | Net Bbls | Metric Tons |
+| ------------------ | --- | ---------- | -------- | ----------- |
+| IFO 380 | 12.1 | 11,678.17 | 11,471.27 | 1,792.51 |
+
+| Event | Date | Time |
+| ----- | ---- | ---- |
+| Hoses Connected | 06/18/2025 | 1430 |
+| Hoses Disconnected | 2025-06-19 | 2:05 PM |
+
+| Arrival/Departure | Fwd/Aft | Port | Stbd. |
+| ----------------- | ------- | ---- | ----- |
+| Arrival | Fwd | 10.5 | 10.6 |
+|  | Aft | 12.0 | 12.1 |
+| Departure | Fwd | 9.5 | 9.4 |
+| Departure | Aft | 11 | 11.2 |
+"""
+
+
+def test_markdown_to_tank_report():
+    report = markdown_to_tank_report(SAMPLE)
+    arrival = report["tankConditions"]["arrival"]
+    assert len(arrival) == 2
+    assert arrival[0] == {
+        "tank": "1P",
+        "productName": "IFO 380",
+        "api": 12.1,
+        "ullageFt": 3,
+        "ullageIn": 4.5,
+        "tempF": 120,
+        "waterBbls": 0,
+        "grossBbls": 5888.17,
+        "netBbls": 5781.07,
+        "metricTons": 903.81,
+    }
+    assert arrival[1]["tempF"] is None
+    assert report["tankConditions"]["departure"][0]["netBbls"] == 9.8
+    assert report["productsDischarged"][0]["metricTons"] == 1792.51
+    assert report["eventTimeline"] == [
+        {"event": "Hoses Connected", "date": "2025-06-18", "time": "14:30"},
+        {"event": "Hoses Disconnected", "date": "2025-06-19", "time": "14:05"},
+    ]
+    assert report["draftReadings"] == [
+        {"event": "Arrival", "fwd": {"port": 10.5, "stbd": 10.6}, "aft": {"port": 12.0, "stbd": 12.1}},
+        {"event": "Departure", "fwd": {"port": 9.5, "stbd": 9.4}, "aft": {"port": 11, "stbd": 11.2}},
+    ]
+
+
+def test_markdown_to_tank_report_rejects_unexpected_input():
+    with pytest.raises(ValueError):
+        markdown_to_tank_report("| A | B |\n| - | - |\n| 1 | 2 |")
+    with pytest.raises(ValueError):
+        markdown_to_tank_report(SAMPLE.replace("5,888.17", "approx 5888"))
+    with pytest.raises(ValueError):
+        markdown_to_tank_report(SAMPLE.replace("1430", "afternoon"))
+
+
+def test_tank_report_to_markdown_round_trips():
+    from backend.tank_extractor import tank_report_to_markdown
+
+    report = markdown_to_tank_report(SAMPLE)
+    md = tank_report_to_markdown(report)
+    assert "| Tank | Product Name | API |" in md
+    assert markdown_to_tank_report(md) == report
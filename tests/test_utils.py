@@ -1,5 +1,7 @@
 import sys, pathlib, json
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import os
+os.environ.setdefault('RESULT_CACHE', 'off')
 from unittest.mock import patch, MagicMock, ANY
 from backend.utils import (
     call_openai,
@@ -14,6 +16,14 @@ import os
 import math
 import pytest
 
+from backend.variants import VariantStore
+
+
+@pytest.fixture(autouse=True)
+def variants(tmp_path, monkeypatch):
+    """Keep image variants rendered by these tests out of the source tree."""
+    monkeypatch.setattr('backend.variants.variant_store', VariantStore(str(tmp_path / 'variants')))
+
 
 def test_call_openai_json_valid_json():
     os.environ['OPENAI_API_KEY'] = 'test'
@@ -157,3 +167,140 @@ def test_convert_markdown_sanitizes_script():
     assert "<table>" in html
 
 
+
+
+def test_call_openai_stream_matches_full_output(tmp_path):
+    from PIL import Image
+    from backend.utils import call_openai_stream
+
+    img = tmp_path / 'img.png'
+    Image.new('RGB', (10, 10), 'red').save(img)
+    deltas = ['| A |', ' B |\n', None, '|---|---|']
+    chunks = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=d))]) for d in deltas
+    ]
+    chunks.append(MagicMock(choices=[]))
+    chat_mock = MagicMock()
+    stream = MagicMock()
+    stream.__iter__.return_value = iter(chunks)
+    chat_mock.completions.create.return_value = stream
+    with patch('backend.utils.openai.chat', chat_mock):
+        parts = list(call_openai_stream(str(img), 'p', img.name))
+    assert ''.join(parts) == '| A | B |\n|---|---|'
+    assert chat_mock.completions.create.call_args.kwargs['stream'] is True
+    stream.close.assert_called_once()
+
+
+def test_markdown_stream_renderer_caches_complete_blocks():
+    from backend.utils import MarkdownStreamRenderer
+
+    md = "|A|B|\n|--|--|\n|1|2|\n\n|C|D|\n|--|--|\n|3|4|"
+    renderer = MarkdownStreamRenderer()
+    with patch('backend.utils.convert_markdown', wraps=convert_markdown) as conv:
+        for end in range(1, len(md) + 1):
+            html = renderer.render(md[:end])
+        first_table_renders = [
+            c for c in conv.call_args_list if c.args[0] == "|A|B|\n|--|--|\n|1|2|"
+        ]
+    assert html == convert_markdown("|A|B|\n|--|--|\n|1|2|") + "\n" + convert_markdown("|C|D|\n|--|--|\n|3|4|")
+    assert html.count('<table>') == 2
+    # Rendered while it was the trailing block and once more when completed
+    assert len(first_table_renders) == 2
+
+
+def test_call_openai_structured_uses_json_schema(tmp_path):
+    from PIL import Image
+    from backend.utils import call_openai_structured, TANK_REPORT_SCHEMA
+
+    img = tmp_path / 'img.png'
+    Image.new('RGB', (10, 10), 'red').save(img)
+    chat_mock = MagicMock()
+    chat_mock.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content='{"tankConditions": {}}'))]
+    )
+    with patch('backend.utils.openai.chat', chat_mock):
+        assert call_openai_structured(str(img)) == '{"tankConditions": {}}'
+    fmt = chat_mock.completions.create.call_args.kwargs['response_format']
+    assert fmt['type'] == 'json_schema'
+    assert fmt['json_schema']['strict'] is True
+    assert fmt['json_schema']['schema'] is TANK_REPORT_SCHEMA
+    tank = TANK_REPORT_SCHEMA['properties']['tankConditions']['properties']['arrival']['items']
+    assert set(tank['required']) == set(tank['properties'])
+
+
+def test_call_openai_applies_image_policy_and_records_metrics(tmp_path):
+    import base64
+    import io
+    from PIL import Image
+
+    img = tmp_path / 'photo.png'
+    Image.new('RGB', (400, 200), 'red').save(img)
+    chat_mock = MagicMock()
+    chat_mock.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content='ok'))],
+        usage=MagicMock(prompt_tokens=120, completion_tokens=7),
+    )
+    metrics = {}
+    with patch('backend.utils.openai.chat', chat_mock), patch(
+        'backend.variants.IMAGE_FORMAT', 'jpeg'
+    ), patch('backend.variants.IMAGE_MAX_EDGE', 100), patch(
+        'backend.variants.IMAGE_DETAIL', 'low'
+    ):
+        assert call_openai(str(img), 'p', img.name, metrics=metrics) == 'ok'
+    image_url = chat_mock.completions.create.call_args.kwargs['messages'][0]['content'][1]['image_url']
+    assert image_url['detail'] == 'low'
+    assert image_url['url'].startswith('data:image/jpeg;base64,')
+    sent = Image.open(io.BytesIO(base64.b64decode(image_url['url'].split(',', 1)[1])))
+    assert sent.size == (100, 50)
+    assert metrics['payload_bytes'] == len(image_url['url'].split(',', 1)[1])
+    assert metrics['image_tokens'] == 85
+    assert metrics['prompt_tokens'] == 120
+    assert metrics['cached'] is False
+    assert metrics['latency_ms'] >= 0
+
+
+def test_chat_completion_records_usage_and_timeout():
+    from backend.utils import chat_completion, LLMStats
+
+    chat_mock = MagicMock()
+    chat_mock.completions.create.return_value = MagicMock(
+        usage=MagicMock(prompt_tokens=10, completion_tokens=3)
+    )
+    stats = LLMStats()
+    metrics = {}
+    with patch('backend.utils.openai.chat', chat_mock), patch('backend.utils.llm_stats', stats):
+        chat_completion({'model': 'm', 'messages': []}, metrics, timeout=7)
+        chat_completion({'model': 'm', 'messages': []})
+    assert chat_mock.completions.create.call_args_list[0].kwargs['timeout'] == 7
+    assert 'timeout' not in chat_mock.completions.create.call_args_list[1].kwargs
+    assert metrics['prompt_tokens'] == 10
+    assert metrics['completion_tokens'] == 3
+    assert stats.stats()['m']['calls'] == 2
+    assert stats.stats()['m']['prompt_tokens'] == 20
+
+
+def test_call_openai_bdr_json_shares_temperature_fallback():
+    from backend.bdr_extractor import call_openai_bdr_json
+
+    error = openai.BadRequestError(
+        message="bad",
+        response=MagicMock(status_code=400, headers={}, request=None),
+        body={"error": {"code": "unsupported_value", "param": "temperature"}},
+    )
+    mock_resp = MagicMock()
+    mock_resp.choices = [MagicMock(message=MagicMock(content='{}'))]
+    chat_mock = MagicMock()
+    chat_mock.completions.create.side_effect = [error, mock_resp]
+    with patch('backend.utils.openai.chat', chat_mock):
+        assert call_openai_bdr_json('tables', 'gpt-4.1-mini') == '{}'
+    assert 'temperature' not in chat_mock.completions.create.call_args_list[1].kwargs
+
+
+def test_openai_client_uses_shared_pool():
+    from backend import utils
+
+    assert openai.http_client is not None
+    assert openai.timeout.connect == utils.OPENAI_CONNECT_TIMEOUT
+    assert openai.timeout.read == utils.OPENAI_READ_TIMEOUT
+    # Retries are done by chat_completion so the limiter sees every 429
+    assert openai.max_retries == 0
@@ -0,0 +1,108 @@
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+import base64
+import io
+import os
+from unittest import mock
+
+from PIL import Image
+
+from backend.variants import VariantStore, upload_max_edge
+
+
+def _image(tmp_path, name='tank.png', color='red'):
+    path = tmp_path / name
+    Image.new('RGB', (10, 20), color).save(path, format='PNG')
+    return str(path)
+
+
+def test_variant_is_preprocessed_and_upload_untouched(tmp_path):
+    path = _image(tmp_path)
+    before = open(path, 'rb').read()
+    store = VariantStore(folder=str(tmp_path / 'variants'))
+    variant = store.get(path, crop_top_fraction=0.5)
+    img = Image.open(io.BytesIO(base64.b64decode(variant.b64)))
+    assert img.mode == 'L'
+    assert img.size == (10, 10)
+    assert variant.data_url.startswith('data:image/png;base64,')
+    assert open(path, 'rb').read() == before
+    assert not os.path.exists(path + '.orig')
+
+
+def test_repeat_calls_skip_pillow(tmp_path):
+    path = _image(tmp_path)
+    folder = str(tmp_path / 'variants')
+    store = VariantStore(folder=folder)
+    first = store.get(path)
+    with mock.patch('backend.variants.Image.open') as img_open:
+        assert store.get(path) == first
+        # A fresh store (e.g. another worker) reads the payload from disk
+        assert VariantStore(folder=folder).get(path) == first
+    img_open.assert_not_called()
+
+
+def test_key_depends_on_content_and_crop(tmp_path):
+    store = VariantStore(folder=str(tmp_path / 'variants'))
+    red = _image(tmp_path, 'a.png')
+    same = _image(tmp_path, 'b.png')
+    blue = _image(tmp_path, 'c.png', 'blue')
+    assert store.get(red).key == store.get(same).key
+    assert store.get(red).key != store.get(blue).key
+    assert store.get(red).key != store.get(red, crop_top_fraction=0.3).key
+
+
+def test_orig_is_used_as_source(tmp_path):
+    path = _image(tmp_path, color='blue')
+    _image(tmp_path, 'tank.png.orig', 'red')
+    store = VariantStore(folder=str(tmp_path / 'variants'))
+    assert store.get(path).key == store.get(str(tmp_path / 'tank.png.orig')).key
+
+
+def test_memory_lru_is_bounded(tmp_path):
+    store = VariantStore(folder=str(tmp_path / 'variants'), max_memory_bytes=1)
+    store.get(_image(tmp_path))
+    assert store._memory_bytes == 0
+    store = VariantStore(folder=str(tmp_path / 'variants'))
+    a = store.get(_image(tmp_path, 'a.png', 'red'))
+    store.max_memory_bytes = len(a.b64) + 1
+    store.get(_image(tmp_path, 'b.png', 'blue'))
+    assert a.key not in store._memory
+    assert store._memory_bytes <= store.max_memory_bytes
+
+
+def test_digest_cache_is_bounded(tmp_path):
+    store = VariantStore(folder=str(tmp_path / 'variants'), max_digests=2)
+    paths = [_image(tmp_path, f'{n}.png') for n in range(3)]
+    store.digest(paths[0])
+    store.digest(paths[1])
+    store.digest(paths[0])
+    store.digest(paths[2])
+    assert [sig[0] for sig in store._digests] == [paths[0], paths[2]]
+
+
+def test_estimate_image_tokens():
+    from backend.variants import estimate_image_tokens
+
+    assert estimate_image_tokens(4000, 3000, 'low') == 85
+    # 4000x3000 -> 2048x1536 -> 1024x768: 2x2 tiles
+    assert estimate_image_tokens(4000, 3000) == 85 + 170 * 4
+    assert estimate_image_tokens(512, 512) == 85 + 170
+
+
+def test_image_policy_per_model_override():
+    from backend import variants
+
+    with mock.patch.object(variants, 'IMAGE_MAX_EDGE_BY_MODEL', 'o3=2048, gpt-4.1-mini=1024'):
+        assert variants.image_policy('gpt-4.1-mini').max_edge == 1024
+        assert variants.image_policy('o3').max_edge == 2048
+        assert variants.image_policy('other').max_edge == variants.IMAGE_MAX_EDGE
+    assert variants.image_policy('other').quality is None
+
+
+def test_upload_max_edge_covers_every_model():
+    with mock.patch('backend.variants.IMAGE_MAX_EDGE', 1024), mock.patch(
+        'backend.variants.IMAGE_MAX_EDGE_BY_MODEL', 'o3=2048,mini=768'
+    ):
+        assert upload_max_edge() == 2048
+    with mock.patch('backend.variants.IMAGE_MAX_EDGE', 0):
+        assert upload_max_edge() is None
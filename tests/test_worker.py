@@ -0,0 +1,157 @@
+import sys, pathlib, time, threading
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+from backend import worker
+
+
+def test_run_batch_preserves_order_and_errors():
+    def work(n):
+        if n == 2:
+            raise ValueError('bad')
+        time.sleep(0.05 * (3 - n))
+        return n * 10
+
+    results = worker.run_batch(work, [(0,), (1,), (2,)], max_in_flight=3)
+    assert results[0] == 0
+    assert results[1] == 10
+    assert isinstance(results[2], ValueError)
+
+
+def test_run_batch_runs_in_parallel_with_cap():
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def work(n):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.2)
+        with lock:
+            active -= 1
+        return n
+
+    start = time.monotonic()
+    results = worker.run_batch(work, [(i,) for i in range(6)], max_in_flight=3)
+    elapsed = time.monotonic() - start
+    assert results == list(range(6))
+    assert peak == 3
+    assert elapsed < 0.6
+
+
+def test_streamed_job_stores_same_output(tmp_path):
+    from unittest.mock import patch
+    from backend.models import init_db, log_request, get_request_statuses
+
+    db_path = str(tmp_path / 'jobs.sqlite')
+    init_db(db_path)
+    req_id = log_request('job', 'img.png', 'ip', 'p', '', status='pending', db_path=db_path)
+    seen = []
+
+    def fake_stream(path, prompt, filename, model=None, crop_top_fraction=None, metrics=None):
+        for part in ['|A|', '\n|--|', '\n|1|']:
+            yield part
+            seen.append(get_request_statuses('job', db_path)[0]['output'])
+
+    with patch('backend.models.DB_PATH', db_path), patch(
+        'backend.worker.STREAM_OUTPUT', True
+    ), patch('backend.worker.STREAM_FLUSH_INTERVAL', 0), patch(
+        'backend.worker.call_openai_stream', side_effect=fake_stream
+    ):
+        worker.process_job_request('job', req_id, 'img.png', 'm')
+
+    row = get_request_statuses('job', db_path)[0]
+    assert seen == ['|A|', '|A|\n|--|', '|A|\n|--|\n|1|']
+    assert row['status'] == 'done'
+    assert row['output'] == '|A|\n|--|\n|1|'
+
+
+def test_structured_mode_fills_output_and_json(tmp_path):
+    import json
+    from unittest.mock import patch
+    from backend.models import init_db, log_request
+    from backend.utils import get_db
+
+    report = {
+        "tankConditions": {
+            "arrival": [{"tank": "1P", "productName": "IFO", "api": 10.0, "ullageFt": 1,
+                         "ullageIn": 2, "tempF": 70.0, "waterBbls": 0, "grossBbls": 5,
+                         "netBbls": 4, "metricTons": 1}],
+            "departure": [],
+        },
+        "productsDischarged": [],
+        "eventTimeline": [],
+        "draftReadings": [],
+    }
+    db_path = str(tmp_path / 'jobs.sqlite')
+    init_db(db_path)
+    req_id = log_request('job', 'img.png', 'ip', 'p', '', status='pending', db_path=db_path)
+    with patch('backend.models.DB_PATH', db_path), patch(
+        'backend.worker.call_openai_structured', return_value=json.dumps(report)
+    ) as call, patch('backend.worker.call_openai') as md_call:
+        worker.process_job_request('job', req_id, 'img.png', 'm', 'structured')
+    assert call.call_count == 1
+    assert not md_call.called
+    with get_db(db_path) as conn:
+        output, json_text, status = conn.execute(
+            'SELECT output, json, status FROM requests'
+        ).fetchone()
+    assert status == 'done'
+    assert '| 1P | IFO | 10 |' in output
+    assert 'VCF' in json.loads(json_text)['tankConditions']['arrival'][0]
+
+
+def test_job_request_stores_call_metrics(tmp_path):
+    import json
+    from unittest.mock import patch
+    from backend.models import init_db, log_request
+    from backend.utils import get_db
+
+    db_path = str(tmp_path / 'jobs.sqlite')
+    init_db(db_path)
+    req_id = log_request('job', 'img.png', 'ip', 'p', '', status='pending', db_path=db_path)
+
+    def fake_call(path, prompt, filename, model=None, crop_top_fraction=None, metrics=None):
+        metrics.update(payload_bytes=1234, image_tokens=765, latency_ms=900)
+        return '|A|'
+
+    with patch('backend.models.DB_PATH', db_path), patch(
+        'backend.worker.call_openai', side_effect=fake_call
+    ):
+        worker.process_job_request('job', req_id, 'img.png', 'm')
+    with get_db(db_path) as conn:
+        metrics = json.loads(conn.execute('SELECT metrics FROM requests').fetchone()[0])
+    assert metrics == {'payload_bytes': 1234, 'image_tokens': 765, 'latency_ms': 900}
+
+
+def test_transient_errors_are_raised_for_the_queue(tmp_path):
+    from unittest.mock import patch
+    import httpx
+    import openai
+    import pytest
+    from backend.models import init_db, log_request, get_request_statuses
+
+    db_path = str(tmp_path / 'jobs.sqlite')
+    init_db(db_path)
+    req_id = log_request('job', 'img.png', 'ip', 'p', '', status='pending', db_path=db_path)
+    timeout = openai.APITimeoutError(httpx.Request('POST', 'https://api.openai.com'))
+    try:
+        raise RuntimeError(f"OpenAI API error: {timeout}") from timeout
+    except RuntimeError as e:
+        transient = e
+
+    with patch('backend.models.DB_PATH', db_path), patch(
+        'backend.worker.call_openai', side_effect=transient
+    ):
+        with pytest.raises(RuntimeError):
+            worker.process_job_request('job', req_id, 'img.png', 'm', raise_transient=True)
+        assert get_request_statuses('job', db_path)[0]['status'] == 'running'
+        # Without the queue the failure is stored as before
+        worker.process_job_request('job', req_id, 'img.png', 'm')
+        assert get_request_statuses('job', db_path)[0]['status'] == 'error'
+
+    with patch('backend.models.DB_PATH', db_path), patch(
+        'backend.worker.call_openai', side_effect=RuntimeError('OpenAI API error: bad image')
+    ):
+        worker.process_job_request('job', req_id, 'img.png', 'm', raise_transient=True)
+    assert get_request_statuses('job', db_path)[0]['output'] == 'OpenAI API error: bad image'